@@ -1,13 +1,37 @@
 """arctool package."""
 
+import warnings
+
 __version__ = "0.13.2"
 
-from jinja2 import ChoiceLoader, PackageLoader
 
-from dtool.utils import JINJA2_ENV
+def jinja2_env():
+    """Return the Jinja2 environment used to render templates.
+
+    This is dtool's environment, so that dtool can also render arctool's
+    templates. Its loaders are set up on first use, rather than on import,
+    to keep importing arctool fast.
+    """
+    from jinja2 import ChoiceLoader, PackageLoader
+    from dtool.utils import JINJA2_ENV
+
+    if not isinstance(JINJA2_ENV.loader, ChoiceLoader):
+        JINJA2_ENV.loader = ChoiceLoader([
+            PackageLoader("dtool", "templates"),
+            PackageLoader("arctool", "templates"),
+        ])
+    return JINJA2_ENV
+
+
+class _DeprecatedJinja2Env(object):
+    """Stand in for the Jinja2 environment, set up when first used."""
+
+    def __getattr__(self, name):
+        warnings.warn("arctool.JINJA2_ENV is deprecated, use "
+                      "arctool.jinja2_env() instead",
+                      DeprecationWarning, stacklevel=2)
+        return getattr(jinja2_env(), name)
 
 
-JINJA2_ENV.loader = ChoiceLoader([
-    PackageLoader("dtool", "templates"),
-    PackageLoader("arctool", "templates"),
-])
+#: Deprecated, use :func:`jinja2_env`.
+JINJA2_ENV = _DeprecatedJinja2Env()
@@ -1,32 +1,264 @@
 """Module wrapping tar and gzip."""
 
+import io
 import os
 import json
-import hashlib
 import subprocess
 import tarfile
+import time
+import threading
+import contextlib
+import collections
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
 
 from dtool import DataSet
+from dtool.filehasher import FileHasher
+
+from arctool.hashing import (
+    BUF_SIZE,
+    DEFAULT_HASH_ALGORITHM,
+    HASH_ALGORITHMS,
+    algorithm_from_manifest,
+    file_hash_function,
+    hash_from_file_object,
+    new_hasher,
+    register_file_hash_functions,
+)
+from arctool.pipeline import HashingPipeline
+from arctool.blocked import (
+    DEFAULT_BLOCK_SIZE,
+    BlockedGzipReader,
+    BlockedGzipWriter,
+    compress_blocks,
+)
+from arctool.checkpoint import (
+    DEFAULT_CHECKPOINT_INTERVAL,
+    CheckpointJournal,
+    checkpoint_path,
+    read_checkpoint,
+)
+from arctool.index import (
+    DEFAULT_SPAN,
+    IndexMismatchError,
+    build_index,
+    index_path,
+    open_from,
+    open_member,
+    read_index,
+    write_index,
+)
+from arctool.volumes import (
+    is_volume_index,
+    read_volume_index,
+    volume_index_path,
+    volume_path,
+    write_volume_index,
+)
+from arctool.manifest import (
+    CompactManifest,
+    compact_manifest_path,
+    iter_manifest_entries,
+    read_compact_manifest,
+    read_manifest_stream,
+)
+from arctool.dedup import DEDUP_KEY, DEFAULT_MIN_SIZE
+from arctool.incremental import (
+    INCREMENTAL_KEY,
+    diff_manifests,
+    incremental_name,
+    incremental_reference,
+)
+from arctool.journal import (
+    VerificationJournal,
+    read_journal,
+    record_passed,
+    verification_record,
+)
+
+# So that dtool can read manifests made with any of the hash algorithms.
+register_file_hash_functions()
+
+#: Size of the write buffer used for tar files, a whole number of records.
+TAR_WRITE_BUFFER_SIZE = 400 * tarfile.RECORDSIZE
+
+# Upper bound on the end of archive marker and padding to a whole record.
+_TAR_END_SIZE = 2 * tarfile.BLOCKSIZE + tarfile.RECORDSIZE
 
 
 def shasum_from_file_object(f):
 
-    BUF_SIZE = 65536
-    hasher = hashlib.sha1()
-    buf = f.read(BUF_SIZE)
-    while len(buf) > 0:
-        hasher.update(buf)
-        buf = f.read(BUF_SIZE)
+    return hash_from_file_object(f, "sha1")
+
+
+class ArchiveManifestError(ValueError):
+    """Raised when the data of an archive does not match its manifest."""
+
+
+class _HashingReader(object):
+    """File like object hashing the data as it is read."""
+
+    def __init__(self, fileobj, algorithm=DEFAULT_HASH_ALGORITHM):
+        self._fileobj = fileobj
+        self._hasher = new_hasher(algorithm)
+
+    def read(self, size=-1):
+        buf = self._fileobj.read(size)
+        self._hasher.update(buf)
+        return buf
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+class _ProgressReader(object):
+    """File like object reporting the number of bytes read to a callback.
+
+    See :mod:`arctool.progress`.
+    """
 
-    return hasher.hexdigest()
+    def __init__(self, fileobj, progress, name=None):
+        self._fileobj = fileobj
+        self._progress = progress
+        self._name = name
+
+    def read(self, size=-1):
+        buf = self._fileobj.read(size)
+        self._progress(len(buf), self._name)
+        return buf
+
+
+def _entry_matches_stat(entry, stat):
+    """Return True if a manifest entry is up to date with the file's stat."""
+    return (entry.get('size') == stat.st_size
+            and entry.get('mtime') == stat.st_mtime
+            and entry.get('inode') == stat.st_ino)
+
+
+def _remove_sidecars(archive_path):
+    """Remove the index and compact manifest files of an archive.
+
+    They describe the archive as it was, and are removed whenever it is
+    written again.
+    """
+    for path in (index_path(archive_path),
+                 compact_manifest_path(archive_path)):
+        if os.path.isfile(path):
+            os.remove(path)
 
 
 class ArchiveDataSet(DataSet):
     """Class for creating specific archive datasets."""
 
-    def __init__(self, name):
+    def __init__(self, name, hash_algorithm=DEFAULT_HASH_ALGORITHM):
         super(ArchiveDataSet, self).__init__(name=name,
                                              data_directory="archive")
+        file_hash_function(hash_algorithm)
+        self._admin_metadata["hash_algorithm"] = hash_algorithm
+
+    @property
+    def hash_algorithm(self):
+        """Return the name of the hash algorithm used in the manifest."""
+        if "hash_algorithm" in self._admin_metadata:
+            return self._admin_metadata["hash_algorithm"]
+        return algorithm_from_manifest(self.manifest)
+
+    def persist_to_path(self, path):
+        """Mark up a directory as an archive dataset.
+
+        See :meth:`dtool.DataSet.persist_to_path`; the manifest uses the
+        dataset's hash algorithm.
+        """
+        super(ArchiveDataSet, self).persist_to_path(
+            path, hash_function=file_hash_function(self.hash_algorithm))
+
+    def set_hash_algorithm(self, hash_algorithm):
+        """Change the hash algorithm of a persisted dataset.
+
+        The existing manifest entries are discarded, so that all files are
+        rehashed by the next :meth:`update_manifest`.
+
+        :param hash_algorithm: name of the hash algorithm
+        :raises: ValueError if the algorithm is not available
+        """
+        hash_function = file_hash_function(hash_algorithm)
+        self._admin_metadata["hash_algorithm"] = hash_algorithm
+        dtool_file_path = os.path.join(self._abs_path, '.dtool', 'dtool')
+        with open(dtool_file_path, 'w') as fh:
+            json.dump(self._admin_metadata, fh)
+
+        manifest = self._structural_metadata
+        manifest.hash_generator = FileHasher(hash_function)
+        manifest["hash_function"] = manifest.hash_generator.name
+        manifest["file_list"] = []
+
+    def update_manifest(self, full=False, n_workers=1):
+        """Update the manifest, only hashing new or changed files.
+
+        Files whose size, mtime and inode match their entry in the existing
+        manifest keep that entry. Does nothing if dataset is not persisted.
+
+        Files are hashed by a pool of n_workers threads, largest first so
+        that the largest file does not end up being hashed on its own at
+        the end. The entries are in the same order as when hashing serially.
+
+        :param full: regenerate all entries, rehashing every file
+        :param n_workers: number of hashing threads
+        :returns: number of bytes hashed
+        """
+
+        if not self._abs_path:
+            return 0
+
+        manifest = self._structural_metadata
+
+        existing_entries = {}
+        if not full:
+            existing_entries = {entry['path']: entry
+                                for entry in manifest['file_list']}
+
+        file_list = []
+        to_hash = []
+        for rel_path in manifest._generate_relative_paths():
+            abs_path = os.path.join(manifest.abs_manifest_root, rel_path)
+            stat = os.stat(abs_path)
+            entry = existing_entries.get(rel_path)
+            if entry is None or not _entry_matches_stat(entry, stat):
+                to_hash.append((len(file_list), rel_path, abs_path, stat))
+                entry = None
+            file_list.append(entry)
+
+        def file_metadata(item):
+            i, rel_path, abs_path, stat = item
+            entry = manifest._file_metadata(abs_path)
+            entry['path'] = rel_path
+            entry['inode'] = stat.st_ino
+            return i, entry
+
+        to_hash.sort(key=lambda item: item[3].st_size, reverse=True)
+        if n_workers > 1:
+            pool = ThreadPool(n_workers)
+            try:
+                entries = pool.map(file_metadata, to_hash, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            entries = [file_metadata(item) for item in to_hash]
+
+        for i, entry in entries:
+            file_list[i] = entry
+
+        manifest['file_list'] = file_list
+        manifest.persist_to_path(self._abs_manifest_path)
+
+        return sum(item[3].st_size for item in to_hash)
 
 
 class _ArchiveFileBase(object):
@@ -54,38 +286,698 @@ class ArchiveFileBuilder(_ArchiveFileBase):
         archive_builder._archive_dataset = ArchiveDataSet.from_path(path)
         return archive_builder
 
-    def initialise_tar(self, path):
-        path = os.path.abspath(path)
+    def _set_tar_path(self, path):
         self._tar_path = os.path.join(
-            path, self._archive_dataset.name + ".tar")
-        working_dir, dataset_dir = os.path.split(
-            self._archive_dataset._abs_path)
-
-        headers_with_path = [os.path.join(dataset_dir, hf)
-                             for hf in ArchiveFile.header_file_order]
+            os.path.abspath(path), self._archive_dataset.name + ".tar")
 
-        cmd = ["tar", "-cf", self._tar_path] + headers_with_path
-        subprocess.call(cmd, cwd=working_dir)
+    def initialise_tar(self, path):
+        """Create tarball containing only the header files."""
+        self._set_tar_path(path)
+        _remove_sidecars(self._tar_path)
+        with tarfile.open(self._tar_path, 'w',
+                          format=tarfile.GNU_FORMAT) as tar:
+            for abs_path, arcname, _ in self._iter_tar_entries(data=False):
+                tar.add(abs_path, arcname)
 
     def append_to_tar(self, path):
-        path = os.path.abspath(path)
-        working_dir, dataset_dir = os.path.split(
-            self._archive_dataset._abs_path)
-        archive_dir_rel_path = os.path.join(
-            dataset_dir, self._archive_dataset.data_directory)
-        cmd = ["tar", "-rf", self._tar_path, archive_dir_rel_path]
-        subprocess.call(cmd, cwd=working_dir)
+        """Append the data directory to the tarball.
 
-    def persist_to_tar(self, path):
-        """Write archive dataset to tarball."""
+        Prefer :meth:`persist_to_tar`, which writes the whole tarball in one
+        pass rather than scanning to the end of the existing tarball.
+        """
+        _remove_sidecars(self._tar_path)
+        with tarfile.open(self._tar_path, 'a',
+                          format=tarfile.GNU_FORMAT) as tar:
+            for abs_path, arcname, _ in self._iter_tar_entries(headers=False):
+                tar.add(abs_path, arcname, recursive=False)
+
+    def persist_to_tar(self, path, progress=None, resume=False,
+                       checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Write archive dataset to tarball.
+
+        The header files and the data directory are written in one pass,
+        through a large write buffer, and the index is written from the
+        offsets recorded on the way.
+
+        A checkpoint is recorded every checkpoint_interval bytes, see
+        :mod:`arctool.checkpoint`. If writing fails after a checkpoint, the
+        partial tarball is kept so that it can be resumed.
+
+        :param path: directory to write the tarball to
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param resume: continue from the last checkpoint of an interrupted
+                       run, if there is one
+        :param checkpoint_interval: uncompressed bytes between checkpoints,
+                                    0 or None for no checkpoints
+        :returns: path to created tarball
+        """
 
         self._archive_dataset.update_manifest()
-        self.initialise_tar(path)
-        self.append_to_tar(path)
+        self._set_tar_path(path)
+
+        self._persist(self._tar_path,
+                      compress=False,
+                      progress=progress,
+                      resume=resume,
+                      checkpoint_interval=checkpoint_interval)
+
+        return self._tar_path
+
+    def _iter_tar_entries(self, headers=True, data=True):
+        """Yield (absolute path, name in tar, manifest path) tuples.
+
+        The header files come first, in :attr:`header_file_order`, followed
+        by the data directory, walked in sorted order. The manifest path is
+        None for anything other than data files.
+
+        :param headers: include the header files
+        :param data: include the data directory
+        """
+        dataset = self._archive_dataset
+        working_dir, dataset_dir = os.path.split(dataset._abs_path)
+
+        if headers:
+            for hf in self.header_file_order:
+                yield (os.path.join(dataset._abs_path, hf),
+                       os.path.join(dataset_dir, hf),
+                       None)
+
+        if not data:
+            return
+
+        abs_data_dir = os.path.join(dataset._abs_path, dataset.data_directory)
+        for dirpath, dirnames, filenames in os.walk(abs_data_dir):
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, abs_data_dir)
+            yield (dirpath,
+                   os.path.normpath(os.path.join(
+                       dataset_dir, dataset.data_directory, rel_dir)),
+                   None)
+            for filename in sorted(filenames):
+                rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+                yield (os.path.join(dirpath, filename),
+                       os.path.join(dataset_dir, dataset.data_directory,
+                                    rel_path),
+                       rel_path)
+
+    def _write_tar(self, fileobj, check_hashes=False, progress=None,
+                   checkpoint=None,
+                   checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                   resume_state=None, entries=None, contents=None):
+        """Write the archive dataset as a tar stream to a file object.
+
+        :param fileobj: file object to write the tar stream to, which must
+                        support tell
+        :param check_hashes: hash the data files as they are written and
+                             check them against the existing manifest
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param checkpoint: callable called with the index entries written
+                           since the previous checkpoint and the state to
+                           resume from, every checkpoint_interval bytes
+        :param checkpoint_interval: uncompressed bytes between checkpoints
+        :param resume_state: state of the checkpoint to resume from, with
+                             the index entries written before it; the file
+                             object must be positioned at its offset
+        :param entries: list of entries, as yielded by
+                        :meth:`_iter_tar_entries`, to write rather than the
+                        whole dataset; only their hashes are checked
+        :param contents: dictionary of the bytes to write, by name in tar,
+                         in place of the contents of the files
+        :raises: ArchiveManifestError if the hashes are checked and the data
+                 does not match the manifest
+        :raises: ValueError if the dataset does not match the checkpoint
+        :returns: list of index entries for the files written
+        """
+        file_list = self._archive_dataset.manifest["file_list"]
+        hash_by_path = {entry['path']: entry['hash'] for entry in file_list}
+        if entries is None:
+            entries = self._iter_tar_entries()
+        else:
+            in_entries = set(manifest_path for _, _, manifest_path in entries)
+            hash_by_path = {path: hash_by_path[path] for path in hash_by_path
+                            if path in in_entries}
+        hash_algorithm = self._archive_dataset.hash_algorithm
+        contents = contents or {}
+        state = resume_state or {}
+        members = list(state.get('members', []))
+        mismatched = list(state.get('mismatched', []))
+        n_skip = state.get('n_entries', 0)
+        n_checkpointed = len(members)
+        n_entries = 0
+
+        with tarfile.open(fileobj=fileobj, mode='w',
+                          format=tarfile.GNU_FORMAT) as tar:
+            last_checkpoint = tar.offset
+            for abs_path, arcname, manifest_path in entries:
+                n_entries += 1
+                if n_entries <= n_skip:
+                    # Written, and checked, before the checkpoint.
+                    hash_by_path.pop(manifest_path, None)
+                    if n_entries == n_skip and arcname != state['last_entry']:
+                        raise ValueError(
+                            "Dataset has changed since the checkpoint")
+                    continue
+
+                tarinfo = tar.gettarinfo(abs_path, arcname)
+                if not tarinfo.isfile():
+                    tar.addfile(tarinfo)
+                else:
+                    offset = tar.offset
+                    if arcname in contents:
+                        tarinfo.size = len(contents[arcname])
+                        opened = io.BytesIO(contents[arcname])
+                    else:
+                        opened = open(abs_path, 'rb')
+                    with opened as fh:
+                        if progress is not None:
+                            fh = _ProgressReader(fh, progress,
+                                                 manifest_path or arcname)
+                        if check_hashes and manifest_path is not None:
+                            hashing_fh = _HashingReader(fh, hash_algorithm)
+                            tar.addfile(tarinfo, hashing_fh)
+                            expected = hash_by_path.pop(manifest_path, None)
+                            if hashing_fh.hexdigest() != expected:
+                                mismatched.append(manifest_path)
+                        else:
+                            tar.addfile(tarinfo, fh)
+
+                    offset_data = tar.offset - _padded_size(tarinfo.size)
+                    members.append({'path': arcname,
+                                    'offset': offset,
+                                    'offset_data': offset_data,
+                                    'size': tarinfo.size})
+
+                since_checkpoint = tar.offset - last_checkpoint
+                if checkpoint is not None \
+                        and since_checkpoint >= checkpoint_interval:
+                    checkpoint(members[n_checkpointed:],
+                               {'offset': tar.offset,
+                                'n_entries': n_entries,
+                                'last_entry': arcname,
+                                'mismatched': mismatched})
+                    n_checkpointed = len(members)
+                    last_checkpoint = tar.offset
+
+            if n_entries < n_skip:
+                raise ValueError("Dataset has changed since the checkpoint")
+
+        if check_hashes:
+            mismatched.extend(sorted(hash_by_path))
+            if mismatched:
+                raise ArchiveManifestError(
+                    "Files do not match the manifest: {}".format(
+                        ", ".join(mismatched)))
+
+        return members
+
+    def _persist(self, output_path, compress, n_threads=8, blocked=False,
+                 block_size=DEFAULT_BLOCK_SIZE, progress=None, resume=False,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 entries=None, contents=None):
+        """Write the tar stream to a file, recording checkpoints, and index it.
+
+        Compressed output has its hashes checked against the manifest, see
+        :meth:`persist_to_tar_gz`.
+
+        :param output_path: path to the file to write
+        :param compress: gzip the tar stream
+        :param entries: entries to write, rather than the whole dataset
+        :param contents: bytes to write in place of the contents of files
+        """
+        if compress and not blocked and which('pigz') is None:
+            blocked = True
+
+        def make_writer(fh_out, state):
+            if not compress:
+                return fh_out
+            compressed_offset, uncompressed_offset = 0, 0
+            if state is not None:
+                compressed_offset = state['compressed_offset']
+                uncompressed_offset = state['offset']
+            if blocked:
+                return BlockedGzipWriter(
+                    fh_out, block_size=block_size, n_threads=n_threads,
+                    compressed_offset=compressed_offset,
+                    uncompressed_offset=uncompressed_offset)
+            return _PigzWriter(fh_out, n_threads,
+                               uncompressed_offset=uncompressed_offset)
+
+        checkpointed = None
+        if resume and os.path.isfile(output_path):
+            checkpointed = read_checkpoint(output_path)
+
+        members, seek_points, state = [], [], None
+        if checkpointed is not None:
+            members, seek_points, state = checkpointed
+            state['members'] = members
+
+        journal = None
+        if checkpoint_interval:
+            journal = CheckpointJournal(output_path, append=state is not None)
+
+        # The index is written again once the archive is complete.
+        _remove_sidecars(output_path)
+
+        try:
+            with open(output_path, 'r+b' if state else 'wb',
+                      buffering=TAR_WRITE_BUFFER_SIZE) as fh_out:
+                if state is not None:
+                    fh_out.seek(state['compressed_offset'])
+                    fh_out.truncate()
+                writer = make_writer(fh_out, state)
+                n_points = [0]
+
+                def checkpoint(new_members, new_state):
+                    writer.flush()
+                    fh_out.flush()
+                    os.fsync(fh_out.fileno())
+                    new_state['compressed_offset'] = fh_out.tell()
+                    new_points = _seek_points(writer)[n_points[0]:]
+                    n_points[0] += len(new_points)
+                    journal.append(new_members, new_points, new_state)
+
+                try:
+                    members = self._write_tar(
+                        writer,
+                        check_hashes=compress,
+                        progress=progress,
+                        checkpoint=checkpoint if journal else None,
+                        checkpoint_interval=checkpoint_interval,
+                        resume_state=state,
+                        entries=entries,
+                        contents=contents)
+                finally:
+                    writer.close()
+        except ArchiveManifestError:
+            os.remove(output_path)
+            if journal is not None:
+                journal.remove()
+            raise
+        except Exception:
+            if journal is None:
+                os.remove(output_path)
+            else:
+                journal.close()
+                if not (journal.n_checkpoints or state):
+                    os.remove(output_path)
+                    os.remove(journal.path)
+            raise
+
+        if journal is not None:
+            journal.remove()
+
+        index = {'members': members,
+                 'seek_points': seek_points + _seek_points(writer)}
+        if compress and blocked:
+            index['block_size'] = block_size
+        write_index(output_path, index)
+
+    def persist_to_tar_gz(self, path, n_threads=8, blocked=False,
+                          block_size=DEFAULT_BLOCK_SIZE, progress=None,
+                          resume=False,
+                          checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Write archive dataset to a compressed tarball in a single pass.
+
+        The data is read once: each file is hashed as it is written to the
+        tar stream, which is piped straight into a parallel compressor. The
+        hashes are checked against the existing manifest rather than the
+        manifest being regenerated. The compressor is pigz, unless blocked
+        is True or pigz is not available, in which case the output is block
+        compressed, see :func:`compress_archive_blocked`.
+
+        Checkpoints are recorded as for :meth:`persist_to_tar`. The
+        compressed output is ended at each checkpoint and continued in a new
+        gzip member, so that it can be resumed from there.
+
+        :param path: directory to write the tarball to
+        :param n_threads: number of compression threads
+        :param blocked: write block compressed output
+        :param block_size: number of uncompressed bytes per block
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param resume: continue from the last checkpoint of an interrupted
+                       run, if there is one
+        :param checkpoint_interval: uncompressed bytes between checkpoints,
+                                    0 or None for no checkpoints
+        :raises: ArchiveManifestError if the data does not match the manifest
+        :returns: path to created gzip file
+        """
+        path = os.path.abspath(path)
+        gzip_path = os.path.join(
+            path, self._archive_dataset.name + ".tar.gz")
+
+        self._persist(gzip_path,
+                      compress=True,
+                      n_threads=n_threads,
+                      blocked=blocked,
+                      block_size=block_size,
+                      progress=progress,
+                      resume=resume,
+                      checkpoint_interval=checkpoint_interval)
+
+        self._tar_path = gzip_path
+        return gzip_path
+
+    def persist_incremental(self, path, base_path, compress=False,
+                            n_threads=8, blocked=False,
+                            block_size=DEFAULT_BLOCK_SIZE, progress=None,
+                            resume=False,
+                            checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Write the files that changed since a base archive to a tarball.
+
+        Only the files that are new, or whose hash differs from the base
+        archive, are written, with the header files. The archived manifest is
+        the whole manifest of the dataset, referencing the base archive, see
+        :mod:`arctool.incremental`. The tarball is named after the dataset
+        and its manifest, see :func:`arctool.incremental.incremental_name`.
+
+        The tarball is written as by :meth:`persist_to_tar` or, if compress
+        is True, :meth:`persist_to_tar_gz`.
+
+        :param path: directory to write the tarball to
+        :param base_path: path to the base archive
+        :param compress: write a gzipped tarball
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param resume: continue from the last checkpoint of an interrupted
+                       run, if there is one
+        :raises: ValueError if the base is an archive of another dataset
+        :raises: ArchiveManifestError if compressing and the data does not
+                 match the manifest
+        :returns: path to created tarball
+        """
+        dataset = self._archive_dataset
+        if not compress:
+            dataset.update_manifest()
+
+        base = ArchiveFile.from_file(base_path)
+        if base.admin_metadata['uuid'] != dataset.uuid:
+            raise ValueError("{} is not an archive of {}".format(
+                base_path, dataset.name))
+        diff = diff_manifests(base.dataset_manifest, dataset.manifest)
+        reference = incremental_reference(base, base_path, diff)
+
+        manifest = dict(dataset.manifest)
+        manifest[INCREMENTAL_KEY] = reference
+
+        suffix = ".tar.gz" if compress else ".tar"
+        output_path = os.path.join(
+            os.path.abspath(path),
+            incremental_name(dataset.name, dataset.manifest) + suffix)
+        self._persist_files(output_path, set(reference['paths']), manifest,
+                            compress=compress,
+                            n_threads=n_threads,
+                            blocked=blocked,
+                            block_size=block_size,
+                            progress=progress,
+                            resume=resume,
+                            checkpoint_interval=checkpoint_interval)
+
+        self._tar_path = output_path
+        return output_path
+
+    def persist_deduplicated(self, path, store, compress=False, n_threads=8,
+                             blocked=False, block_size=DEFAULT_BLOCK_SIZE,
+                             progress=None, resume=False,
+                             checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                             min_size=DEFAULT_MIN_SIZE):
+        """Write archive dataset to a tarball, referencing stored files.
+
+        Files already stored in an archive in the dedup store, with the same
+        hash and size, are not written; the archived manifest is the whole
+        manifest of the dataset, with references to where they are stored,
+        see :mod:`arctool.dedup`. The new archive is then added to the store.
+
+        The tarball is written as by :meth:`persist_to_tar` or, if compress
+        is True, :meth:`persist_to_tar_gz`.
+
+        :param path: directory to write the tarball to
+        :param store: :class:`arctool.dedup.DedupStore`
+        :param compress: write a gzipped tarball
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param resume: continue from the last checkpoint of an interrupted
+                       run, if there is one
+        :param min_size: smallest file to reference rather than write
+        :raises: ArchiveManifestError if compressing and the data does not
+                 match the manifest
+        :returns: path to created tarball
+        """
+        dataset = self._archive_dataset
+        if not compress:
+            dataset.update_manifest()
+
+        suffix = ".tar.gz" if compress else ".tar"
+        output_path = os.path.join(os.path.abspath(path),
+                                   dataset.name + suffix)
+
+        references = store.find_references(dataset.hash_algorithm,
+                                           dataset.manifest,
+                                           min_size=min_size,
+                                           exclude=output_path)
+        file_list = dataset.manifest['file_list']
+        manifest = dict(dataset.manifest)
+        manifest[DEDUP_KEY] = {
+            'references': references,
+            'bytes_saved': sum(entry['size'] for entry in file_list
+                               if entry['path'] in references)}
+
+        self._persist_files(output_path,
+                            set(entry['path'] for entry in file_list
+                                if entry['path'] not in references),
+                            manifest,
+                            compress=compress,
+                            n_threads=n_threads,
+                            blocked=blocked,
+                            block_size=block_size,
+                            progress=progress,
+                            resume=resume,
+                            checkpoint_interval=checkpoint_interval)
+
+        store.add_archive(ArchiveFile.from_file(output_path), output_path)
+
+        self._tar_path = output_path
+        return output_path
+
+    def _persist_files(self, output_path, paths, manifest, **kwargs):
+        """Write some of the data files, with the header files, to a file.
+
+        :param output_path: path to the file to write
+        :param paths: set of the manifest paths of the files to write
+        :param manifest: manifest to archive in place of the dataset's
+        :param kwargs: keyword arguments passed on to :meth:`_persist`
+        """
+        dataset = self._archive_dataset
+        entries = [entry for entry in self._iter_tar_entries()
+                   if entry[2] is None or entry[2] in paths]
+
+        _, dataset_dir = os.path.split(dataset._abs_path)
+        manifest_arcname = os.path.join(
+            dataset_dir, dataset._admin_metadata['manifest_path'])
+        contents = {manifest_arcname: json.dumps(
+            manifest, indent=2, sort_keys=True).encode('utf-8')}
+
+        self._persist(output_path, entries=entries, contents=contents,
+                      **kwargs)
+
+    def _plan_volumes(self, max_volume_size):
+        """Return list of the entries to write to each volume.
+
+        Each volume starts with the header files. Entries are added in order
+        until the next file would take the volume over max_volume_size bytes
+        of tar; a file bigger than that is written to a volume of its own.
+        Directories are never the reason for starting a new volume.
+        """
+        headers = list(self._iter_tar_entries(data=False))
+        header_size = _TAR_END_SIZE + sum(
+            _tar_entry_size(abs_path, arcname)
+            for abs_path, arcname, _ in headers)
+
+        volumes = []
+        entries, size, has_files = list(headers), header_size, False
+        for entry in self._iter_tar_entries(headers=False):
+            entry_size = _tar_entry_size(entry[0], entry[1])
+            is_file = entry[2] is not None
+            if is_file and has_files \
+                    and size + entry_size > max_volume_size:
+                volumes.append(entries)
+                entries, size, has_files = list(headers), header_size, False
+            entries.append(entry)
+            size += entry_size
+            has_files = has_files or is_file
+        volumes.append(entries)
+
+        return volumes
+
+    def persist_to_volumes(self, path, max_volume_size, compress=False,
+                           n_threads=8, blocked=False,
+                           block_size=DEFAULT_BLOCK_SIZE, progress=None,
+                           resume=False,
+                           checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Write archive dataset to several tarballs of limited size.
+
+        Each volume is a complete tarball, with the header files, and is
+        written as by :meth:`persist_to_tar` or, if compress is True,
+        :meth:`persist_to_tar_gz`. See :mod:`arctool.volumes`.
+
+        The size limit applies to the uncompressed tar data of each volume.
+        When resuming, volumes that were completed are not written again.
+
+        :param path: directory to write the volumes to
+        :param max_volume_size: maximum number of bytes of tar per volume,
+                                unless a single file is bigger
+        :param compress: write gzipped volumes
+        :param progress: callable called with the number of bytes of file
+                         data written, and the file, as they are written
+        :param resume: continue from the last checkpoint of an interrupted
+                       run, if there is one
+        :raises: ArchiveManifestError if compressing and the data does not
+                 match the manifest
+        :returns: path to the volume index
+        """
+        path = os.path.abspath(path)
+        name = self._archive_dataset.name
+        suffix = ".tar.gz" if compress else ".tar"
+
+        if not compress:
+            self._archive_dataset.update_manifest()
+
+        plan = self._plan_volumes(max_volume_size)
+
+        planned = set(manifest_path for entries in plan
+                      for _, _, manifest_path in entries)
+        missing = sorted(entry['path'] for entry
+                         in self._archive_dataset.manifest['file_list']
+                         if entry['path'] not in planned)
+        if missing:
+            raise ArchiveManifestError(
+                "Files do not match the manifest: {}".format(
+                    ", ".join(missing)))
+
+        volumes = []
+        for number, entries in enumerate(plan, 1):
+            output_path = volume_path(path, name, number, suffix)
+            completed = read_index(output_path) is not None \
+                and not os.path.isfile(checkpoint_path(output_path))
+            if not (resume and completed):
+                self._persist(output_path,
+                              compress=compress,
+                              n_threads=n_threads,
+                              blocked=blocked,
+                              block_size=block_size,
+                              progress=progress,
+                              resume=resume,
+                              checkpoint_interval=checkpoint_interval,
+                              entries=entries)
+            volumes.append({
+                'path': os.path.basename(output_path),
+                'members': [manifest_path for _, _, manifest_path in entries
+                            if manifest_path is not None]})
+
+        self._tar_path = volume_index_path(path, name)
+        write_volume_index(self._tar_path, {'name': name,
+                                            'max_volume_size': max_volume_size,
+                                            'volumes': volumes})
 
         return self._tar_path
 
 
+def _entries_by_path(manifest):
+    """Return mapping of the entries of a manifest by path."""
+    if isinstance(manifest, CompactManifest):
+        return manifest.entries_by_path()
+    return {entry['path']: entry for entry in manifest['file_list']}
+
+
+def _select_entries(manifest, paths):
+    """Return copy of a manifest with only the entries with a path in paths.
+    """
+    if isinstance(manifest, CompactManifest):
+        return manifest.select(paths)
+    return dict(manifest,
+                file_list=[entry for entry in manifest['file_list']
+                           if entry['path'] in paths])
+
+
+def _tar_entry_size(abs_path, arcname):
+    """Return upper bound on the bytes of tar taken by a file or directory.
+    """
+    size = tarfile.BLOCKSIZE
+    name_length = len(arcname.encode('utf-8')) + 1
+    if name_length > tarfile.LENGTH_NAME:
+        # GNU long name header and the name itself.
+        size += tarfile.BLOCKSIZE + _padded_size(name_length)
+    if os.path.isfile(abs_path) and not os.path.islink(abs_path):
+        size += _padded_size(os.path.getsize(abs_path))
+    return size
+
+
+def _padded_size(size):
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def _seek_points(writer):
+    """Return seek points recorded by a compressing writer.
+
+    Plain files have none.
+    """
+    return getattr(writer, 'seek_points', [])
+
+
+class _PigzWriter(object):
+    """File like object compressing the data written to it with pigz.
+
+    Each call to :meth:`flush` ends the gzip member being written, the next
+    write starts a new one. The start of each member is a seek point.
+
+    :param fh_out: file object to write compressed data to
+    :param n_threads: number of threads for pigz to use
+    :param uncompressed_offset: uncompressed offset of the data written
+    """
+
+    def __init__(self, fh_out, n_threads, uncompressed_offset=0):
+        self._fh_out = fh_out
+        self._n_threads = n_threads
+        self._offset = uncompressed_offset
+        self._process = None
+        self.seek_points = []
+
+    def _start(self):
+        self._fh_out.flush()
+        self.seek_points.append({'compressed_offset': self._fh_out.tell(),
+                                 'uncompressed_offset': self._offset,
+                                 'window': None})
+        self._process = subprocess.Popen(
+            ['pigz', '-p', str(self._n_threads), '-c'],
+            stdin=subprocess.PIPE,
+            stdout=self._fh_out)
+
+    def write(self, data):
+        if self._process is None:
+            self._start()
+        self._process.stdin.write(data)
+        self._offset += len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        """End the gzip member being written."""
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        process.stdin.close()
+        process.wait()
+        if process.returncode != 0:
+            raise IOError("pigz failed with exit code {}".format(
+                process.returncode))
+
+    def close(self):
+        self.flush()
+
+
 class ArchiveFile(_ArchiveFileBase):
     """Class for working with tarred/gzipped archive datasets.
 
@@ -96,10 +988,47 @@ class ArchiveFile(_ArchiveFileBase):
     def __init__(self):
         self._name = None
         self._tar_path = None
+        self._use_pigz = True
+        self._compact = False
+        self.buf_size = BUF_SIZE
+        self._index = None
+        self._index_members = None
+        self._admin_metadata = None
+        self._manifest = None
+        self._dataset_manifest = None
+        self._descriptive_metadata = None
+        # Archives holding referenced files, by path.
+        self._referenced_archives = {}
+        # Lookups built from the manifest, and the manifest they were built
+        # from, so that they are rebuilt if the manifest is replaced. The
+        # manifest is read from the archive, and not expected to be modified
+        # in place.
+        self._cached_manifest = None
+        self._entries_by_path = None
+        self._summary = None
+
+    def _open_tar_stream(self, offset=0):
+        if offset and self._index is not None:
+            try:
+                fh = open_from(self._tar_path, self._index, offset)
+            except IndexMismatchError:
+                self._drop_index()
+            else:
+                return self._open_tar_stream_from(fh)
+        return open_tar_stream(self._tar_path, use_pigz=self._use_pigz)
+
+    @contextlib.contextmanager
+    def _open_tar_stream_from(self, fh):
+        """Yield tar stream reading from a member at an offset in the index.
+        """
+        try:
+            with tarfile.open(fileobj=fh, mode='r|') as tar:
+                yield tar
+        finally:
+            fh.close()
 
     def _extract_file_contents(self, file_path):
-        with tarfile.open(self._tar_path, 'r:*') as tar:
-            fp = tar.extractfile(file_path)
+        with self._open_member(file_path) as fp:
             contents = fp.read()
 
         return contents
@@ -119,31 +1048,250 @@ class ArchiveFile(_ArchiveFileBase):
 
         return self._manifest
 
+    @property
+    def dataset_manifest(self):
+        """Return manifest of the whole dataset.
+
+        This is the :attr:`manifest` unless the archive is incremental, in
+        which case the manifest lists only the files in the archive.
+        """
+        if self._dataset_manifest is not None:
+            return self._dataset_manifest
+        return self._manifest
+
+    @property
+    def incremental(self):
+        """Return the reference to the base of an incremental archive.
+
+        See :mod:`arctool.incremental`. None if the archive is not
+        incremental.
+        """
+        return self.dataset_manifest.get(INCREMENTAL_KEY)
+
+    @property
+    def references(self):
+        """Return dictionary of the references to files stored elsewhere.
+
+        See :mod:`arctool.dedup`. Empty if the archive is not deduplicated.
+        """
+        return self.dataset_manifest.get(DEDUP_KEY, {}).get('references', {})
+
+    @property
+    def descriptive_metadata(self):
+
+        return self._descriptive_metadata
+
+    @property
+    def hash_algorithm(self):
+        """Return the name of the hash algorithm used in the manifest."""
+        if "hash_algorithm" in self.admin_metadata:
+            return self.admin_metadata["hash_algorithm"]
+        return algorithm_from_manifest(self.manifest)
+
+    def _hash_file_object(self, fp):
+        return hash_from_file_object(fp, self.hash_algorithm, self.buf_size)
+
+    def _check_manifest_cache(self):
+        if self._cached_manifest is not self._manifest:
+            self._cached_manifest = self._manifest
+            self._entries_by_path = None
+            self._summary = None
+
+    def _manifest_entries(self):
+        """Return dictionary of the manifest entries by path, built once."""
+        self._check_manifest_cache()
+        if self._entries_by_path is None:
+            self._entries_by_path = _entries_by_path(self.manifest)
+        return self._entries_by_path
+
+    def _read_header(self, tar):
+        """Parse the header files at the start of the tar stream.
+
+        Stops reading as soon as the admin metadata, manifest and README have
+        been found, which the builder guarantees to be the first members.
+        """
+        first_member = tar.next()
+        self._name, _ = first_member.name.split(os.path.sep, 1)
+
+        admin_file_path = os.path.join(self._name, '.dtool', 'dtool')
+        manifest_file_path = None
+        readme_file_path = None
+
+        member = first_member
+        while member is not None:
+            if member.name == admin_file_path:
+                admin_str = tar.extractfile(member).read().decode('utf-8')
+                self._admin_metadata = json.loads(admin_str)
+                manifest_file_path = os.path.join(
+                    self._name, self._admin_metadata['manifest_path'])
+                readme_file_path = os.path.join(
+                    self._name, self._admin_metadata['readme_path'])
+            elif member.name == manifest_file_path:
+                self._manifest = self._read_manifest(tar, member)
+            elif member.name == readme_file_path:
+                readme_str = tar.extractfile(member).read().decode('utf-8')
+                self._descriptive_metadata = yaml.safe_load(readme_str) or {}
+
+            if self._manifest is not None \
+                    and self._descriptive_metadata is not None:
+                return
+            member = tar.next()
+
+        raise KeyError("Header files not found in {}".format(self._tar_path))
+
+    def _read_manifest(self, tar, member):
+        """Return manifest of the archive.
+
+        The compact manifest companion file is used, rather than parsing the
+        manifest member, if it was written from the same manifest. Otherwise
+        the manifest member is parsed as it is read, one entry at a time.
+
+        The manifest is a dictionary, or a
+        :class:`arctool.manifest.CompactManifest` if the archive was opened
+        with compact=True.
+        """
+        source = {'uuid': self._admin_metadata['uuid'],
+                  'size': member.size,
+                  'mtime': member.mtime}
+        companion_path = compact_manifest_path(self._tar_path)
+        if os.path.isfile(companion_path):
+            try:
+                manifest = read_compact_manifest(companion_path)
+            except (IOError, ValueError, KeyError):
+                manifest = None
+            if manifest is not None and manifest.source == source:
+                return manifest if self._compact else manifest.to_dict()
+
+        fh = tar.extractfile(member)
+        if self._compact:
+            return read_manifest_stream(fh, source)
+        manifest = {}
+        manifest['file_list'] = list(iter_manifest_entries(fh, manifest))
+        return manifest
+
     @classmethod
-    def from_file(cls, path):
-        """Read archive from file, either .tar or .tar.gz"""
+    def from_file(cls, path, use_pigz=True, compact=False):
+        """Read archive from file, either .tar or .tar.gz
+
+        Only the header files at the start of the archive are read.
+
+        A volume index is opened as an :class:`ArchiveVolumeSet`.
+
+        :param path: path to archive file
+        :param use_pigz: decompress gzipped archives using pigz, if it is
+                         available
+        :param compact: hold the manifest as a read only
+                        :class:`arctool.manifest.CompactManifest`, which
+                        takes a fraction of the memory of the dictionary,
+                        rather than as a dictionary
+        """
+        if is_volume_index(path):
+            return ArchiveVolumeSet.from_file(path, use_pigz=use_pigz,
+                                              compact=compact)
 
         archive_file = cls()
 
         archive_file._tar_path = path
+        archive_file._use_pigz = use_pigz
+        archive_file._compact = compact
 
-        with tarfile.open(path, 'r:*') as tar:
-            first_member = tar.next()
-            archive_file._name, _ = first_member.name.split(os.path.sep, 1)
+        with archive_file._open_tar_stream() as tar:
+            archive_file._read_header(tar)
 
-        admin_file_path = os.path.join(archive_file._name, '.dtool', 'dtool')
-        admin_str = archive_file._extract_string_contents(admin_file_path)
-        archive_file._admin_metadata = json.loads(admin_str)
-
-        manifest_file_path = os.path.join(
-            archive_file._name,
-            archive_file.admin_metadata['manifest_path'])
-        manifest_str = archive_file._extract_string_contents(
-            manifest_file_path)
-        archive_file._manifest = json.loads(manifest_str)
+        archive_file._select_stored_files()
+        archive_file._index = read_index(path)
 
         return archive_file
 
+    def _select_stored_files(self):
+        """Restrict the manifest to the files stored in the archive.
+
+        Incremental archives only store the files changed since their base,
+        and deduplicated archives store references in place of some files.
+        """
+        incremental = self.incremental
+        references = self.references
+        if incremental is None and not references:
+            return
+
+        if incremental is not None:
+            stored = set(incremental['paths'])
+        else:
+            stored = set(entry['path']
+                         for entry in self._manifest['file_list'])
+        stored.difference_update(references)
+        self._dataset_manifest = self._manifest
+        self._manifest = _select_entries(self._manifest, stored)
+
+    def _referenced_archive(self, reference):
+        """Return :class:`ArchiveFile` storing a referenced file.
+
+        The archive is looked for in the directory of this archive, before
+        the path recorded in the reference, and gzipped if it has been
+        compressed since it was referenced.
+        """
+        candidates = [os.path.join(
+            os.path.dirname(os.path.abspath(self._tar_path)),
+            os.path.basename(reference['archive'])),
+            reference['archive']]
+        candidates += [candidate + '.gz' for candidate in candidates
+                       if not candidate.endswith('.gz')]
+        archive_path = next((candidate for candidate in candidates
+                             if os.path.isfile(candidate)),
+                            reference['archive'])
+        if archive_path not in self._referenced_archives:
+            self._referenced_archives[archive_path] = ArchiveFile.from_file(
+                archive_path, use_pigz=self._use_pigz, compact=self._compact)
+        return self._referenced_archives[archive_path]
+
+    def _open_member(self, member_name):
+        """Return file like object with the data of the named member.
+
+        Uses the index sidecar file to seek to the member if there is one,
+        otherwise reads forward through the archive. Referenced files are
+        read from the archive storing them.
+        """
+        references = self.references
+        if references:
+            path = os.path.relpath(os.path.normpath(member_name),
+                                   self._data_dir())
+            if path in references:
+                reference = references[path]
+                return self._referenced_archive(reference)._open_member(
+                    reference['member'])
+
+        index_member = self._index_member(member_name)
+        if index_member is not None:
+            try:
+                return open_member(self._tar_path, self._index, index_member)
+            except IndexMismatchError:
+                self._drop_index()
+
+        return _StreamedMember(self._open_tar_stream(), member_name)
+
+    def _drop_index(self):
+        """Stop using an index found not to match the archive.
+
+        The archive is read forward from the start instead.
+        """
+        self._index = None
+        self._index_members = None
+
+    def _index_member(self, member_name):
+        """Return the index entry of the named member, or None."""
+        if self._index is None:
+            return None
+        if self._index_members is None:
+            self._index_members = {entry['path']: entry
+                                   for entry in self._index['members']}
+        return self._index_members.get(member_name)
+
+    def _data_dir(self):
+        """Return the path of the manifest root in the archive."""
+        return os.path.normpath(os.path.join(
+            self._name,
+            self.admin_metadata['manifest_root']))
+
     def calculate_file_hash(self, filename):
 
         full_file_path = os.path.join(
@@ -151,10 +1299,8 @@ class ArchiveFile(_ArchiveFileBase):
             self.admin_metadata['manifest_root'],
             filename)
 
-        with tarfile.open(self._tar_path, 'r:*') as tar:
-            fp = tar.extractfile(full_file_path)
-
-            return shasum_from_file_object(fp)
+        with self._open_member(full_file_path) as fp:
+            return self._hash_file_object(fp)
 
     def verify_file(self, file_in_archive):
         """Verify single file in archive.
@@ -162,64 +1308,630 @@ class ArchiveFile(_ArchiveFileBase):
         :param file_in_archive: file to verify
         :returns: True if checksum matches, False otherwise.
         """
-        file_list = self.manifest["file_list"]
-
-        filedict_by_path = {entry['path']: entry for entry in file_list}
-
-        file_entry = filedict_by_path[file_in_archive]
+        entries = self._manifest_entries()
+        if file_in_archive not in entries \
+                and file_in_archive in self.references:
+            entries = _entries_by_path(self.dataset_manifest)
+        file_entry = entries[file_in_archive]
 
         manifest_hash = file_entry['hash']
         archive_hash = self.calculate_file_hash(file_in_archive)
 
         return manifest_hash == archive_hash
 
-    def verify_all(self):
-        """Verify all files in archive.
+    def verify_files(self, files_in_archive, progress=None):
+        """Verify several files in archive, in a single pass through it.
 
-        :returns: True if all files verify, False otherwise.
+        The files are checked in the order they are stored in the archive.
+        If the archive has an index, reading starts at the first of them;
+        reading stops as soon as all of them have been checked.
+
+        Referenced files are verified in the archives storing them.
+
+        :param files_in_archive: files to verify
+        :param progress: callable called with the number of bytes, and the
+                         file, as they are read from the archive
+        :raises: KeyError if a file is not in the manifest
+        :returns: dictionary of True if the checksum matches, False
+                  otherwise, by file; files missing from the archive do not
+                  match
+        """
+        entries = self._manifest_entries()
+        references = self.references
+        referenced = [path for path in files_in_archive
+                      if path not in entries and path in references]
+        expected = {path: entries[path]['hash'] for path in files_in_archive
+                    if path not in references or path in entries}
+        results = {path: False for path in expected}
+        results.update(self._verify_referenced(referenced, progress))
+        if not expected:
+            return results
+
+        offset = 0
+        prefix = self._data_dir() + '/'
+        offsets = [self._index_member(prefix + path) for path in expected]
+        if offsets and all(member is not None for member in offsets):
+            offset = min(member['offset'] for member in offsets)
+
+        with self._open_tar_stream(offset) as tar:
+            for file_in_archive, member in self._iter_data_members(tar):
+                if file_in_archive not in expected:
+                    continue
+                fp = tar.extractfile(member)
+                if progress is not None:
+                    fp = _ProgressReader(fp, progress, file_in_archive)
+                results[file_in_archive] = \
+                    self._hash_file_object(fp) == expected.pop(file_in_archive)
+                if not expected:
+                    break
+
+        return results
+
+    def _verify_referenced(self, files_in_archive, progress=None):
+        """Verify referenced files in the archives storing them.
+
+        Each archive is read in a single pass. A referenced file matches if
+        the stored copy matches both the manifest of the archive storing it
+        and the manifest of this dataset.
+
+        :param files_in_archive: referenced files to verify
+        :param progress: callable called with the number of bytes, and the
+                         file, as they are read from the archives
+        :returns: dictionary of True if the checksum matches, False
+                  otherwise, by file
         """
+        entries = _entries_by_path(self.dataset_manifest)
+        paths_by_archive = collections.OrderedDict()
+        for path in files_in_archive:
+            reference = self.references[path]
+            archive_file = self._referenced_archive(reference)
+            stored_path = os.path.relpath(reference['member'],
+                                          archive_file._data_dir())
+            paths_by_archive.setdefault(archive_file, {})[stored_path] = path
+
+        results = {}
+        for archive_file, paths in paths_by_archive.items():
+            archive_file.buf_size = self.buf_size
+            archive_progress = None
+            if progress is not None:
+                archive_progress = _renamed(progress, paths)
+            verified = archive_file.verify_files(list(paths),
+                                                 progress=archive_progress)
+            stored_entries = archive_file._manifest_entries()
+            for stored_path, path in paths.items():
+                results[path] = (verified[stored_path]
+                                 and stored_entries[stored_path]['hash']
+                                 == entries[path]['hash'])
+
+        return results
+
+    def _iter_data_members(self, tar):
+        """Yield (path, member) tuples for the data files in a tar stream.
+
+        The path is relative to the manifest root, i.e. it matches the
+        paths in the manifest file list.
+        """
+        prefix = self._data_dir() + '/'
+
+        for member in tar:
+            if not member.isfile():
+                continue
+            if not member.name.startswith(prefix):
+                continue
+            yield member.name[len(prefix):], member
 
-        # TODO - raise exception?
+    def _resume_offset(self, records):
+        """Return offset of the first data member without a result, or 0.
 
+        Verification can only start part way through an archive with an
+        index.
+        """
+        if not records or self._index is None:
+            return 0
+        prefix = self._data_dir() + '/'
+        for member in self._index['members']:
+            name = member['path']
+            if name.startswith(prefix) and name[len(prefix):] not in records:
+                return member['offset']
+        return 0
+
+    def verification_report(self, n_workers=1, progress=None,
+                            journal_path=None, resume=False, keep_going=True):
+        """Return dictionary with the outcome of verifying all files.
+
+        The archive is streamed through once, in order, hashing each file
+        as it passes and comparing it to the manifest. With more than one
+        worker the hashing is done by a
+        :class:`arctool.pipeline.HashingPipeline`.
+
+        The result for each file can be recorded in a journal, see
+        :mod:`arctool.journal`. When resuming from a journal, files with a
+        result are not hashed again and, if the archive has an index,
+        streaming starts at the first file without one.
+
+        :param n_workers: number of hashing threads
+        :param progress: callable called with the number of bytes, and the
+                         file, as they are read from the archive
+        :param journal_path: path to the journal to record results in
+        :param resume: resume from the results in the journal
+        :param keep_going: check every file, rather than stopping at the
+                           first corrupt or extra file
+        :returns: dictionary with lists of 'missing', 'extra' and 'corrupt'
+                  file paths, the number of bytes hashed ('n_bytes') in
+                  'seconds', and whether all files were checked
+                  ('complete'); missing files are only reported if complete
+        """
         file_list = self.manifest["file_list"]
+        # A compact manifest is looked up in place, rather than copied.
+        entries = _entries_by_path(self.manifest)
+
+        records = collections.OrderedDict()
+        if resume and journal_path is not None \
+                and os.path.isfile(journal_path):
+            records = read_journal(journal_path)
+        journal = None
+        if journal_path is not None:
+            journal = VerificationJournal(journal_path, append=bool(records))
+
+        def add_record(record):
+            records[record['path']] = record
+            if journal is not None:
+                journal.append(record)
+
+        stopped = []
+        started = {}
+        n_bytes = 0
+        start = time.time()
+        try:
+            with self._open_tar_stream(self._resume_offset(records)) as tar:
+
+                def files_to_hash():
+                    for file_in_archive, member in \
+                            self._iter_data_members(tar):
+                        if file_in_archive in records:
+                            continue
+                        if file_in_archive not in entries:
+                            add_record(verification_record(
+                                file_in_archive, None, None, member.size))
+                            if not keep_going:
+                                stopped.append(file_in_archive)
+                                return
+                            continue
+                        started[file_in_archive] = (time.time(), member.size)
+                        fp = tar.extractfile(member)
+                        if progress is not None:
+                            fp = _ProgressReader(fp, progress, file_in_archive)
+                        yield file_in_archive, fp
+
+                if n_workers > 1:
+                    pipeline = HashingPipeline(
+                        n_workers=n_workers,
+                        chunk_size=self.buf_size,
+                        hasher_factory=HASH_ALGORITHMS[self.hash_algorithm])
+                    hashes = pipeline.run(files_to_hash())
+                else:
+                    hashes = ((file_in_archive, self._hash_file_object(fp))
+                              for file_in_archive, fp in files_to_hash())
+
+                for file_in_archive, archive_hash in hashes:
+                    started_at, size = started.pop(file_in_archive)
+                    n_bytes += size
+                    record = verification_record(
+                        file_in_archive,
+                        entries[file_in_archive]['hash'],
+                        archive_hash,
+                        size,
+                        time.time() - started_at)
+                    add_record(record)
+                    if not (keep_going or record_passed(record)):
+                        stopped.append(file_in_archive)
+                        break
+                # Stop the hashing threads, if stopping early.
+                hashes.close()
+        finally:
+            if journal is not None:
+                journal.close()
+
+        complete = not stopped
+        missing = []
+        if complete:
+            missing = [entry['path'] for entry in file_list
+                       if entry['path'] not in records]
+
+        return {'missing': missing,
+                'extra': [path for path, record in records.items()
+                          if record['expected'] is None],
+                'corrupt': [path for path, record in records.items()
+                            if record['expected'] is not None
+                            and not record_passed(record)],
+                'n_bytes': n_bytes,
+                'seconds': time.time() - start,
+                'complete': complete}
+
+    def verify_all(self):
+        """Verify all files in archive.
 
-        for entry in file_list:
-            file_in_archive = entry['path']
-            manifest_hash = entry['hash']
-            archive_hash = self.calculate_file_hash(file_in_archive)
+        Stops at the first file that does not verify.
 
-            if archive_hash != manifest_hash:
-                return False
+        :returns: True if all files verify, False otherwise.
+        """
+        report = self.verification_report(keep_going=False)
 
-        return True
+        return report['complete'] \
+            and not (report['missing'] or report['extra'] or report['corrupt'])
 
     def summarise(self):
         """Return dictionary with summary information about an archive.
 
         :returns: dictionary of summary information about the archive
         """
-        total_size = sum(entry['size'] for entry in self.manifest['file_list'])
-
-        summary = {}
-        summary['n_files'] = len(self.manifest['file_list'])
-        summary['total_size'] = total_size
+        self._check_manifest_cache()
+        if self._summary is None:
+            if isinstance(self.manifest, CompactManifest):
+                total_size = self.manifest.total_size()
+            else:
+                total_size = sum(entry['size']
+                                 for entry in self.manifest['file_list'])
+            self._summary = {'n_files': len(self.manifest['file_list']),
+                             'total_size': total_size}
+
+        summary = dict(self._summary)
         summary['manifest'] = self.manifest
 
         return summary
 
 
+class ArchiveVolumeSet(ArchiveFile):
+    """Class for working with archives split into volumes.
+
+    The volumes are opened as one archive. See :mod:`arctool.volumes`.
+    """
+
+    def __init__(self):
+        super(ArchiveVolumeSet, self).__init__()
+        self._volumes = []
+        self._volume_by_path = {}
+
+    @classmethod
+    def from_file(cls, path, use_pigz=True, compact=False):
+        """Read archive from the volume index of a volume set.
+
+        The header files of each volume are read.
+
+        :param path: path to volume index file
+        :param use_pigz: decompress gzipped volumes using pigz, if it is
+                         available
+        :param compact: hold the manifest as a read only
+                        :class:`arctool.manifest.CompactManifest`
+        """
+        volume_set = cls()
+        volume_set._tar_path = path
+        volume_set._use_pigz = use_pigz
+        volume_set._compact = compact
+
+        for volume in read_volume_index(path)['volumes']:
+            archive_file = ArchiveFile.from_file(volume['path'],
+                                                 use_pigz=use_pigz,
+                                                 compact=compact)
+            if volume_set._manifest is None:
+                volume_set._manifest = archive_file.manifest
+            # Each volume verifies only its own files.
+            members = set(volume['members'])
+            archive_file._manifest = _select_entries(archive_file.manifest,
+                                                     members)
+            volume_set._volumes.append(archive_file)
+            for member in members:
+                volume_set._volume_by_path[member] = archive_file
+
+        first_volume = volume_set._volumes[0]
+        volume_set._name = first_volume._name
+        volume_set._admin_metadata = first_volume.admin_metadata
+        volume_set._dataset_manifest = first_volume._dataset_manifest
+        volume_set._descriptive_metadata = first_volume.descriptive_metadata
+
+        return volume_set
+
+    @property
+    def volumes(self):
+        """Return list of :class:`ArchiveFile` instances, one per volume."""
+        return list(self._volumes)
+
+    def _open_member(self, member_name):
+        prefix = os.path.join(self._name,
+                              self.admin_metadata['manifest_root'], '')
+        path = os.path.normpath(member_name)[len(prefix):]
+        volume = self._volume_by_path.get(path, self._volumes[0])
+        return volume._open_member(member_name)
+
+    def verify_files(self, files_in_archive, progress=None):
+        """Verify several files in archive, in one pass through each volume.
+
+        See :meth:`ArchiveFile.verify_files`.
+        """
+        entries = self._manifest_entries()
+        references = self.references
+        referenced = [path for path in files_in_archive
+                      if path not in entries and path in references]
+        results = self._verify_referenced(referenced, progress)
+        paths_by_volume = collections.OrderedDict()
+        for path in files_in_archive:
+            if path in results:
+                continue
+            if path not in entries:
+                raise KeyError(path)
+            volume = self._volume_by_path.get(path)
+            if volume is None:
+                results[path] = False
+            else:
+                paths_by_volume.setdefault(volume, []).append(path)
+
+        for volume, paths in paths_by_volume.items():
+            volume.buf_size = self.buf_size
+            results.update(volume.verify_files(paths, progress=progress))
+
+        return results
+
+    def verification_report(self, n_workers=1, progress=None,
+                            journal_path=None, resume=False, keep_going=True):
+        """Return dictionary with the outcome of verifying all files.
+
+        The volumes are verified in parallel, n_workers at a time, each as
+        by :meth:`ArchiveFile.verification_report`. Each volume has its own
+        journal, journal_path with the volume number appended.
+        """
+        if progress is not None:
+            progress = _locked(progress)
+
+        def verify_volume(item):
+            number, volume = item
+            volume_journal_path = None
+            if journal_path is not None:
+                volume_journal_path = "{}.{:03d}".format(journal_path, number)
+            volume.buf_size = self.buf_size
+            return volume.verification_report(
+                progress=progress,
+                journal_path=volume_journal_path,
+                resume=resume,
+                keep_going=keep_going)
+
+        start = time.time()
+        pool = ThreadPool(max(1, min(n_workers, len(self._volumes))))
+        try:
+            reports = pool.map(verify_volume,
+                               enumerate(self._volumes, 1))
+        finally:
+            pool.close()
+            pool.join()
+
+        complete = all(report['complete'] for report in reports)
+        missing = []
+        if complete:
+            missing = [entry['path'] for entry in self.manifest['file_list']
+                       if entry['path'] not in self._volume_by_path]
+
+        return {'missing': missing + [path for report in reports
+                                      for path in report['missing']],
+                'extra': [path for report in reports
+                          for path in report['extra']],
+                'corrupt': [path for report in reports
+                            for path in report['corrupt']],
+                'n_bytes': sum(report['n_bytes'] for report in reports),
+                'seconds': time.time() - start,
+                'complete': complete}
+
+
+def _renamed(progress, names):
+    """Return progress callback reporting files under other names.
+
+    :param progress: callable called with the number of bytes and the file
+    :param names: dictionary of the names to report, by file
+    """
+    def renamed_progress(n_bytes, name):
+        return progress(n_bytes, names.get(name, name))
+    return renamed_progress
+
+
+def _locked(func):
+    """Return function calling func while holding a lock."""
+    lock = threading.Lock()
+
+    def locked_func(*args):
+        with lock:
+            return func(*args)
+    return locked_func
+
+
 ################################################################
 # Helper function(s) for wrapping shell commands on the tar file.
 ################################################################
 
 
-def compress_archive(path, n_threads=8):
+def compress_archive(path, n_threads=8, index_span=DEFAULT_SPAN,
+                     progress=None):
     """Compress the (tar) archive at the given path.
 
-    Uses pigz for speed.
+    Uses pigz for speed. An index sidecar file with seek points every
+    index_span bytes is written for the compressed archive.
 
     :param path: path to the archive tarball
     :param n_threads: number of threads for pigz to use
+    :param index_span: uncompressed bytes between seek points in the index,
+                       no index is written if this is 0 or None
+    :param progress: callable called with the number of bytes of the
+                     tarball as they are compressed; the tarball is then
+                     piped through pigz rather than compressed in place
+    :returns: path to created gzip file
+    """
+    path = os.path.abspath(path)
+
+    basename = os.path.basename(path)
+    archive_name, ext = os.path.splitext(basename)
+    assert ext == '.tar'
+
+    _remove_sidecars(path + '.gz')
+
+    if progress is None:
+        compress_tool = 'pigz'
+        compress_args = ['-p', str(n_threads), path]
+        compress_command = [compress_tool] + compress_args
+
+        subprocess.call(compress_command)
+    else:
+        _pipe_through_pigz(path, path + '.gz', n_threads, progress)
+        os.remove(path)
+
+    # The sidecars of the uncompressed tarball are no longer valid.
+    _remove_sidecars(path)
+
+    gzip_path = path + '.gz'
+    if index_span:
+        write_index(gzip_path, build_index(gzip_path, span=index_span))
+
+    return gzip_path
+
+
+def _pipe_through_pigz(path, gzip_path, n_threads, progress):
+    with open(path, 'rb') as fh_in:
+        with open(gzip_path, 'wb') as fh_out:
+            process = subprocess.Popen(['pigz', '-p', str(n_threads), '-c'],
+                                       stdin=subprocess.PIPE,
+                                       stdout=fh_out)
+            try:
+                for data in _read_chunks(_ProgressReader(fh_in, progress)):
+                    process.stdin.write(data)
+            finally:
+                process.stdin.close()
+                process.wait()
+
+    if process.returncode != 0:
+        os.remove(gzip_path)
+        raise IOError("pigz failed with exit code {}".format(
+            process.returncode))
+
+
+def _read_chunks(fh, size=TAR_WRITE_BUFFER_SIZE):
+    data = fh.read(size)
+    while data:
+        yield data
+        data = fh.read(size)
+
+
+def _is_gzip_file(path):
+    with open(path, 'rb') as fh:
+        return fh.read(2) == b'\x1f\x8b'
+
+
+def _pigz_decompress_command():
+    if which('pigz') is not None:
+        return ['pigz', '-dc']
+    if which('unpigz') is not None:
+        return ['unpigz', '-c']
+    return None
+
+
+def _find_member(tar, name):
+    """Return the member with the given name, reading forward in the stream.
+    """
+    for member in tar:
+        if member.name == name:
+            return member
+    raise KeyError("filename {!r} not found".format(name))
+
+
+class _StreamedMember(object):
+    """File like object reading a member from a tar stream context."""
+
+    def __init__(self, tar_stream, member_name):
+        self._tar_stream = tar_stream
+        tar = tar_stream.__enter__()
+        try:
+            self._fp = tar.extractfile(_find_member(tar, member_name))
+        except Exception:
+            tar_stream.__exit__(None, None, None)
+            raise
+
+    def read(self, size=-1):
+        return self._fp.read(size)
+
+    def close(self):
+        self._tar_stream.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@contextlib.contextmanager
+def open_tar_stream(path, use_pigz=True):
+    """Context manager yielding a :class:`tarfile.TarFile` for reading.
+
+    The members have to be read in order, as from a stream. Gzipped archives
+    are decompressed by pigz in a separate process, and piped to tarfile,
+    if pigz is available. Otherwise Python's gzip layer is used. Plain tar
+    files are opened for random access so that skipping over members is
+    cheap.
+
+    Block compressed archives, see :func:`compress_archive_blocked`, are
+    decompressed in parallel by a pool of threads instead.
+
+    :param path: path to the archive
+    :param use_pigz: use pigz for decompression if available
+    """
+    if not _is_gzip_file(path):
+        with tarfile.open(path, 'r:*') as tar:
+            yield tar
+        return
+
+    index = read_index(path)
+    if index is not None and index.get('block_size'):
+        with open(path, 'rb') as fh:
+            reader = BlockedGzipReader(fh, index['seek_points'])
+            try:
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    yield tar
+            finally:
+                reader.close()
+        return
+
+    decompress_command = _pigz_decompress_command() if use_pigz else None
+    if decompress_command is None:
+        with tarfile.open(path, 'r|gz') as tar:
+            yield tar
+        return
+
+    process = subprocess.Popen(decompress_command + [path],
+                               stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+            yield tar
+    finally:
+        # Stop pigz if the stream was not read to the end.
+        if process.poll() is None:
+            process.terminate()
+        process.stdout.close()
+        process.wait()
+
+    if process.returncode > 0:
+        raise IOError("{} failed with exit code {}".format(
+            decompress_command[0], process.returncode))
+
+
+def compress_archive_blocked(path, n_threads=8,
+                             block_size=DEFAULT_BLOCK_SIZE, progress=None):
+    """Compress the (tar) archive at the given path into independent blocks.
+
+    Each block is a complete gzip member, so the output can be read by
+    gunzip and tar like any other gzip file. The block offsets are stored as
+    seek points in the index sidecar file, allowing parallel decompression
+    and seeking to members.
+
+    :param path: path to the archive tarball
+    :param n_threads: number of compression threads
+    :param block_size: number of uncompressed bytes per block
+    :param progress: callable called with the number of bytes of the
+                     tarball as they are compressed
     :returns: path to created gzip file
     """
     path = os.path.abspath(path)
@@ -228,10 +1940,23 @@ def compress_archive(path, n_threads=8):
     archive_name, ext = os.path.splitext(basename)
     assert ext == '.tar'
 
-    compress_tool = 'pigz'
-    compress_args = ['-p', str(n_threads), path]
-    compress_command = [compress_tool] + compress_args
+    tar_index = build_index(path)
+
+    gzip_path = path + '.gz'
+    _remove_sidecars(gzip_path)
+    with open(path, 'rb') as fh_in:
+        if progress is not None:
+            fh_in = _ProgressReader(fh_in, progress)
+        with open(gzip_path, 'wb') as fh_out:
+            seek_points = compress_blocks(fh_in, fh_out,
+                                          block_size=block_size,
+                                          n_threads=n_threads)
+
+    os.remove(path)
+    _remove_sidecars(path)
 
-    subprocess.call(compress_command)
+    write_index(gzip_path, {'members': tar_index['members'],
+                            'seek_points': seek_points,
+                            'block_size': block_size})
 
-    return path + '.gz'
+    return gzip_path
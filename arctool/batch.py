@@ -0,0 +1,199 @@
+"""Module for archiving all the datasets in a project.
+
+Each dataset goes through the same steps as when archived by hand: creating
+the manifest, creating the tarball, compressing it and verifying it.
+Several datasets are processed at a time, by a pool of worker threads,
+with separate limits on the number of disk bound steps (manifest, tar and
+verify) and on the cores used for compression running at any one time.
+
+Steps whose output already exists are skipped, so that a batch can be rerun
+after an interruption or to pick up new datasets. A dataset whose compressed
+archive has passed verification is skipped altogether.
+"""
+
+import os
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
+from dtool import (
+    DataSet,
+    DtoolTypeError,
+    NotDtoolObject,
+)
+
+from arctool.archive import (
+    ArchiveDataSet,
+    ArchiveFile,
+    ArchiveFileBuilder,
+    compress_archive,
+)
+from arctool.checkpoint import checkpoint_path
+from arctool.index import read_index
+from arctool.journal import journal_path, read_journal, record_passed
+from arctool.manifest import manifest_size
+from arctool.utils import readme_yml_is_valid
+
+
+def find_datasets(project_path):
+    """Return sorted list of paths to the datasets in a project directory.
+
+    :param project_path: path to a directory containing datasets
+    :returns: list of absolute paths
+    """
+    project_path = os.path.abspath(project_path)
+    dataset_paths = []
+    for name in sorted(os.listdir(project_path)):
+        path = os.path.join(project_path, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            DataSet.from_path(path)
+        except (NotDtoolObject, DtoolTypeError):
+            continue
+        dataset_paths.append(path)
+    return dataset_paths
+
+
+def _is_complete(archive_path):
+    """Return True if an archive was written in full."""
+    return read_index(archive_path) is not None \
+        and not os.path.isfile(checkpoint_path(archive_path))
+
+
+def _is_verified(archive_path, manifest):
+    """Return True if every file in the manifest is journaled as verified."""
+    path = journal_path(archive_path)
+    if not os.path.isfile(path):
+        return False
+    records = read_journal(path)
+    return all(entry['path'] in records
+               and record_passed(records[entry['path']])
+               for entry in manifest['file_list']) \
+        and len(records) == len(manifest['file_list'])
+
+
+class BatchArchiver(object):
+    """Class for archiving many datasets with a pool of worker threads.
+
+    :param output_path: directory to write the archives to, by default the
+                        parent directory of each dataset
+    :param n_workers: number of datasets to process at a time
+    :param max_io: maximum number of disk bound steps to run at a time
+    :param cores: number of cores to use for compression, in total
+    :param cores_per_job: number of cores for each compression
+    """
+
+    def __init__(self, output_path=None, n_workers=2, max_io=1, cores=4,
+                 cores_per_job=4):
+        self.output_path = output_path
+        self.n_workers = n_workers
+        self.cores_per_job = min(cores_per_job, cores)
+        self._io_slots = threading.BoundedSemaphore(max_io)
+        self._cpu_slots = threading.BoundedSemaphore(
+            max(1, cores // self.cores_per_job))
+
+    def _output_path(self, dataset_path):
+        if self.output_path is not None:
+            return os.path.abspath(self.output_path)
+        return os.path.dirname(dataset_path)
+
+    def _run_step(self, result, step, slots, func, *args, **kwargs):
+        with slots:
+            start = time.time()
+            value = func(*args, **kwargs)
+            result['steps'][step] = time.time() - start
+        return value
+
+    def archive_dataset(self, dataset_path):
+        """Archive a dataset, skipping steps that have already been done.
+
+        :param dataset_path: path to the dataset
+        :returns: dictionary with the dataset 'name' and 'path', the
+                  'archive_path', the 'status' ('archived', 'skipped' or
+                  'failed'), the 'n_bytes' of data, the 'seconds' spent on
+                  each of the 'steps' run, their total 'seconds', and the
+                  'error' if the dataset failed
+        """
+        dataset_path = os.path.abspath(dataset_path)
+        result = {'name': os.path.basename(dataset_path),
+                  'path': dataset_path,
+                  'archive_path': None,
+                  'status': 'archived',
+                  'n_bytes': 0,
+                  'steps': {},
+                  'error': None}
+
+        try:
+            archive_dataset = ArchiveDataSet.from_path(dataset_path)
+            tar_path = os.path.join(self._output_path(dataset_path),
+                                    archive_dataset.name + ".tar")
+            gzip_path = tar_path + ".gz"
+            result['name'] = archive_dataset.name
+            result['archive_path'] = gzip_path
+            result['n_bytes'] = manifest_size(archive_dataset.manifest)
+
+            if _is_complete(gzip_path):
+                archive_file = ArchiveFile.from_file(gzip_path)
+                if _is_verified(gzip_path, archive_file.manifest):
+                    result['status'] = 'skipped'
+                    return self._finish(result)
+            else:
+                self._create(result, archive_dataset, tar_path)
+
+            report = self._run_step(
+                result, 'verify', self._io_slots, self._verify, gzip_path)
+            if report['missing'] or report['extra'] or report['corrupt']:
+                raise ValueError(
+                    "Verification failed: {} missing, {} extra, {} corrupt "
+                    "files".format(len(report['missing']),
+                                   len(report['extra']),
+                                   len(report['corrupt'])))
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+
+        return self._finish(result)
+
+    def _create(self, result, archive_dataset, tar_path):
+        with open(archive_dataset.abs_readme_path) as fh:
+            if not readme_yml_is_valid(fh.read()):
+                raise ValueError("README.yml is not valid")
+
+        if not _is_complete(tar_path):
+            self._run_step(result, 'manifest', self._io_slots,
+                           archive_dataset.update_manifest)
+            result['n_bytes'] = manifest_size(archive_dataset.manifest)
+            archive_builder = ArchiveFileBuilder.from_path(
+                archive_dataset._abs_path)
+            self._run_step(result, 'tar', self._io_slots,
+                           archive_builder.persist_to_tar,
+                           os.path.dirname(tar_path), resume=True)
+
+        self._run_step(result, 'compress', self._cpu_slots,
+                       compress_archive, tar_path,
+                       n_threads=self.cores_per_job)
+
+    def _verify(self, gzip_path):
+        archive_file = ArchiveFile.from_file(gzip_path)
+        return archive_file.verification_report(
+            journal_path=journal_path(gzip_path), resume=True)
+
+    def _finish(self, result):
+        result['seconds'] = sum(result['steps'].values())
+        return result
+
+    def run(self, dataset_paths):
+        """Yield the result of archiving each dataset, in order.
+
+        A failure archiving one dataset does not stop the others.
+
+        :param dataset_paths: list of paths to datasets
+        """
+        pool = ThreadPool(self.n_workers)
+        try:
+            for result in pool.imap(self.archive_dataset, dataset_paths):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
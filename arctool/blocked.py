@@ -0,0 +1,211 @@
+"""Module for block compressed, BGZF style, gzip files.
+
+The input is split into blocks of a fixed size and each block is compressed
+into a complete gzip member of its own. The concatenated members form a
+valid multi-member gzip file, which standard gunzip and tar read as a single
+stream. Since the blocks are independent they can be compressed and
+decompressed in parallel, and decompression can start at any block.
+
+The offsets of the blocks are returned as seek points in the format used by
+:mod:`arctool.index`.
+"""
+
+import zlib
+import collections
+from multiprocessing.pool import ThreadPool
+
+#: Default number of uncompressed bytes per block.
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+_GZIP_WBITS = 31
+
+
+def _compress_block(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress_block(data):
+    return zlib.decompress(data, _GZIP_WBITS)
+
+
+def _ordered_map(pool, func, items, n_pending):
+    """Yield func(item) in order, with at most n_pending items in flight.
+
+    Unlike :meth:`multiprocessing.pool.Pool.imap` this does not read ahead
+    of the results, so memory use is bounded.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= n_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _read_blocks(fh, block_size):
+    data = fh.read(block_size)
+    while data:
+        yield data
+        data = fh.read(block_size)
+
+
+class BlockedGzipWriter(object):
+    """File like object compressing the data written to it in blocks.
+
+    Blocks are compressed in parallel and written to the output in order.
+    The seek points of the blocks written are available from
+    :attr:`seek_points`.
+
+    :param out_fh: file object to write compressed data to
+    :param block_size: number of uncompressed bytes per block
+    :param n_threads: number of compression threads
+    :param compressed_offset: offset in the output of the first block, when
+                              appending to existing output
+    :param uncompressed_offset: uncompressed offset of the first block
+    """
+
+    def __init__(self, out_fh, block_size=DEFAULT_BLOCK_SIZE, n_threads=8,
+                 compressed_offset=0, uncompressed_offset=0):
+        self._out_fh = out_fh
+        self._block_size = block_size
+        self._n_pending = 2 * n_threads
+        self._pool = ThreadPool(n_threads)
+        self._pending = collections.deque()
+        self._buffer = []
+        self._buffer_size = 0
+        self._compressed_offset = compressed_offset
+        self._uncompressed_offset = uncompressed_offset
+        self.seek_points = []
+
+    def _write_block(self, size, compressed):
+        self.seek_points.append({
+            "compressed_offset": self._compressed_offset,
+            "uncompressed_offset": self._uncompressed_offset,
+            "window": None})
+        self._out_fh.write(compressed)
+        self._compressed_offset += len(compressed)
+        self._uncompressed_offset += size
+
+    def _submit(self, data):
+        self._pending.append(
+            (len(data), self._pool.apply_async(_compress_block, (data,))))
+        while len(self._pending) >= self._n_pending:
+            size, result = self._pending.popleft()
+            self._write_block(size, result.get())
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size < self._block_size:
+            return
+        data = b"".join(self._buffer)
+        pos = 0
+        while len(data) - pos >= self._block_size:
+            self._submit(data[pos:pos + self._block_size])
+            pos += self._block_size
+        self._buffer = [data[pos:]]
+        self._buffer_size = len(data) - pos
+
+    def tell(self):
+        """Return the number of uncompressed bytes written."""
+        pending = sum(size for size, _ in self._pending)
+        return self._uncompressed_offset + pending + self._buffer_size
+
+    def flush(self):
+        """Compress and write all the data written so far.
+
+        Any partial block is written as a short block. Does not flush the
+        output file object.
+        """
+        if self._buffer_size:
+            self._submit(b"".join(self._buffer))
+            self._buffer = []
+            self._buffer_size = 0
+        while self._pending:
+            size, result = self._pending.popleft()
+            self._write_block(size, result.get())
+
+    def close(self):
+        """Compress and write any remaining data.
+
+        Does not close the output file object.
+        """
+        try:
+            self.flush()
+        finally:
+            self._pool.close()
+            self._pool.join()
+
+
+def compress_blocks(in_fh, out_fh, block_size=DEFAULT_BLOCK_SIZE,
+                    n_threads=8):
+    """Write block compressed gzip data, returning the seek points.
+
+    :param in_fh: file object to read uncompressed data from
+    :param out_fh: file object to write compressed data to
+    :param block_size: number of uncompressed bytes per block
+    :param n_threads: number of compression threads
+    :returns: list of seek points, one at the start of each block
+    """
+    writer = BlockedGzipWriter(out_fh, block_size=block_size,
+                               n_threads=n_threads)
+    try:
+        for data in _read_blocks(in_fh, block_size):
+            writer.write(data)
+    finally:
+        writer.close()
+
+    return writer.seek_points
+
+
+class BlockedGzipReader(object):
+    """File like object decompressing the blocks of a file in parallel.
+
+    :param fh: file object of the block compressed file
+    :param seek_points: seek points at the start of each block
+    :param n_threads: number of decompression threads
+    """
+
+    def __init__(self, fh, seek_points, n_threads=8):
+        self._fh = fh
+        self._pool = ThreadPool(n_threads)
+        self._blocks = _ordered_map(self._pool,
+                                    _decompress_block,
+                                    self._read_compressed(seek_points),
+                                    2 * n_threads)
+        self._buffer = b""
+        self._buffer_pos = 0
+
+    def _read_compressed(self, seek_points):
+        offsets = [p["compressed_offset"] for p in seek_points]
+        self._fh.seek(offsets[0])
+        for start, end in zip(offsets, offsets[1:]):
+            yield self._fh.read(end - start)
+        # The last block runs to the end of the file.
+        yield self._fh.read()
+
+    def read(self, size=-1):
+        output = []
+        while size != 0:
+            if self._buffer_pos >= len(self._buffer):
+                try:
+                    self._buffer = next(self._blocks)
+                except StopIteration:
+                    break
+                self._buffer_pos = 0
+            if size < 0:
+                end = len(self._buffer)
+            else:
+                end = self._buffer_pos + size
+            data = self._buffer[self._buffer_pos:end]
+            self._buffer_pos += len(data)
+            if size > 0:
+                size -= len(data)
+            output.append(data)
+        return b"".join(output)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
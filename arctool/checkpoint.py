@@ -0,0 +1,95 @@
+"""Module for checkpoints allowing interrupted archive creation to resume.
+
+While an archive is written, a journal sidecar file, ``<archive>.checkpoint``,
+is appended to at regular intervals. Each checkpoint appends the index
+entries of the members, and the seek points, written since the previous
+checkpoint, followed by the state needed to resume: the uncompressed tar
+offset and compressed file offset of the last complete member and the number
+of entries written. The archive file is flushed to disk before the state is
+recorded, so everything up to the offsets of the last checkpoint is known to
+be good. Anything in the journal after the last state line is ignored.
+
+The journal is removed once the archive has been written successfully.
+"""
+
+import os
+import json
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+#: Default number of uncompressed bytes written between checkpoints.
+DEFAULT_CHECKPOINT_INTERVAL = 1024 * 1024 * 1024
+
+
+def checkpoint_path(archive_path):
+    """Return the path to the checkpoint journal of an archive."""
+    return archive_path + CHECKPOINT_SUFFIX
+
+
+class CheckpointJournal(object):
+    """Class for appending checkpoints to the journal of an archive.
+
+    :param archive_path: path to the archive being written
+    :param append: append to an existing journal, rather than starting a new
+                   one
+    """
+
+    def __init__(self, archive_path, append=False):
+        self.path = checkpoint_path(archive_path)
+        self._fh = open(self.path, "a" if append else "w")
+        self.n_checkpoints = 0
+
+    def append(self, members, seek_points, state):
+        """Record a checkpoint and flush it to disk.
+
+        :param members: index entries of the members written since the
+                        previous checkpoint
+        :param seek_points: seek points written since the previous checkpoint
+        :param state: dictionary with the state needed to resume
+        """
+        lines = [json.dumps({"member": member}) for member in members]
+        lines.extend(json.dumps({"seek_point": point})
+                     for point in seek_points)
+        lines.append(json.dumps({"state": state}))
+        self._fh.write("\n".join(lines) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self.n_checkpoints += 1
+
+    def close(self):
+        self._fh.close()
+
+    def remove(self):
+        """Close and delete the journal."""
+        self.close()
+        os.remove(self.path)
+
+
+def read_checkpoint(archive_path):
+    """Return (members, seek points, state) of the last checkpoint, or None.
+
+    None is returned if there is no journal, or no complete checkpoint in it.
+    """
+    path = checkpoint_path(archive_path)
+    if not os.path.isfile(path):
+        return None
+
+    members = []
+    seek_points = []
+    checkpoint = None
+    with open(path) as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line may be incomplete.
+                break
+            if "member" in record:
+                members.append(record["member"])
+            elif "seek_point" in record:
+                seek_points.append(record["seek_point"])
+            else:
+                checkpoint = (list(members), list(seek_points),
+                              record["state"])
+
+    return checkpoint
@@ -4,45 +4,79 @@
 import sys
 import os
 import getpass
+import contextlib
+import time
 
 import click
 
-from dtool import (
-    DataSet,
-    Project,
-    DtoolTypeError,
-    NotDtoolObject,
+from arctool import __version__, telemetry
+from arctool.estimate import Estimator, max_rss_mb, record_run
+from arctool.hashing import (
+    BUF_SIZE,
+    HASH_ALGORITHMS,
+    benchmark_hash_algorithms,
 )
-from arctool import __version__
-from arctool.utils import (
-    README_SCHEMA,
-    readme_yml_is_valid,
-    new_archive_dataset,
+from arctool.journal import JOURNAL_SUFFIX, journal_path
+from arctool.manifest import manifest_size
+from arctool.volumes import read_volume_index
+from arctool.progress import ProgressMeter
+from arctool.slurm import (
+    DEFAULT_PARTITION,
+    PIPELINE_STEPS,
+    compress_options,
+    generate_pipeline_script,
+    generate_slurm_script,
 )
-from arctool.archive import (
-    ArchiveDataSet,
-    ArchiveFile,
-    ArchiveFileBuilder,
-    compress_archive,
-)
-from arctool.slurm import generate_slurm_script
-from dtool.clickutils import create_project, generate_descriptive_metadata
 
-from fluent import sender
+# dtool, and the modules of arctool that use it, are imported by the commands
+# that need them, to keep the start up time down.
+
+
+def _show_meter(meter):
+    if meter is None:
+        return None
+    return str(meter)
+
+
+@contextlib.contextmanager
+def _progress_bar(label, total_bytes):
+    """Yield :class:`arctool.progress.ProgressMeter` drawing a progress bar.
+
+    The bar shows the throughput, time remaining and current file.
+    """
+    with click.progressbar(length=total_bytes,
+                           label=label,
+                           show_eta=False,
+                           item_show_func=_show_meter) as bar:
 
-logger = sender.FluentSender('arctool', host='v0679', port=24224)
+        def update_bar(meter, n_bytes):
+            bar.current_item = meter
+            bar.update(n_bytes)
+
+        meter = ProgressMeter(total_bytes, on_update=update_bar)
+        yield meter
+        meter.finish()
+
+
+def _record_run(step, n_bytes, n_cores, seconds):
+    """Add run to the history used for estimates; failing to is not fatal."""
+    try:
+        record_run(step, n_bytes, n_cores, seconds, memory_mb=max_rss_mb())
+    except (IOError, OSError):
+        pass
 
 
 @click.group()
 @click.version_option(version=__version__)
-@click.option('--fluentd-host', envvar='FLUENTD_HOST', default='v0679')
+@click.option('--fluentd-host', envvar='FLUENTD_HOST',
+              default=telemetry.DEFAULT_HOST)
 def cli(fluentd_host):
 
-    logger = sender.FluentSender('arctool', host=fluentd_host, port=24224)
+    telemetry.configure(host=fluentd_host)
     message = {'api-version': __version__,
                'command_line': sys.argv,
                'unix_username': getpass.getuser()}
-    logger.emit('cli_command', message)
+    telemetry.emit('cli_command', message)
 
 
 @cli.group(invoke_without_command=True)
@@ -52,6 +86,8 @@ def cli(fluentd_host):
               default='.',
               type=click.Path(exists=True))
 def new(ctx, staging_path):
+    from dtool import Project, DtoolTypeError, NotDtoolObject
+    from dtool.clickutils import create_project
 
     # ctx is passed in via @click.pass_context
 
@@ -75,6 +111,7 @@ def new(ctx, staging_path):
               default='.',
               type=click.Path(exists=True))
 def project(staging_path):
+    from dtool.clickutils import create_project
 
     create_project(staging_path)
 
@@ -90,12 +127,15 @@ def dataset(staging_path):
 
 
 def cli_new_dataset(staging_path):
+    from dtool.clickutils import generate_descriptive_metadata
+    from arctool.utils import README_SCHEMA, new_archive_dataset
+
     staging_path = os.path.abspath(staging_path)
 
     click.secho('Starting new archive in: ', nl=False)
     click.secho(staging_path, fg='green')
 
-    logger.emit('pre_new_archive', {'staging_path': staging_path})
+    telemetry.emit('pre_new_archive', {'staging_path': staging_path})
 
     descriptive_metadata = generate_descriptive_metadata(
         README_SCHEMA, staging_path)
@@ -109,7 +149,7 @@ def cli_new_dataset(staging_path):
     log_data = {'metadata': descriptive_metadata,
                 'archive_path': dataset_path,
                 'dataset_uuid': dataset.uuid}
-    logger.emit('new', log_data)
+    telemetry.emit('new', log_data)
 
     archive_data_path = os.path.join(dataset_path, dataset.data_directory)
     click.secho('Now:')
@@ -127,22 +167,43 @@ def manifest():
 
 
 @manifest.command()
+@click.option('--full', is_flag=True, default=False,
+              help='Rehash all files, rather than only new or changed ones.')
+@click.option('--workers', '-w', default=1,
+              help='Number of files to hash concurrently.')
+@click.option('--hash-algorithm',
+              type=click.Choice(sorted(HASH_ALGORITHMS)),
+              help='Hash algorithm to use; changing it rehashes all files.')
 @click.argument('path', 'Path to archive dataset directory.',
                 type=click.Path(exists=True))
-def create(path):
+def create(path, full, workers, hash_algorithm):
+    from arctool.archive import ArchiveDataSet
 
     archive_dataset = ArchiveDataSet.from_path(path)
 
     log_data = {'uuid': archive_dataset.uuid, 'path': path}
-    logger.emit('pre_create_manifest', log_data)
+    telemetry.emit('pre_create_manifest', log_data)
+
+    if hash_algorithm is not None \
+            and hash_algorithm != archive_dataset.hash_algorithm:
+        archive_dataset.set_hash_algorithm(hash_algorithm)
 
-    archive_dataset.update_manifest()
+    start = time.time()
+    n_bytes_hashed = archive_dataset.update_manifest(full=full,
+                                                     n_workers=workers)
+    seconds = time.time() - start
 
     click.secho('Created manifest', fg='green')
 
     log_data = {'uuid': archive_dataset.uuid,
-                'manifest': archive_dataset.manifest}
-    logger.emit('post_create_manifest', log_data)
+                'manifest': telemetry.summarise_manifest(
+                    archive_dataset.manifest),
+                'n_bytes_hashed': n_bytes_hashed,
+                'seconds': seconds}
+    telemetry.emit('post_create_manifest', log_data)
+    # Only the bytes hashed count, unchanged files are not read.
+    if n_bytes_hashed:
+        _record_run('manifest', n_bytes_hashed, workers, seconds)
 
     click.secho('Next: ', nl=False)
     click.secho('arctool archive create {}'.format(path), fg='cyan')
@@ -154,15 +215,47 @@ def archive():
 
 
 @archive.command()  # NOQA
+@click.option('--compress', '-z', is_flag=True, default=False,
+              help='Hash, tar and compress the data in a single pass.')
+@click.option('--cores', '-c', default=4,
+              help='Number of CPU cores to use for compression.')
+@click.option('--blocked', '-b', is_flag=True, default=False,
+              help='Compress into independent (BGZF style) gzip blocks.')
+@click.option('--resume', '-r', is_flag=True, default=False,
+              help='Resume from the last checkpoint of an interrupted run.')
+@click.option('--max-volume-size', type=float,
+              help='Split the archive into volumes of at most this many GiB.')
+@click.option('--incremental-from', type=click.Path(exists=True),
+              help='Archive only the files changed since this archive.')
+@click.option('--dedup', is_flag=True, default=False,
+              help='Reference files already stored in the dedup store.')
 @click.argument('path', 'Path to dataset directory.',
                 type=click.Path(exists=True))
-def create(path):
+def create(path, compress, cores, blocked, resume, max_volume_size,
+           incremental_from, dedup):
+    from dtool import DataSet
+    from arctool.utils import readme_yml_is_valid
+    from arctool.archive import (
+        ArchiveFile,
+        ArchiveFileBuilder,
+        ArchiveManifestError,
+    )
+    from arctool.dedup import DEDUP_KEY, DedupStore
+
     path = os.path.abspath(path)
 
+    if incremental_from and max_volume_size:
+        raise click.UsageError(
+            "--incremental-from cannot be used with --max-volume-size")
+    if dedup and (incremental_from or max_volume_size):
+        raise click.UsageError(
+            "--dedup cannot be used with --incremental-from or "
+            "--max-volume-size")
+
     dataset = DataSet.from_path(path)
     log_data = {'path': path,
                 'dataset_uuid': dataset.uuid}
-    logger.emit('pre_create_archive', log_data)
+    telemetry.emit('pre_create_archive', log_data)
 
     readme_path = dataset.abs_readme_path
     click.secho('Validating readme at: ', nl=False)
@@ -172,52 +265,170 @@ def create(path):
         click.secho("Not valid", fg='red')
         sys.exit(2)
 
-    archive_builder = ArchiveFileBuilder.from_path(path)
-    hacked_path = os.path.join(path, "..")
-    tar_file_path = archive_builder.persist_to_tar(hacked_path)
-
-#   tar_file_path = dtool.arctool.initialise_archive(path)
-
-#   def show_func(item):
-#       if item is None:
-#           return ''
-#       return str(item['path'])
-
-#   with click.progressbar(manifest_filedict,
-#                          length=tot_size,
-#                          item_show_func=show_func) as bar:
-#       for entry in bar:
-#           rpath = os.path.join('archive', entry['path'])
-#           append_to_tar_archive(path, rpath)
-#           bar.update(entry['size'])
-
     click.secho('Archiving data at: ', nl=False)
     click.secho(path, fg='green')
 
+    archive_builder = ArchiveFileBuilder.from_path(path)
+    hacked_path = os.path.join(path, "..")
+    total_bytes = manifest_size(dataset.manifest)
+    with _progress_bar('Archiving', total_bytes) as meter:
+        try:
+            if dedup:
+                with DedupStore() as store:
+                    tar_file_path = archive_builder.persist_deduplicated(
+                        hacked_path, store, compress=compress,
+                        n_threads=cores, blocked=blocked,
+                        progress=meter.update, resume=resume)
+            elif incremental_from:
+                tar_file_path = archive_builder.persist_incremental(
+                    hacked_path, incremental_from, compress=compress,
+                    n_threads=cores, blocked=blocked, progress=meter.update,
+                    resume=resume)
+            elif max_volume_size:
+                tar_file_path = archive_builder.persist_to_volumes(
+                    hacked_path, int(max_volume_size * 2 ** 30),
+                    compress=compress, n_threads=cores, blocked=blocked,
+                    progress=meter.update, resume=resume)
+            elif compress:
+                tar_file_path = archive_builder.persist_to_tar_gz(
+                    hacked_path, n_threads=cores, blocked=blocked,
+                    progress=meter.update, resume=resume)
+            else:
+                tar_file_path = archive_builder.persist_to_tar(
+                    hacked_path, progress=meter.update, resume=resume)
+        except ArchiveManifestError as e:
+            click.secho(str(e), fg='red')
+            click.secho('Update the manifest using: ', nl=False)
+            click.secho('arctool manifest create {}'.format(path),
+                        fg='cyan')
+            sys.exit(2)
+        except ValueError as e:
+            click.secho(str(e), fg='red')
+            sys.exit(2)
+
     click.secho('Created archive: ', nl=False)
     click.secho(tar_file_path, fg='green')
 
-    archive_size = os.stat(tar_file_path).st_size
+    if dedup:
+        archive_file = ArchiveFile.from_file(tar_file_path)
+        bytes_saved = archive_file.dataset_manifest[DEDUP_KEY]['bytes_saved']
+        click.secho('Deduplicated files: ', nl=False)
+        click.secho(str(len(archive_file.references)), fg='green', nl=False)
+        click.secho(', saving', nl=False)
+        click.secho(' {:.2f} GiB'.format(float(bytes_saved) / 2 ** 30),
+                    fg='green')
+
+    if max_volume_size:
+        volume_paths = [volume['path'] for volume
+                        in read_volume_index(tar_file_path)['volumes']]
+        click.secho('Volumes: ', nl=False)
+        click.secho(str(len(volume_paths)), fg='green')
+    else:
+        volume_paths = [tar_file_path]
+
+    archive_size = sum(os.stat(p).st_size for p in volume_paths)
     post_tar_log = {'dataset_uuid': dataset.uuid,
                     'archive_size': archive_size,
                     'output_tar_path': tar_file_path}
-    logger.emit('post_create_archive', post_tar_log)
+    post_tar_log.update(meter.summary())
+    telemetry.emit('post_create_archive', post_tar_log)
+    if compress:
+        # Hashing and tarring in the same pass as compressing, which
+        # dominates the time taken.
+        _record_run('compress', meter.n_bytes, cores, meter.seconds)
+    else:
+        _record_run('tar', meter.n_bytes, 1, meter.seconds)
 
     click.secho('Next: ', nl=False)
-    click.secho('arctool archive compress {}'.format(tar_file_path), fg='cyan')
+    if compress or max_volume_size:
+        click.secho('arctool verify full {}'.format(tar_file_path), fg='cyan')
+    else:
+        click.secho('arctool archive compress {}'.format(tar_file_path),
+                    fg='cyan')
+
+
+@archive.command(name='create-all')
+@click.option('--workers', '-w', default=2,
+              help='Number of datasets to archive at a time.')
+@click.option('--max-io', default=1,
+              help='Maximum number of disk bound steps to run at a time.')
+@click.option('--cores', '-c', default=4,
+              help='Number of CPU cores to use for compression in total.')
+@click.option('--cores-per-job', default=4,
+              help='Number of CPU cores for each compression.')
+@click.option('--output-path', type=click.Path(exists=True, file_okay=False),
+              help='Directory to write the archives to (default: PATH).')
+@click.argument('path', 'Path to project directory.',
+                type=click.Path(exists=True, file_okay=False))
+def create_all(path, workers, max_io, cores, cores_per_job, output_path):
+    from arctool.batch import BatchArchiver, find_datasets
+
+    dataset_paths = find_datasets(path)
+
+    click.secho('Archiving datasets in: ', nl=False)
+    click.secho(os.path.abspath(path), fg='green')
+    click.secho('Datasets found: ', nl=False)
+    click.secho(str(len(dataset_paths)), fg='green')
+
+    batch = BatchArchiver(output_path=output_path,
+                          n_workers=workers,
+                          max_io=max_io,
+                          cores=cores,
+                          cores_per_job=cores_per_job)
+
+    results = []
+    for result in batch.run(dataset_paths):
+        results.append(result)
+        telemetry.emit('post_create_all_dataset', result)
+        fg = 'red' if result['status'] == 'failed' else 'green'
+        click.secho('{}: '.format(result['name']), nl=False)
+        click.secho(result['status'], fg=fg)
+        if result['error']:
+            click.secho('  {}'.format(result['error']), fg='red')
+
+    click.secho('')
+    click.secho('{:<30} {:>8} {:>10} {:>10} {:>10}'.format(
+        'Dataset', 'Status', 'GB', 'Seconds', 'MB/s'))
+    for result in results:
+        seconds = max(result['seconds'], 1e-6)
+        mb_per_second = float(result['n_bytes']) / 1e6 / seconds
+        if result['status'] == 'skipped':
+            mb_per_second = 0.0
+        click.secho('{:<30} {:>8} {:>10.2f} {:>10.1f} {:>10.1f}'.format(
+            result['name'], result['status'], result['n_bytes'] / 1e9,
+            result['seconds'], mb_per_second))
+
+    if any(result['status'] == 'failed' for result in results):
+        sys.exit(1)
 
 
 @archive.command()
-@click.option('--cores', '-c', default=4, help='Number of CPU cores to use.')
+@click.option('--cores', '-c', type=int,
+              help='Number of CPU cores to use (default 4, or sized from the '
+                   'archive with --slurm).')
 @click.option('--slurm', '-s', is_flag=True, default=False,
               help='Rather than running compression, generate SLURM script.')
+@click.option('--index-span', default=64,
+              help='MiB between seek points in the index (0 for no index).')
+@click.option('--blocked', '-b', is_flag=True, default=False,
+              help='Compress into independent (BGZF style) gzip blocks.')
+@click.option('--block-size', default=4,
+              help='MiB of uncompressed data per block when using --blocked.')
 @click.argument('path', 'Path to uncompressed archive (tar) file.',
                 type=click.Path(exists=True))
-def compress(path, cores, slurm):
+def compress(path, cores, slurm, index_span, blocked, block_size):
+    from arctool.archive import (
+        ArchiveFile,
+        compress_archive,
+        compress_archive_blocked,
+    )
+
     path = os.path.abspath(path)
     archive = ArchiveFile.from_file(path)
 
     if not slurm:
+        if cores is None:
+            cores = 4
         click.secho('Compressing archive: ', nl=False)
         click.secho(path, fg='green')
 
@@ -225,9 +436,19 @@ def compress(path, cores, slurm):
                    'archive_path': path,
                    'cores': cores,
                    'tar_size': os.stat(path).st_size}
-        logger.emit('pre_compress_archive', pre_log)
-
-        compressed_archive_path = compress_archive(path, n_threads=cores)
+        telemetry.emit('pre_compress_archive', pre_log)
+
+        with _progress_bar('Compressing', pre_log['tar_size']) as meter:
+            if blocked:
+                compressed_archive_path = compress_archive_blocked(
+                    path, n_threads=cores,
+                    block_size=block_size * 1024 * 1024,
+                    progress=meter.update)
+            else:
+                compressed_archive_path = compress_archive(
+                    path, n_threads=cores,
+                    index_span=index_span * 1024 * 1024,
+                    progress=meter.update)
 
         click.secho('Created compressed file: ', nl=False)
         click.secho(compressed_archive_path, fg='green')
@@ -235,7 +456,9 @@ def compress(path, cores, slurm):
         post_log = {'dataset_uuid': archive.admin_metadata["uuid"],
                     'compressed_archive_path': compressed_archive_path,
                     'gzip_size': os.stat(compressed_archive_path).st_size}
-        logger.emit('post_compress_archive', post_log)
+        post_log.update(meter.summary())
+        telemetry.emit('post_compress_archive', post_log)
+        _record_run('compress', pre_log['tar_size'], cores, meter.seconds)
 
         click.secho('Now:')
         click.secho('  Move {} to archive storage'.format(
@@ -244,15 +467,85 @@ def compress(path, cores, slurm):
     # WARNING - be VERY careful automating this to submit the job - if the
     # logic fails, the job will repeatedly submit itself forever!
     else:
-        job_parameters = dict(n_cores=cores, partition="rg-sv")
-        command_string = "arctool archive compress -c {} {}".format(cores,
-                                                                    path)
+        job_parameters = Estimator().suggest(
+            'compress', os.stat(path).st_size, n_cores=cores)
+        job_parameters['partition'] = DEFAULT_PARTITION
+        cores = job_parameters['n_cores']
+        command_string = "arctool archive compress -c {} {}{}".format(
+            cores, compress_options(index_span, blocked, block_size), path)
 
         submit_string = generate_slurm_script(command_string, job_parameters)
 
         print(submit_string)
 
 
+@archive.command()
+@click.option('--index-span', default=64,
+              help='MiB between seek points in gzipped archives.')
+@click.argument('path', 'Path to archive (tar or tar.gz) file.',
+                type=click.Path(exists=True))
+def index(path, index_span):
+    from arctool.archive import ArchiveFile
+    from arctool.index import build_index, index_path, write_index
+    from arctool.manifest import compact_manifest_path, write_compact_manifest
+
+    path = os.path.abspath(path)
+
+    click.secho('Indexing archive: ', nl=False)
+    click.secho(path, fg='green')
+
+    archive_index = build_index(path, span=index_span * 1024 * 1024)
+    write_index(path, archive_index)
+
+    click.secho('Created index: ', nl=False)
+    click.secho(index_path(path), fg='green')
+
+    archive_file = ArchiveFile.from_file(path, compact=True)
+    manifest_path = compact_manifest_path(path)
+    write_compact_manifest(manifest_path, archive_file.dataset_manifest)
+
+    click.secho('Created compact manifest: ', nl=False)
+    click.secho(manifest_path, fg='green')
+
+
+@archive.command()
+@click.argument('archive_path', 'Path to archive.',
+                type=click.Path(exists=True))
+@click.argument('path', 'Path to dataset directory.',
+                type=click.Path(exists=True))
+def diff(archive_path, path):
+    from dtool import DataSet
+    from arctool.archive import ArchiveFile
+    from arctool.incremental import diff_manifests
+
+    archive_file = ArchiveFile.from_file(archive_path, compact=True)
+    dataset = DataSet.from_path(path)
+
+    try:
+        differences = diff_manifests(archive_file.dataset_manifest,
+                                     dataset.manifest)
+    except ValueError as e:
+        click.secho(str(e), fg='red')
+        sys.exit(2)
+
+    for key, mark, colour in (('added', 'A', 'green'),
+                              ('changed', 'M', 'yellow'),
+                              ('removed', 'D', 'red')):
+        for file_path in differences[key]:
+            click.secho("{} {}".format(mark, file_path), fg=colour)
+
+    click.secho("{} added, {} changed, {} removed, {} unchanged".format(
+        len(differences['added']),
+        len(differences['changed']),
+        len(differences['removed']),
+        differences['unchanged']))
+
+    if differences['added'] or differences['changed']:
+        click.secho('Next: ', nl=False)
+        click.secho('arctool archive create --incremental-from {} {}'.format(
+            archive_path, path), fg='cyan')
+
+
 @cli.group()
 def verify():
     pass
@@ -262,7 +555,9 @@ def verify():
 @click.argument('path', 'Path to compressed archive.',
                 type=click.Path(exists=True))
 def summary(path):
-    archive_file = ArchiveFile.from_file(path)
+    from arctool.archive import ArchiveFile
+
+    archive_file = ArchiveFile.from_file(path, compact=True)
     summary_data = archive_file.summarise()
 
     size_in_gibi = float(summary_data['total_size']) / (2 ** 30)
@@ -277,21 +572,240 @@ def summary(path):
 
 
 @verify.command()
+@click.option('--workers', '-w', default=1,
+              help='Number of hashing threads to use.')
+@click.option('--buffer-size', default=BUF_SIZE // 1024,
+              help='KiB read at a time when hashing.')
+@click.option('--journal', type=click.Path(dir_okay=False),
+              help='Journal of per file results (default with --resume: '
+                   'PATH{}).'.format(JOURNAL_SUFFIX))
+@click.option('--resume', '-r', is_flag=True, default=False,
+              help='Skip files that already have a result in the journal.')
+@click.option('--keep-going', '-k', is_flag=True, default=False,
+              help='Check every file rather than stopping at the first '
+                   'failure.')
 @click.argument('path', 'Path to compressed archive.',
                 type=click.Path(exists=True))
-def full(path):
+def full(path, workers, buffer_size, journal, resume, keep_going):
+    from arctool.archive import ArchiveFile
 
     click.secho("Performing full verification on:", nl=False)
     click.secho(" {}".format(path), fg='green')
 
-    archive_file = ArchiveFile.from_path(path)
-    result = archive_file.verify_all()
+    # Only journal when asked to, as the archive may be read only.
+    if journal is None and resume:
+        journal = journal_path(path)
+
+    archive_file = ArchiveFile.from_file(path, compact=True)
+    archive_file.buf_size = buffer_size * 1024
+    total_bytes = manifest_size(archive_file.manifest)
+    with _progress_bar('Verifying', total_bytes) as meter:
+        report = archive_file.verification_report(n_workers=workers,
+                                                  progress=meter.update,
+                                                  journal_path=journal,
+                                                  resume=resume,
+                                                  keep_going=keep_going)
+
+    for key in ('missing', 'extra', 'corrupt'):
+        for file_in_archive in report[key]:
+            click.secho("{}: ".format(key.capitalize()), fg='red', nl=False)
+            click.secho(file_in_archive)
+
+    _record_run('verify', report['n_bytes'], workers, report['seconds'])
+
+    seconds = max(report['seconds'], 1e-6)
+    mb_per_second = float(report['n_bytes']) / 1e6 / seconds
+    click.secho("Hashed", nl=False)
+    click.secho(" {:.2f} MB/s".format(mb_per_second), fg='green', nl=False)
+    click.secho(" using {} worker(s).".format(workers))
+
+    if journal is not None:
+        click.secho("Results recorded in:", nl=False)
+        click.secho(" {}".format(journal), fg='green')
 
     click.secho("Verification ", nl=False)
-    if result:
+    if not (report['missing'] or report['extra'] or report['corrupt']):
         click.secho("passed", fg='green')
     else:
         click.secho("failed", fg='red')
+        if not report['complete']:
+            click.secho('Stopped at the first failure; check the remaining '
+                        'files using: ', nl=False)
+            resume_options = ''
+            if journal is not None:
+                resume_options = '--journal {} --resume '.format(journal)
+            click.secho('arctool verify full {}--keep-going {}'.format(
+                resume_options, path), fg='cyan')
+        sys.exit(1)
+
+
+@cli.group()
+def slurm():
+    pass
+
+
+def _parse_throughput(values):
+    throughput = {}
+    for value in values:
+        step, _, mb_per_second = value.partition('=')
+        if step not in PIPELINE_STEPS:
+            raise click.BadParameter(
+                'Step must be one of: {}'.format(', '.join(PIPELINE_STEPS)))
+        try:
+            throughput[step] = float(mb_per_second)
+        except ValueError:
+            raise click.BadParameter(
+                'Expected STEP=MB/S, got: {}'.format(value))
+    return throughput
+
+
+@slurm.command()
+@click.option('--partition', '-p', default=DEFAULT_PARTITION,
+              help='SLURM partition to submit the jobs to.')
+@click.option('--max-cores', default=16,
+              help='Maximum number of cores for a compression job.')
+@click.option('--throughput', '-t', multiple=True, metavar='STEP=MB/S',
+              help='Measured throughput of a step, per core for compress; '
+                   'can be given for each step.')
+@click.option('--index-span', default=64,
+              help='MiB between seek points in the index (0 for no index).')
+@click.option('--blocked', '-b', is_flag=True, default=False,
+              help='Compress into independent (BGZF style) gzip blocks.')
+@click.option('--block-size', default=4,
+              help='MiB of uncompressed data per block when using --blocked.')
+@click.argument('paths', nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=False))
+def pipeline(paths, partition, max_cores, throughput, index_span, blocked,
+             block_size):
+    from dtool import DataSet, DtoolTypeError, NotDtoolObject
+    from arctool.archive import ArchiveDataSet
+    from arctool.batch import find_datasets
+
+    throughput = _parse_throughput(throughput)
+
+    dataset_paths = []
+    for path in paths:
+        try:
+            DataSet.from_path(path)
+            dataset_paths.append(os.path.abspath(path))
+        except (NotDtoolObject, DtoolTypeError):
+            dataset_paths.extend(find_datasets(path))
+
+    if not dataset_paths:
+        click.secho('No datasets found', fg='red')
+        sys.exit(2)
+
+    datasets = [ArchiveDataSet.from_path(p) for p in dataset_paths]
+    print(generate_pipeline_script(datasets, partition=partition,
+                                   throughput=throughput,
+                                   max_cores=max_cores,
+                                   estimator=Estimator(),
+                                   index_span=index_span,
+                                   blocked=blocked,
+                                   block_size=block_size))
+
+
+@cli.command()
+@click.option('--max-cores', default=16,
+              help='Maximum number of cores to suggest for compression.')
+@click.argument('path', 'Path to dataset directory or archive file.',
+                type=click.Path(exists=True))
+def estimate(path, max_cores):
+    from arctool.archive import ArchiveDataSet, ArchiveFile
+
+    path = os.path.abspath(path)
+
+    if os.path.isdir(path):
+        manifest = ArchiveDataSet.from_path(path).manifest
+        steps = PIPELINE_STEPS
+    else:
+        manifest = ArchiveFile.from_file(path).manifest
+        steps = ('verify',) if path.endswith('.gz') \
+            else ('compress', 'verify')
+    n_bytes = manifest_size(manifest)
+
+    click.secho('Estimates for', nl=False)
+    click.secho(' {:.2f} GiB'.format(float(n_bytes) / 2 ** 30),
+                fg='green', nl=False)
+    click.secho(' in {} files:'.format(len(manifest['file_list'])))
+
+    estimator = Estimator()
+    row = '{:<10} {:>6} {:>8} {:>10} {:>8} {:>6}'
+    click.secho(row.format('step', 'cores', 'memory', 'walltime', 'MB/s',
+                           'runs'))
+    for step in steps:
+        suggestion = estimator.suggest(step, n_bytes, max_cores=max_cores)
+        click.secho(row.format(step,
+                               suggestion['n_cores'],
+                               suggestion['memory'],
+                               suggestion['walltime'],
+                               '{:.1f}'.format(suggestion['mb_per_second']),
+                               suggestion['n_runs']))
+
+
+@cli.group()
+def dedup():
+    pass
+
+
+@dedup.command()
+@click.argument('paths', 'Paths to archives.', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+def add(paths):
+    from arctool.archive import ArchiveFile
+    from arctool.dedup import DedupStore
+
+    with DedupStore() as store:
+        for path in paths:
+            archive_file = ArchiveFile.from_file(path)
+            store.add_archive(archive_file, path)
+            click.secho('Added to dedup store: ', nl=False)
+            click.secho(os.path.abspath(path), fg='green')
+
+
+@dedup.command()
+def report():
+    from arctool.dedup import DedupStore
+
+    with DedupStore() as store:
+        archives = store.report()
+
+    row = '{:<30} {:>8} {:>10} {:>10} {:>10}'
+    click.secho(row.format('dataset', 'files', 'GiB', 'references',
+                           'GiB saved'))
+    for archive in archives:
+        click.secho(row.format(
+            archive['name'],
+            archive['n_files'],
+            '{:.2f}'.format(float(archive['total_size']) / 2 ** 30),
+            archive['n_references'],
+            '{:.2f}'.format(float(archive['bytes_saved']) / 2 ** 30)))
+
+    bytes_saved = sum(archive['bytes_saved'] for archive in archives)
+    click.secho('Total saved:', nl=False)
+    click.secho(' {:.2f} GiB'.format(float(bytes_saved) / 2 ** 30),
+                fg='green')
+
+
+@cli.group()
+def benchmark():
+    pass
+
+
+@benchmark.command()
+@click.option('--buffer-size', default=BUF_SIZE // 1024,
+              help='KiB passed to the hash function at a time.')
+@click.argument('path', 'Path to sample file.',
+                type=click.Path(exists=True, dir_okay=False))
+def hashing(path, buffer_size):
+
+    click.secho("Hashing throughput on:", nl=False)
+    click.secho(" {}".format(path), fg='green')
+
+    results = benchmark_hash_algorithms(path, buf_size=buffer_size * 1024)
+    for algorithm, mb_per_second in results:
+        click.secho("{:>10}".format(algorithm), nl=False)
+        click.secho(" {:10.2f} MB/s".format(mb_per_second), fg='green')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+"""Module for deduplicating files across archived datasets.
+
+Many datasets hold identical files, such as reference genomes and their
+indexes, that would otherwise be archived again and again. The dedup store
+is a local sqlite database, ``~/.arctool/dedup.sqlite`` (or
+``$ARCTOOL_DEDUP_STORE``), that indexes the files stored in each archive by
+their hash in the manifest.
+
+A deduplicated archive, see
+:meth:`arctool.archive.ArchiveFileBuilder.persist_deduplicated`, holds
+references in place of the files that are already stored in another
+archive. The manifest archived with it is the whole manifest of the dataset,
+with a 'dedup' key holding the references by path, and the bytes saved::
+
+    "dedup": {
+        "references": {
+            "genome/chr1.fa": {
+                "uuid": "af6727bf-29c7-43dd-b42f-a5d7ede28337",
+                "archive": "/archive/project/reference_genome.tar.gz",
+                "member": "reference_genome/archive/chr1.fa"
+            }
+        },
+        "bytes_saved": 254235226
+    }
+
+Referenced files are read from the referenced archive, which is looked for
+in the directory of the deduplicated archive before the path recorded.
+"""
+
+import os
+import time
+import sqlite3
+
+DEDUP_STORE_ENV_VAR = "ARCTOOL_DEDUP_STORE"
+
+#: Manifest key holding the references of a deduplicated archive.
+DEDUP_KEY = "dedup"
+
+#: Files smaller than this are always stored, as references save little.
+DEFAULT_MIN_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash_algorithm TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uuid TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (hash_algorithm, hash)
+);
+CREATE INDEX IF NOT EXISTS blobs_archive ON blobs (archive);
+CREATE TABLE IF NOT EXISTS archives (
+    archive TEXT PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    n_files INTEGER NOT NULL,
+    total_size INTEGER NOT NULL,
+    n_references INTEGER NOT NULL,
+    bytes_saved INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+"""
+
+
+def dedup_store_path():
+    """Return the path to the dedup store."""
+    default = os.path.join(os.path.expanduser("~"), ".arctool",
+                           "dedup.sqlite")
+    return os.environ.get(DEDUP_STORE_ENV_VAR, default)
+
+
+class DedupStore(object):
+    """Class for the index of the files stored in archives, by hash.
+
+    Can be used as a context manager, closing the database on exit.
+
+    :param path: path to the sqlite database, by default
+                 :func:`dedup_store_path`
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = dedup_store_path()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_archive(self, archive_file, archive_path):
+        """Index the files stored in an archive.
+
+        Files already indexed in another archive keep their first location.
+        Adding an archive again replaces what was indexed from it before, as
+        does adding a gzipped archive that was added before it was
+        compressed.
+
+        :param archive_file: :class:`arctool.archive.ArchiveFile`
+        :param archive_path: path to the archive
+        """
+        archive_path = os.path.abspath(archive_path)
+        uuid = archive_file.admin_metadata["uuid"]
+        hash_algorithm = archive_file.hash_algorithm
+        data_dir = archive_file._data_dir()
+        stored = archive_file.manifest["file_list"]
+        dedup = archive_file.dataset_manifest.get(DEDUP_KEY, {})
+
+        rows = ((hash_algorithm, entry["hash"], entry["size"], uuid,
+                 archive_path, os.path.join(data_dir, entry["path"]))
+                for entry in stored)
+        replaced = [archive_path]
+        if archive_path.endswith(".gz"):
+            replaced.append(archive_path[:-len(".gz")])
+
+        with self._connection:
+            for path in replaced:
+                self._connection.execute(
+                    "DELETE FROM blobs WHERE archive = ?", (path,))
+                self._connection.execute(
+                    "DELETE FROM archives WHERE archive = ?", (path,))
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO archives "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (archive_path,
+                 uuid,
+                 archive_file.admin_metadata["name"],
+                 len(stored),
+                 sum(entry["size"] for entry in stored),
+                 len(dedup.get("references", {})),
+                 dedup.get("bytes_saved", 0),
+                 time.time()))
+
+    def lookup(self, hash_algorithm, hexdigest):
+        """Return location of the file with a hash, or None.
+
+        :param hash_algorithm: name of the hash algorithm
+        :param hexdigest: hash of the file
+        :returns: dictionary with the 'uuid' of the dataset, the path to the
+                  'archive', the 'member' in the archive and the 'size'
+        """
+        row = self._connection.execute(
+            "SELECT uuid, archive, member, size FROM blobs "
+            "WHERE hash_algorithm = ? AND hash = ?",
+            (hash_algorithm, hexdigest)).fetchone()
+        if row is None:
+            return None
+        return {"uuid": row[0], "archive": row[1], "member": row[2],
+                "size": row[3]}
+
+    def find_references(self, hash_algorithm, manifest,
+                        min_size=DEFAULT_MIN_SIZE, exclude=None):
+        """Return references to stored copies of the files in a manifest.
+
+        :param hash_algorithm: name of the hash algorithm of the manifest
+        :param manifest: dataset manifest
+        :param min_size: smallest file to reference
+        :param exclude: path to an archive not to reference, such as the
+                        one about to be written, gzipped or not
+        :returns: dictionary of references by path
+        """
+        excluded = set()
+        if exclude is not None:
+            exclude = os.path.abspath(exclude)
+            if exclude.endswith(".gz"):
+                exclude = exclude[:-len(".gz")]
+            excluded = set([exclude, exclude + ".gz"])
+        references = {}
+        for entry in manifest["file_list"]:
+            if entry["size"] < min_size:
+                continue
+            location = self.lookup(hash_algorithm, entry["hash"])
+            if location is None or location["archive"] in excluded \
+                    or location["size"] != entry["size"]:
+                continue
+            references[entry["path"]] = {"uuid": location["uuid"],
+                                         "archive": location["archive"],
+                                         "member": location["member"]}
+        return references
+
+    def report(self):
+        """Return list of the archives indexed, oldest first.
+
+        :returns: list of dictionaries with the 'archive' path, the dataset
+                  'uuid' and 'name', the 'n_files' and 'total_size' stored,
+                  and the 'n_references' and 'bytes_saved' by deduplication
+        """
+        keys = ("archive", "uuid", "name", "n_files", "total_size",
+                "n_references", "bytes_saved")
+        rows = self._connection.execute(
+            "SELECT {} FROM archives ORDER BY added".format(", ".join(keys)))
+        return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,208 @@
+"""Module for estimating the resources needed to archive a dataset.
+
+The commands that do the heavy lifting record each run in a local history,
+a JSON lines file at ``~/.arctool/history.jsonl`` (or ``$ARCTOOL_HISTORY``):
+the step, the bytes processed, the cores used, the seconds taken and the
+peak memory used. For each step a throughput model is fitted to the recent
+history::
+
+    seconds = overhead_seconds + n_bytes / (mb_per_second * 1e6 * n_cores)
+
+where the cores only count for steps that scale with them, i.e. compress.
+The model is used to suggest the cores, memory and walltime for a new run.
+Steps without a history fall back on :data:`arctool.slurm.DEFAULT_THROUGHPUT`.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from arctool.slurm import (
+    DEFAULT_THROUGHPUT,
+    MULTICORE_STEPS,
+    size_job,
+)
+
+HISTORY_ENV_VAR = "ARCTOOL_HISTORY"
+
+#: Number of most recent runs of a step the model is fitted to.
+MAX_RUNS = 50
+
+#: Memory in MiB suggested for a step with no record of its memory use.
+DEFAULT_MEMORY_MB = 1024
+
+#: Suggested memory is the peak recorded multiplied by this.
+MEMORY_SAFETY_FACTOR = 1.5
+
+
+def history_path():
+    """Return the path to the history of runs."""
+    default = os.path.join(os.path.expanduser("~"), ".arctool",
+                           "history.jsonl")
+    return os.environ.get(HISTORY_ENV_VAR, default)
+
+
+def max_rss_mb():
+    """Return peak memory, in MiB, of this process and its children.
+
+    Returns None where this is not available.
+    """
+    if resource is None:
+        return None
+    max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports KiB, macOS bytes.
+    if sys.platform == "darwin":
+        max_rss = max_rss // 1024
+    return max_rss // 1024
+
+
+def record_run(step, n_bytes, n_cores, seconds, memory_mb=None, path=None):
+    """Append a run of a step to the history.
+
+    :param step: one of :data:`arctool.slurm.PIPELINE_STEPS`
+    :param n_bytes: number of bytes processed
+    :param n_cores: number of cores used
+    :param seconds: seconds taken
+    :param memory_mb: peak memory used in MiB
+    :param path: path to the history, by default :func:`history_path`
+    """
+    if path is None:
+        path = history_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    record = {"step": step,
+              "n_bytes": n_bytes,
+              "n_cores": n_cores,
+              "seconds": round(seconds, 3),
+              "memory_mb": memory_mb,
+              "timestamp": time.time()}
+    with open(path, "a") as fh:
+        fh.write(json.dumps(record) + "\n")
+
+
+def read_history(path=None):
+    """Return list of the runs in the history, oldest first.
+
+    Lines that cannot be parsed are ignored.
+    """
+    if path is None:
+        path = history_path()
+    if not os.path.isfile(path):
+        return []
+    records = []
+    with open(path) as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+class ThroughputModel(object):
+    """Model of the time taken by a step.
+
+    :param step: the step modelled
+    :param mb_per_second: throughput in MB/s, per core for compress
+    :param overhead_seconds: fixed time taken regardless of size
+    :param memory_mb: peak memory recorded in MiB, or None
+    :param n_runs: number of runs the model was fitted to
+    """
+
+    def __init__(self, step, mb_per_second, overhead_seconds=0.0,
+                 memory_mb=None, n_runs=0):
+        self.step = step
+        self.mb_per_second = mb_per_second
+        self.overhead_seconds = overhead_seconds
+        self.memory_mb = memory_mb
+        self.n_runs = n_runs
+
+    @classmethod
+    def fit(cls, step, records):
+        """Return model fitted by least squares to runs of a step.
+
+        Falls back on the default throughput if there are no usable runs.
+        """
+        points = []
+        memory = []
+        for record in records[-MAX_RUNS:]:
+            if record["n_bytes"] <= 0 or record["seconds"] <= 0:
+                continue
+            n_cores = record["n_cores"] if step in MULTICORE_STEPS else 1
+            points.append((float(record["n_bytes"]) / max(n_cores, 1),
+                           float(record["seconds"])))
+            if record.get("memory_mb"):
+                memory.append(record["memory_mb"])
+        memory_mb = max(memory) if memory else None
+
+        if not points:
+            return cls(step, DEFAULT_THROUGHPUT[step], memory_mb=memory_mb)
+
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_t = sum(t for _, t in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        slope = None
+        if var_x > 0:
+            slope = sum((x - mean_x) * (t - mean_t) for x, t in points) / var_x
+            overhead = mean_t - slope * mean_x
+        if slope is None or slope <= 0 or overhead < 0:
+            # Fit through the origin instead.
+            slope = sum(x * t for x, t in points) \
+                / sum(x * x for x, _ in points)
+            overhead = 0.0
+
+        return cls(step, 1.0 / slope / 1e6, overhead, memory_mb, n)
+
+
+class Estimator(object):
+    """Class for suggesting the resources for a step from the run history.
+
+    :param path: path to the history, by default :func:`history_path`
+    """
+
+    def __init__(self, path=None):
+        self._records = {}
+        for record in read_history(path):
+            self._records.setdefault(record["step"], []).append(record)
+
+    def model(self, step):
+        """Return :class:`ThroughputModel` of a step."""
+        return ThroughputModel.fit(step, self._records.get(step, []))
+
+    def suggest(self, step, n_bytes, n_cores=None, max_cores=16):
+        """Return dictionary of suggested resources for a run of a step.
+
+        :param step: one of :data:`arctool.slurm.PIPELINE_STEPS`
+        :param n_bytes: number of bytes to process
+        :param n_cores: number of cores to use, rather than suggesting it
+        :param max_cores: maximum number of cores to suggest
+        :returns: dictionary with the 'n_cores', 'walltime' and 'memory', as
+                  SLURM job parameters, and the 'mb_per_second' and
+                  'n_runs' of the model
+        """
+        model = self.model(step)
+        suggestion = size_job(step, n_bytes,
+                              mb_per_second=model.mb_per_second,
+                              overhead_seconds=model.overhead_seconds,
+                              n_cores=n_cores,
+                              max_cores=max_cores)
+
+        memory_mb = DEFAULT_MEMORY_MB
+        if model.memory_mb is not None:
+            memory_mb = max(model.memory_mb * MEMORY_SAFETY_FACTOR, 256)
+            # Round up to a multiple of 256 MiB.
+            memory_mb = int(math.ceil(memory_mb / 256.0)) * 256
+        suggestion["memory"] = "{}M".format(memory_mb)
+        suggestion["mb_per_second"] = model.mb_per_second
+        suggestion["n_runs"] = model.n_runs
+        return suggestion
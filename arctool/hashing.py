@@ -0,0 +1,155 @@
+"""Module for the hash algorithms used in manifests and verification.
+
+The algorithm used for a dataset is recorded in its admin metadata, under
+``hash_algorithm``, and chosen from :data:`HASH_ALGORITHMS`. SHA-1 remains
+the default, for compatibility with existing archives. xxh3 and blake3 are
+available if the optional ``xxhash`` and ``blake3`` packages are installed.
+
+Each algorithm also has a file hash function that is registered with dtool,
+so that dtool can read manifests created with it. dtool is only imported
+when the functions are registered, see :func:`register_file_hash_functions`.
+"""
+
+import time
+import hashlib
+
+#: Default number of bytes read at a time when hashing.
+BUF_SIZE = 65536
+
+DEFAULT_HASH_ALGORITHM = "sha1"
+
+#: Hash algorithm names and the functions returning new hash objects.
+HASH_ALGORITHMS = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "md5": hashlib.md5,
+}
+
+if hasattr(hashlib, "blake2b"):
+    HASH_ALGORITHMS["blake2b"] = hashlib.blake2b
+
+try:
+    import xxhash
+    HASH_ALGORITHMS["xxh3"] = xxhash.xxh3_64
+except (ImportError, AttributeError):
+    pass
+
+try:
+    import blake3
+    HASH_ALGORITHMS["blake3"] = blake3.blake3
+except ImportError:
+    pass
+
+
+def new_hasher(algorithm):
+    """Return a new hash object.
+
+    :param algorithm: name of the hash algorithm
+    :raises: ValueError if the algorithm is not available
+    :returns: hash object with update and hexdigest methods
+    """
+    try:
+        return HASH_ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError("Unknown hash algorithm: {}; choose from: {}".format(
+            algorithm, ", ".join(sorted(HASH_ALGORITHMS))))
+
+
+def hash_from_file_object(f, algorithm=DEFAULT_HASH_ALGORITHM,
+                          buf_size=BUF_SIZE):
+    """Return hex digest of the data read from a file object.
+
+    :param f: file object
+    :param algorithm: name of the hash algorithm
+    :param buf_size: number of bytes to read at a time
+    :returns: hex digest
+    """
+    hasher = new_hasher(algorithm)
+    buf = f.read(buf_size)
+    while len(buf) > 0:
+        hasher.update(buf)
+        buf = f.read(buf_size)
+
+    return hasher.hexdigest()
+
+
+def _file_hash_function(algorithm):
+    def file_hash(filename):
+        with open(filename, "rb") as fh:
+            return hash_from_file_object(fh, algorithm)
+    # dtool records the name of the function in the manifest.
+    file_hash.__name__ = algorithm + "sum"
+    return file_hash
+
+
+# Names used by dtool for its own file hash functions.
+_DTOOL_FILE_HASH_FUNCTIONS = {
+    "sha1": "shasum",
+    "md5": "md5sum",
+}
+
+
+def _file_hash_function_name(algorithm):
+    return _DTOOL_FILE_HASH_FUNCTIONS.get(algorithm, algorithm + "sum")
+
+
+def register_file_hash_functions():
+    """Register the file hash function of each algorithm with dtool.
+
+    dtool's own functions are used for sha1 and md5. Calling this more than
+    once has no effect.
+    """
+    from dtool.filehasher import HASH_FUNCTIONS
+    for algorithm in HASH_ALGORITHMS:
+        name = _file_hash_function_name(algorithm)
+        if name not in HASH_FUNCTIONS:
+            HASH_FUNCTIONS[name] = _file_hash_function(algorithm)
+
+
+def file_hash_function(algorithm):
+    """Return function hashing a file, for use in dtool manifests.
+
+    :param algorithm: name of the hash algorithm
+    :raises: ValueError if the algorithm is not available
+    """
+    from dtool.filehasher import HASH_FUNCTIONS
+    new_hasher(algorithm)
+    register_file_hash_functions()
+    return HASH_FUNCTIONS[_file_hash_function_name(algorithm)]
+
+
+def algorithm_from_manifest(manifest):
+    """Return name of the hash algorithm used in a dtool manifest."""
+    name = manifest.get("hash_function", _DTOOL_FILE_HASH_FUNCTIONS["sha1"])
+    for algorithm, dtool_name in _DTOOL_FILE_HASH_FUNCTIONS.items():
+        if dtool_name == name:
+            return algorithm
+    return name[:-len("sum")]
+
+
+def benchmark_hash_algorithms(path, buf_size=BUF_SIZE,
+                              max_bytes=256 * 1024 * 1024):
+    """Return hashing throughput of each available algorithm on a file.
+
+    Up to max_bytes of the file are read into memory first, so that the
+    results measure hashing rather than disk speed.
+
+    :param path: path to sample file
+    :param buf_size: number of bytes to pass to the hash object at a time
+    :param max_bytes: maximum number of bytes of the file to hash
+    :returns: list of (algorithm, MB/s) tuples, fastest first
+    """
+    with open(path, "rb") as fh:
+        data = memoryview(fh.read(max_bytes))
+
+    results = []
+    for algorithm in sorted(HASH_ALGORITHMS):
+        hasher = new_hasher(algorithm)
+        start = time.time()
+        for i in range(0, len(data), buf_size):
+            hasher.update(data[i:i + buf_size])
+        hasher.hexdigest()
+        seconds = max(time.time() - start, 1e-9)
+        results.append((algorithm, len(data) / 1e6 / seconds))
+
+    return sorted(results, key=lambda result: result[1], reverse=True)
@@ -0,0 +1,96 @@
+"""Module for incremental archives.
+
+Datasets are often archived again after files have been added to them. An
+incremental archive holds only the files that are new or have changed since
+a base archive of the dataset, which is compared with the current manifest
+by path and hash.
+
+The manifest archived with an incremental archive is the whole manifest of
+the dataset, with an 'incremental' key referencing the base archive::
+
+    "incremental": {
+        "base_uuid": "af6727bf-29c7-43dd-b42f-a5d7ede28337",
+        "base_archive": "data_set_1.tar.gz",
+        "base_manifest_hash": "5e1ff15d9f3a8cd5a8a1e5a0b0e8a1b7e2c9f1a3",
+        "paths": ["new_file.txt", "changed_file.txt"],
+        "removed": ["deleted_file.txt"]
+    }
+
+The 'paths' are the files held by the incremental archive; the others are
+held by the base archive, or by its own base if that is also incremental.
+The 'base_manifest_hash', see :func:`arctool.manifest.manifest_hash`,
+identifies the version of the dataset in the base archive, since the
+archives of a dataset share its UUID.
+"""
+
+import os
+
+from arctool.manifest import manifest_hash
+
+#: Manifest key referencing the base of an incremental archive.
+INCREMENTAL_KEY = "incremental"
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """Return dictionary of the differences between two manifests.
+
+    Files are compared by path and hash.
+
+    :param old_manifest: manifest of the earlier version of a dataset
+    :param new_manifest: manifest of the later version
+    :raises: ValueError if the manifests use different hash functions
+    :returns: dictionary with sorted lists of the paths 'added', 'changed'
+              and 'removed', and the number of files 'unchanged'
+    """
+    old_function = old_manifest.get("hash_function")
+    new_function = new_manifest.get("hash_function")
+    if old_function != new_function:
+        raise ValueError(
+            "Manifests use different hash functions: {} and {}".format(
+                old_function, new_function))
+
+    old_hashes = dict((entry["path"], entry["hash"])
+                      for entry in old_manifest["file_list"])
+    added, changed = [], []
+    unchanged = 0
+    for entry in new_manifest["file_list"]:
+        old_hash = old_hashes.pop(entry["path"], None)
+        if old_hash is None:
+            added.append(entry["path"])
+        elif old_hash != entry["hash"]:
+            changed.append(entry["path"])
+        else:
+            unchanged += 1
+
+    return {"added": sorted(added),
+            "changed": sorted(changed),
+            "removed": sorted(old_hashes),
+            "unchanged": unchanged}
+
+
+def incremental_name(name, manifest):
+    """Return name of an incremental archive of a version of a dataset.
+
+    The name is the dataset name followed by the start of the manifest hash,
+    so that it does not overwrite its base and is the same when resumed.
+
+    :param name: dataset name
+    :param manifest: manifest of the version archived
+    """
+    return "{}.delta-{}".format(name, manifest_hash(manifest)[:8])
+
+
+def incremental_reference(base_archive_file, base_path, diff):
+    """Return the reference to a base archive recorded in the manifest.
+
+    :param base_archive_file: :class:`arctool.archive.ArchiveFile` of the
+                              base archive
+    :param base_path: path to the base archive
+    :param diff: differences from the base, see :func:`diff_manifests`
+    """
+    return {"base_uuid": base_archive_file.admin_metadata["uuid"],
+            "base_archive": os.path.basename(base_path),
+            "base_manifest_hash": manifest_hash(
+                base_archive_file.dataset_manifest),
+            "paths": sorted(diff["added"] + diff["changed"]),
+            "removed": diff["removed"]}
@@ -0,0 +1,459 @@
+"""Module for random access member indexes stored alongside archives.
+
+An index is a JSON sidecar file, ``<archive>.idx``, recording the header
+offset, data offset and size of every file in the tarball.
+
+An index records the size of the archive and a fingerprint of its first and
+last bytes, and is ignored if they no longer match, such as when the archive
+has been rebuilt. As a tarball padded to whole records can be rebuilt with
+the same size and the same first and last bytes, the tar header at the
+offset of a member is also checked to name the member before it is read.
+
+For gzipped archives the index also records zran style seek points: places
+in the compressed stream where decompression can be restarted, together
+with the uncompressed offset and the 32 KiB of uncompressed data preceding
+it (the dictionary window). Seek points are found at the byte aligned sync
+markers that pigz writes between its blocks, and at the start of each gzip
+member of a multi-member file. Each candidate is validated by restarting
+decompression from it before it is recorded.
+"""
+
+import os
+import sys
+import json
+import zlib
+import base64
+import hashlib
+import tarfile
+
+INDEX_SUFFIX = ".idx"
+
+#: Default number of uncompressed bytes between gzip seek points.
+DEFAULT_SPAN = 64 * 1024 * 1024
+
+WINDOW_SIZE = 32768
+READ_SIZE = 1024 * 1024
+
+#: Bytes at the start and at the end of an archive in its fingerprint.
+FINGERPRINT_SIZE = 64 * 1024
+
+# Empty stored deflate block that byte aligns the stream (a sync flush).
+_SYNC_MARKER = b"\x00\x00\xff\xff"
+_GZIP_MAGIC = b"\x1f\x8b"
+_GZIP_WBITS = 31
+_RAW_WBITS = -15
+_VALIDATE_SIZE = 16384
+
+# The zdict argument to zlib.decompressobj requires Python 3.3.
+_ZDICT_SUPPORTED = sys.version_info >= (3, 3)
+
+
+class IndexMismatchError(ValueError):
+    """Raised when an index does not match the archive it is read with."""
+
+
+def index_path(archive_path):
+    """Return the path to the index sidecar file of an archive."""
+    return archive_path + INDEX_SUFFIX
+
+
+def archive_identity(archive_path):
+    """Return the size and fingerprint of an archive, as in its index.
+
+    The fingerprint is the SHA-1 hash of the first and last
+    :data:`FINGERPRINT_SIZE` bytes of the archive.
+
+    :param archive_path: path to .tar or .tar.gz file
+    :returns: dictionary with the 'archive_size' and 'archive_fingerprint'
+    """
+    size = os.stat(archive_path).st_size
+    hasher = hashlib.sha1()
+    with open(archive_path, "rb") as fh:
+        hasher.update(fh.read(FINGERPRINT_SIZE))
+        if size > FINGERPRINT_SIZE:
+            fh.seek(max(FINGERPRINT_SIZE, size - FINGERPRINT_SIZE))
+            hasher.update(fh.read())
+    return {"archive_size": size,
+            "archive_fingerprint": hasher.hexdigest()}
+
+
+def _encode_window(window):
+    return base64.b64encode(zlib.compress(window)).decode("ascii")
+
+
+def _decode_window(encoded):
+    return zlib.decompress(base64.b64decode(encoded.encode("ascii")))
+
+
+def _seek_point(compressed_offset, uncompressed_offset, window=None):
+    if window is not None:
+        window = _encode_window(window)
+    return {"compressed_offset": compressed_offset,
+            "uncompressed_offset": uncompressed_offset,
+            "window": window}
+
+
+def _header_matches(header, member_entry):
+    """Return True if tar header blocks are those of an index entry.
+
+    The last block is the header of the member itself; any before it hold a
+    long name, which is looked for in them.
+    """
+    if len(header) < tarfile.BLOCKSIZE:
+        return False
+    block = header[-tarfile.BLOCKSIZE:]
+    try:
+        if sys.version_info >= (3,):
+            tarinfo = tarfile.TarInfo.frombuf(block, tarfile.ENCODING,
+                                              "surrogateescape")
+        else:
+            tarinfo = tarfile.TarInfo.frombuf(block)
+    except tarfile.TarError:
+        return False
+    if len(header) == len(block):
+        return tarinfo.name == member_entry["path"] \
+            and tarinfo.size == member_entry["size"]
+    return member_entry["path"].encode("utf-8") in header[:-len(block)]
+
+
+def _member_entry(member):
+    return {"path": member.name,
+            "offset": member.offset,
+            "offset_data": member.offset_data,
+            "size": member.size}
+
+
+class _GzipIndexer(object):
+    """File like object decompressing a gzip file and finding seek points."""
+
+    def __init__(self, fileobj, span):
+        self._fileobj = fileobj
+        self._span = span
+        self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+        self._compressed_offset = 0
+        self._uncompressed_offset = 0
+        self._window = b""
+        self._buffer = b""
+        self._buffer_pos = 0
+        self._eof = False
+        self._last_point = 0
+        self.seek_points = [_seek_point(0, 0)]
+
+    def _advance(self, output):
+        self._uncompressed_offset += len(output)
+        if len(output) >= WINDOW_SIZE:
+            self._window = output[-WINDOW_SIZE:]
+        else:
+            self._window = (self._window + output)[-WINDOW_SIZE:]
+
+    def _point_is_due(self):
+        return self._uncompressed_offset - self._last_point >= self._span
+
+    def _add_point(self, compressed_offset, window):
+        self.seek_points.append(_seek_point(
+            compressed_offset, self._uncompressed_offset, window))
+        self._last_point = self._uncompressed_offset
+
+    def _decompress(self, data, offset):
+        """Return output from feeding data, starting at compressed offset."""
+        output = []
+        while data:
+            out = self._decompressor.decompress(data)
+            output.append(out)
+            self._advance(out)
+            leftover = self._decompressor.unused_data
+            if not leftover:
+                break
+
+            # End of a gzip member; anything that follows is a new member.
+            if not leftover.startswith(_GZIP_MAGIC):
+                self._eof = True
+                break
+            offset = offset + len(data) - len(leftover)
+            self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+            if self._point_is_due():
+                self._add_point(offset, None)
+            data = leftover
+        return b"".join(output)
+
+    def _try_sync_point(self, compressed_offset, lookahead):
+        """Record a seek point if decompression can restart at the offset."""
+        if len(lookahead) < _VALIDATE_SIZE:
+            return
+        expected = self._decompressor.copy().decompress(lookahead)
+        try:
+            restarted = zlib.decompressobj(_RAW_WBITS, zdict=self._window)
+            actual = restarted.decompress(lookahead)
+        except zlib.error:
+            return
+        if actual and actual == expected:
+            self._add_point(compressed_offset, self._window)
+
+    def _feed(self, data):
+        output = []
+        pos = 0
+        while pos < len(data) and not self._eof:
+            split = -1
+            if _ZDICT_SUPPORTED:
+                split = data.find(_SYNC_MARKER, pos)
+            if split < 0:
+                output.append(self._decompress(data[pos:],
+                                               self._compressed_offset + pos))
+                break
+            split += len(_SYNC_MARKER)
+            output.append(
+                self._decompress(data[pos:split],
+                                 self._compressed_offset + pos))
+            pos = split
+            if self._point_is_due():
+                self._try_sync_point(self._compressed_offset + pos,
+                                     data[pos:pos + _VALIDATE_SIZE])
+        self._compressed_offset += len(data)
+        return b"".join(output)
+
+    def read(self, size=-1):
+        while self._buffer_pos >= len(self._buffer) and not self._eof:
+            data = self._fileobj.read(READ_SIZE)
+            if not data:
+                self._eof = True
+                break
+            self._buffer = self._feed(data)
+            self._buffer_pos = 0
+
+        if size < 0:
+            size = len(self._buffer) - self._buffer_pos
+        data = self._buffer[self._buffer_pos:self._buffer_pos + size]
+        self._buffer_pos += len(data)
+        return data
+
+
+def build_index(archive_path, span=DEFAULT_SPAN):
+    """Return index of the members, and gzip seek points, of an archive.
+
+    For gzipped archives this decompresses the whole archive once.
+
+    :param archive_path: path to .tar or .tar.gz file
+    :param span: minimum number of uncompressed bytes between seek points
+    :returns: index as a dictionary
+    """
+    members = []
+    seek_points = []
+
+    with open(archive_path, "rb") as fh:
+        is_gzip = fh.read(2) == _GZIP_MAGIC
+        fh.seek(0)
+        if is_gzip:
+            indexer = _GzipIndexer(fh, span)
+            with tarfile.open(fileobj=indexer, mode="r|") as tar:
+                for member in tar:
+                    if member.isfile():
+                        members.append(_member_entry(member))
+            seek_points = indexer.seek_points
+        else:
+            with tarfile.open(fileobj=fh, mode="r:") as tar:
+                for member in tar:
+                    if member.isfile():
+                        members.append(_member_entry(member))
+
+    index = archive_identity(archive_path)
+    index.update({"members": members,
+                  "seek_points": seek_points})
+    return index
+
+
+def write_index(archive_path, index):
+    """Write index to the sidecar file of the archive.
+
+    The size and fingerprint of the archive, see :func:`archive_identity`,
+    are recorded with the index.
+    """
+    index = dict(index)
+    index.update(archive_identity(archive_path))
+    with open(index_path(archive_path), "w") as fh:
+        json.dump(index, fh)
+
+
+def read_index(archive_path):
+    """Return index of the archive, or None.
+
+    None is returned if there is no index, or if it does not match the
+    size and fingerprint of the archive.
+    """
+    path = index_path(archive_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as fh:
+        index = json.load(fh)
+    identity = archive_identity(archive_path)
+    if any(index.get(key) != value for key, value in identity.items()):
+        return None
+    return index
+
+
+def _inflate_from(fh, point):
+    """Yield decompressed chunks, restarting decompression at seek point."""
+    fh.seek(point["compressed_offset"])
+    if point["window"] is None:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+    else:
+        window = _decode_window(point["window"])
+        decompressor = zlib.decompressobj(_RAW_WBITS, zdict=window)
+
+    data = fh.read(READ_SIZE)
+    while data:
+        yield decompressor.decompress(data)
+        leftover = decompressor.unused_data
+        if leftover:
+            if point["window"] is not None:
+                # A raw deflate stream is followed by the gzip trailer.
+                while len(leftover) < 10:
+                    more = fh.read(READ_SIZE)
+                    if not more:
+                        break
+                    leftover += more
+                leftover = leftover[8:]
+                point = {"window": None}
+            if not leftover.startswith(_GZIP_MAGIC):
+                return
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            data = leftover
+        else:
+            data = fh.read(READ_SIZE)
+
+
+def _read_from(fh, offset):
+    fh.seek(offset)
+    data = fh.read(READ_SIZE)
+    while data:
+        yield data
+        data = fh.read(READ_SIZE)
+
+
+class _RangeReader(object):
+    """File like object reading a range of bytes from a stream of chunks.
+
+    A size of None reads to the end of the stream.
+    """
+
+    def __init__(self, fh, chunks, skip, size):
+        self._fh = fh
+        self._chunks = chunks
+        self._skip = skip
+        self._remaining = size
+        self._buffer = b""
+        self._buffer_pos = 0
+
+    def read(self, size=-1):
+        if self._remaining is not None:
+            if size < 0 or size > self._remaining:
+                size = self._remaining
+        output = []
+        while size != 0:
+            if self._buffer_pos >= len(self._buffer):
+                try:
+                    self._buffer = next(self._chunks)
+                except StopIteration:
+                    break
+                self._buffer_pos = 0
+                if self._skip:
+                    skipped = min(self._skip, len(self._buffer))
+                    self._buffer_pos = skipped
+                    self._skip -= skipped
+                    continue
+            if size < 0:
+                data = self._buffer[self._buffer_pos:]
+            else:
+                data = self._buffer[self._buffer_pos:self._buffer_pos + size]
+                size -= len(data)
+            self._buffer_pos += len(data)
+            if self._remaining is not None:
+                self._remaining -= len(data)
+            output.append(data)
+        return b"".join(output)
+
+    def unread(self, data):
+        """Return data just read to the front of the stream."""
+        self._buffer = data + self._buffer[self._buffer_pos:]
+        self._buffer_pos = 0
+        if self._remaining is not None:
+            self._remaining += len(data)
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _open_checked(archive_path, index, member_entry, size):
+    """Return reader from the header of a member, checking the header.
+
+    :raises: IndexMismatchError if the header is not that of the member
+    """
+    header_size = member_entry["offset_data"] - member_entry["offset"]
+    if size is not None:
+        size += header_size
+    reader = _open_range(archive_path, index, member_entry["offset"], size)
+    header = reader.read(header_size)
+    if not _header_matches(header, member_entry):
+        reader.close()
+        raise IndexMismatchError(
+            "{} is not at offset {} of {}".format(
+                member_entry["path"], member_entry["offset"], archive_path))
+    return reader, header
+
+
+def _open_range(archive_path, index, offset, size):
+    fh = open(archive_path, "rb")
+    if not index["seek_points"]:
+        return _RangeReader(fh, _read_from(fh, offset), 0, size)
+
+    usable = [p for p in index["seek_points"]
+              if p["window"] is None or _ZDICT_SUPPORTED]
+    point = max((p for p in usable if p["uncompressed_offset"] <= offset),
+                key=lambda p: p["uncompressed_offset"])
+    return _RangeReader(fh, _inflate_from(fh, point),
+                        offset - point["uncompressed_offset"],
+                        size)
+
+
+def open_member(archive_path, index, member_entry):
+    """Return file like object for reading the data of an archive member.
+
+    Seeks directly to the member in plain tar files, and to the nearest
+    preceding seek point in gzipped tar files.
+
+    :param archive_path: path to .tar or .tar.gz file
+    :param index: index of the archive
+    :param member_entry: entry for the member from the index
+    :raises: IndexMismatchError if the member is not where the index says
+    :returns: file like object
+    """
+    reader, _ = _open_checked(archive_path, index, member_entry,
+                              member_entry["size"])
+    return reader
+
+
+def open_from(archive_path, index, offset):
+    """Return file like object reading the uncompressed tar from an offset.
+
+    Reading continues to the end of the archive. Starting at the header
+    offset of a member gives a tar stream starting with that member.
+
+    :param archive_path: path to .tar or .tar.gz file
+    :param index: index of the archive
+    :param offset: uncompressed offset to start reading from
+    :raises: IndexMismatchError if the offset is that of a member that is
+             not where the index says
+    :returns: file like object
+    """
+    member_entry = next((entry for entry in index["members"]
+                         if entry["offset"] == offset), None)
+    if member_entry is None:
+        return _open_range(archive_path, index, offset, None)
+    reader, header = _open_checked(archive_path, index, member_entry, None)
+    reader.unread(header)
+    return reader
@@ -0,0 +1,73 @@
+"""Module for journals of per file verification results.
+
+As an archive is verified, the result for each file is appended to a JSON
+lines journal, by default ``<archive>.verify.jsonl``. Each record has the
+file's path, the hash expected from the manifest, the hash calculated from
+the archive, the number of bytes and the seconds taken. Files in the archive
+that are not in the manifest are recorded with an expected hash of None.
+
+An interrupted verification can be resumed from its journal, skipping the
+files that already have a result.
+"""
+
+import json
+import collections
+
+JOURNAL_SUFFIX = ".verify.jsonl"
+
+
+def journal_path(archive_path):
+    """Return the default path to the verification journal of an archive."""
+    return archive_path + JOURNAL_SUFFIX
+
+
+def verification_record(path, expected, actual, n_bytes=0, seconds=0.0):
+    """Return a journal record of the result of verifying a file."""
+    return {"path": path,
+            "expected": expected,
+            "actual": actual,
+            "bytes": n_bytes,
+            "seconds": round(seconds, 6)}
+
+
+def record_passed(record):
+    """Return True if the record is of a file that verified."""
+    return record["expected"] is not None \
+        and record["actual"] == record["expected"]
+
+
+class VerificationJournal(object):
+    """Class for appending results to a verification journal.
+
+    :param path: path to the journal
+    :param append: append to an existing journal, rather than starting a new
+                   one
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self._fh = open(path, "a" if append else "w")
+
+    def append(self, record):
+        self._fh.write(json.dumps(record) + "\n")
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
+
+def read_journal(path):
+    """Return ordered dictionary of the records in a journal, by path.
+
+    Later records for a path replace earlier ones. An incomplete last line,
+    from an interrupted run, is ignored.
+    """
+    records = collections.OrderedDict()
+    with open(path) as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            records[record["path"]] = record
+    return records
@@ -0,0 +1,591 @@
+"""Module for a compact representation of dataset manifests.
+
+The manifest of a dataset with millions of files takes gigabytes of memory
+as a list of dictionaries. :class:`CompactManifest` stores the file list in
+columns instead: the paths as a list of interned strings, the hashes as raw
+bytes in one contiguous buffer and the sizes, mtimes and inodes in arrays.
+It can be used as the dictionary it replaces, but is read only; the entries
+of its file list are dictionaries built on access.
+
+Manifests are parsed from a stream by :func:`iter_manifest_entries`, which
+yields the entries of the file list one at a time, so that a compact manifest
+is built without holding the JSON document, or a list of dictionaries, in
+memory.
+
+A compact manifest can be written to a binary companion file,
+``<archive>.manifest.bin``, which is memory mapped when read, so that the
+manifest of an archive is available without parsing its JSON. The file
+starts with a magic string and the length of a JSON header, holding the
+other keys of the manifest and the layout of the columns. The columns
+follow, each starting at a multiple of 8 bytes, as little endian integers
+and doubles, the raw hashes, and the UTF-8 encoded paths with their offsets.
+"""
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import hashlib
+import binascii
+import codecs
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+COMPACT_MANIFEST_SUFFIX = ".manifest.bin"
+
+_MAGIC = b"ARCMAN01"
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    # Python 2 can only intern byte strings.
+    def _intern(s):
+        return s
+
+# Entry keys stored in columns; any others are kept per entry.
+_COLUMN_KEYS = ("path", "hash", "size", "mtime", "inode", "mimetype")
+
+# Column keys that not every entry has, other than the inode.
+_OPTIONAL_KEYS = ("size", "mtime", "mimetype")
+
+# Stands in for an entry without an inode.
+_NO_INODE = -1
+
+#: Bytes read from a manifest stream at a time.
+READ_SIZE = 1024 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+
+def compact_manifest_path(archive_path):
+    """Return path to the compact manifest companion file of an archive."""
+    return archive_path + COMPACT_MANIFEST_SUFFIX
+
+
+def _to_bytes(column):
+    if isinstance(column, array.array):
+        if sys.byteorder == "big":
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        if hasattr(column, "tobytes"):
+            return column.tobytes()
+        return column.tostring()
+    return bytes(column)
+
+
+def _from_bytes(typecode, data):
+    column = array.array(typecode)
+    if hasattr(column, "frombytes"):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def manifest_hash(manifest):
+    """Return sha1 hexdigest of the paths, sizes and hashes in a manifest.
+
+    Identifies the contents of a dataset, regardless of the mtimes and other
+    metadata of its files.
+    """
+    hasher = hashlib.sha1()
+    for entry in manifest["file_list"]:
+        line = u"{}\t{}\t{}\n".format(entry["path"], entry["size"],
+                                      entry["hash"])
+        hasher.update(line.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def manifest_size(manifest):
+    """Return the total size in bytes of the files in a manifest.
+
+    :param manifest: dataset manifest, a dictionary or a
+                     :class:`CompactManifest`
+    """
+    if isinstance(manifest, CompactManifest):
+        return manifest.total_size()
+    return sum(entry["size"] for entry in manifest["file_list"])
+
+
+class _MappedColumn(Sequence):
+    """Read only column of little endian numbers in a memory mapped file."""
+
+    def __init__(self, buf, offset, typecode, length):
+        self._buf = buf
+        self._offset = offset
+        self._typecode = typecode
+        self._format = "<" + typecode
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return struct.unpack_from(self._format, self._buf,
+                                  self._offset + 8 * i)[0]
+
+    def __iter__(self):
+        end = self._offset + 8 * self._length
+        return iter(_from_bytes(self._typecode, self._buf[self._offset:end]))
+
+
+class _MappedPaths(Sequence):
+    """Read only column of paths in a memory mapped file."""
+
+    def __init__(self, buf, offsets, blob_offset):
+        self._buf = buf
+        self._offsets = offsets
+        self._blob_offset = blob_offset
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = self._blob_offset + self._offsets[i]
+        end = self._blob_offset + self._offsets[i + 1]
+        return self._buf[start:end].decode("utf-8")
+
+
+class CompactFileList(Sequence):
+    """Read only sequence of manifest entries stored in columns.
+
+    Entries are returned as new dictionaries, so changing them does not
+    change the file list.
+    """
+
+    def __init__(self):
+        self._paths = []
+        self._hashes = bytearray()
+        self._hash_size = None
+        self._sizes = array.array("q")
+        self._mtimes = array.array("d")
+        self._inodes = array.array("q")
+        self._mimetype_ids = array.array("q")
+        self._mimetypes = []
+        self._mimetype_ids_by_name = {}
+        # Hashes that are not hex digests of the common size, by position.
+        self._odd_hashes = {}
+        # Keys other than the column keys, by position.
+        self._extras = {}
+        # Column keys that entries do not have, by position.
+        self._missing = {}
+        self._index_by_path = None
+
+    def _append(self, entry):
+        i = len(self._paths)
+        self._paths.append(_intern(entry["path"]))
+
+        hexdigest = entry.get("hash")
+        if self._hash_size is None and hexdigest:
+            self._hash_size = len(hexdigest) // 2
+        try:
+            raw = bytearray(binascii.unhexlify(hexdigest))
+            if len(raw) != self._hash_size \
+                    or binascii.hexlify(raw).decode("ascii") != hexdigest:
+                raise ValueError(hexdigest)
+        except (TypeError, ValueError, binascii.Error):
+            raw = bytearray(self._hash_size or 0)
+            self._odd_hashes[i] = hexdigest
+        self._hashes.extend(raw)
+
+        self._sizes.append(entry.get("size", 0))
+        self._mtimes.append(entry.get("mtime", 0.0))
+        inode = entry.get("inode")
+        self._inodes.append(_NO_INODE if inode is None else inode)
+
+        mimetype = entry.get("mimetype")
+        if mimetype not in self._mimetype_ids_by_name:
+            self._mimetype_ids_by_name[mimetype] = len(self._mimetypes)
+            self._mimetypes.append(mimetype)
+        self._mimetype_ids.append(self._mimetype_ids_by_name[mimetype])
+
+        extras = dict((key, value) for key, value in entry.items()
+                      if key not in _COLUMN_KEYS)
+        if extras:
+            self._extras[i] = extras
+        missing = [key for key in _OPTIONAL_KEYS if key not in entry]
+        if missing:
+            self._missing[i] = missing
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        entry = {"path": self._paths[i],
+                 "hash": self.hash(i),
+                 "size": self._sizes[i],
+                 "mtime": self._mtimes[i],
+                 "mimetype": self._mimetypes[self._mimetype_ids[i]]}
+        if self._inodes[i] != _NO_INODE:
+            entry["inode"] = self._inodes[i]
+        for key in self._missing.get(i, ()):
+            del entry[key]
+        entry.update(self._extras.get(i, ()))
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def path(self, i):
+        """Return the path of the i-th entry."""
+        return self._paths[i]
+
+    def hash(self, i):
+        """Return the hash of the i-th entry."""
+        if i in self._odd_hashes:
+            return self._odd_hashes[i]
+        start = i * self._hash_size
+        raw = self._hashes[start:start + self._hash_size]
+        return binascii.hexlify(raw).decode("ascii")
+
+    def size(self, i):
+        """Return the size of the i-th entry."""
+        return self._sizes[i]
+
+    def total_size(self):
+        """Return the sum of the sizes of the entries."""
+        return sum(self._sizes)
+
+    def index(self, path):
+        """Return position of the entry with a path.
+
+        :raises: ValueError if there is no entry with the path
+        """
+        if self._index_by_path is None:
+            self._index_by_path = dict(
+                (p, i) for i, p in enumerate(self._paths))
+        try:
+            return self._index_by_path[path]
+        except KeyError:
+            raise ValueError("{} is not in the manifest".format(path))
+
+
+class _EntriesByPath(Mapping):
+    """Read only mapping of the entries of a file list by path."""
+
+    def __init__(self, file_list):
+        self._file_list = file_list
+
+    def __getitem__(self, path):
+        try:
+            return self._file_list[self._file_list.index(path)]
+        except ValueError:
+            raise KeyError(path)
+
+    def __contains__(self, path):
+        try:
+            self._file_list.index(path)
+        except ValueError:
+            return False
+        return True
+
+    def __iter__(self):
+        for i in range(len(self._file_list)):
+            yield self._file_list.path(i)
+
+    def __len__(self):
+        return len(self._file_list)
+
+
+class CompactManifest(Mapping):
+    """Read only dataset manifest with a compact file list.
+
+    :param header: dictionary with the keys of the manifest other than the
+                   'file_list'
+    :param file_list: :class:`CompactFileList`
+    :param source: dictionary identifying where the manifest was read from,
+                   recorded in the companion file to check that it is up to
+                   date
+    """
+
+    def __init__(self, header, file_list, source=None):
+        self._header = header
+        self._file_list = file_list
+        self.source = source
+
+    @classmethod
+    def from_entries(cls, header, entries, source=None):
+        """Return compact manifest from an iterable of file list entries."""
+        file_list = CompactFileList()
+        for entry in entries:
+            file_list._append(entry)
+        return cls(header, file_list, source)
+
+    @classmethod
+    def from_dict(cls, manifest, source=None):
+        """Return compact manifest from a manifest dictionary."""
+        header = dict((key, value) for key, value in manifest.items()
+                      if key != "file_list")
+        return cls.from_entries(header, manifest["file_list"], source)
+
+    def __getitem__(self, key):
+        if key == "file_list":
+            return self._file_list
+        return self._header[key]
+
+    def __iter__(self):
+        for key in self._header:
+            yield key
+        yield "file_list"
+
+    def __len__(self):
+        return len(self._header) + 1
+
+    def entries_by_path(self):
+        """Return read only mapping of the file list entries by path."""
+        return _EntriesByPath(self._file_list)
+
+    def total_size(self):
+        """Return the sum of the sizes in the file list."""
+        return self._file_list.total_size()
+
+    def select(self, paths):
+        """Return compact manifest of the entries with a path in paths.
+
+        :param paths: set of paths
+        """
+        entries = (entry for entry in self._file_list
+                   if entry["path"] in paths)
+        return CompactManifest.from_entries(self._header, entries, self.source)
+
+    def to_dict(self):
+        """Return the manifest as a dictionary, with a list of entries."""
+        manifest = dict(self._header)
+        manifest["file_list"] = list(self._file_list)
+        return manifest
+
+
+class _JSONStream(object):
+    """Reader of JSON values from a stream of UTF-8 encoded bytes."""
+
+    def __init__(self, fh, read_size=READ_SIZE):
+        self._fh = fh
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = u""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read more of the stream; return False at the end of it."""
+        if self._eof:
+            return False
+        data = self._fh.read(self._read_size)
+        self._eof = not data
+        # Drop what has been parsed, so the buffer stays about one read long.
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data, self._eof)
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Return the next character that is not whitespace."""
+        while True:
+            while self._pos < len(self._buf) \
+                    and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def expect(self, char):
+        """Consume the next character, which must be char."""
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                "Expected {!r} but found {!r}".format(char, found))
+        self._pos += 1
+
+    def value(self):
+        """Return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                end = None
+            # A value ending the buffer may continue in the next read, e.g.
+            # a number; in a manifest a value is always followed by , ] or }.
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if not self._fill():
+                raise ValueError("Invalid JSON value")
+
+
+def iter_manifest_entries(fh, header=None, read_size=READ_SIZE):
+    """Yield the entries of the file list of a manifest read from a stream.
+
+    Only the entry being parsed and one read of the stream are held in
+    memory.
+
+    :param fh: file like object with the manifest as UTF-8 encoded JSON
+    :param header: dictionary to add the keys of the manifest other than the
+                   'file_list' to; keys after the file list are added once
+                   all the entries have been yielded
+    :param read_size: bytes to read from the stream at a time
+    :raises: ValueError if the stream is not a JSON object
+    """
+    if header is None:
+        header = {}
+    stream = _JSONStream(fh, read_size)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "file_list":
+            stream.expect("[")
+            if stream.peek() != "]":
+                while True:
+                    yield stream.value()
+                    if stream.peek() == "]":
+                        break
+                    stream.expect(",")
+            stream.expect("]")
+        else:
+            header[key] = stream.value()
+        if stream.peek() == "}":
+            return
+        stream.expect(",")
+
+
+def read_manifest_stream(fh, source=None, read_size=READ_SIZE):
+    """Return :class:`CompactManifest` parsed from a stream.
+
+    :param fh: file like object with the manifest as UTF-8 encoded JSON
+    :param source: dictionary identifying where the manifest was read from
+    :param read_size: bytes to read from the stream at a time
+    :raises: ValueError if the stream is not a manifest
+    """
+    header = {}
+    return CompactManifest.from_entries(
+        header, iter_manifest_entries(fh, header, read_size), source)
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def write_compact_manifest(path, manifest):
+    """Write compact manifest to a binary file that can be memory mapped.
+
+    :param path: path to write to
+    :param manifest: :class:`CompactManifest`
+    """
+    file_list = manifest["file_list"]
+    n = len(file_list)
+
+    encoded_paths = [p.encode("utf-8") for p in file_list._paths]
+    path_offsets = array.array("q", [0])
+    for encoded_path in encoded_paths:
+        path_offsets.append(path_offsets[-1] + len(encoded_path))
+
+    columns = [
+        ("sizes", _to_bytes(array.array("q", file_list._sizes))),
+        ("mtimes", _to_bytes(array.array("d", file_list._mtimes))),
+        ("inodes", _to_bytes(array.array("q", file_list._inodes))),
+        ("mimetype_ids", _to_bytes(array.array("q",
+                                               file_list._mimetype_ids))),
+        ("path_offsets", _to_bytes(path_offsets)),
+        ("hashes", _to_bytes(file_list._hashes)),
+        ("paths", b"".join(encoded_paths)),
+    ]
+    offsets = {}
+    offset = 0
+    for name, data in columns:
+        offsets[name] = offset
+        offset = _align(offset + len(data))
+
+    header = {"manifest": manifest._header,
+              "source": manifest.source,
+              "n_entries": n,
+              "hash_size": file_list._hash_size,
+              "mimetypes": file_list._mimetypes,
+              "odd_hashes": dict((str(i), h) for i, h
+                                 in file_list._odd_hashes.items()),
+              "extras": dict((str(i), e) for i, e
+                             in file_list._extras.items()),
+              "missing": dict((str(i), keys) for i, keys
+                              in file_list._missing.items()),
+              "offsets": offsets}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(_MAGIC) + 8 + len(header_bytes))
+
+    # Written alongside and moved into place, as the existing file may be
+    # memory mapped.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(_MAGIC)
+        fh.write(struct.pack("<q", len(header_bytes)))
+        fh.write(header_bytes)
+        for name, data in columns:
+            fh.write(b"\0" * (data_start + offsets[name] - fh.tell()))
+            fh.write(data)
+    os.rename(tmp_path, path)
+
+
+def read_compact_manifest(path):
+    """Return :class:`CompactManifest` memory mapping a companion file.
+
+    :param path: path to the binary file
+    :raises: ValueError if the file is not a compact manifest
+    """
+    with open(path, "rb") as fh:
+        if fh.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a compact manifest: {}".format(path))
+        header_size, = struct.unpack("<q", fh.read(8))
+        header = json.loads(fh.read(header_size).decode("utf-8"))
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = _align(len(_MAGIC) + 8 + header_size)
+    offsets = dict((name, data_start + offset)
+                   for name, offset in header["offsets"].items())
+    n = header["n_entries"]
+
+    file_list = CompactFileList()
+    file_list._sizes = _MappedColumn(buf, offsets["sizes"], "q", n)
+    file_list._mtimes = _MappedColumn(buf, offsets["mtimes"], "d", n)
+    file_list._inodes = _MappedColumn(buf, offsets["inodes"], "q", n)
+    file_list._mimetype_ids = _MappedColumn(buf, offsets["mimetype_ids"],
+                                            "q", n)
+    path_offsets = _MappedColumn(buf, offsets["path_offsets"], "q", n + 1)
+    file_list._paths = _MappedPaths(buf, path_offsets, offsets["paths"])
+    hash_size = header["hash_size"] or 0
+    file_list._hashes = memoryview(buf)[
+        offsets["hashes"]:offsets["hashes"] + n * hash_size]
+    file_list._hash_size = header["hash_size"]
+    file_list._mimetypes = header["mimetypes"]
+    file_list._odd_hashes = dict((int(i), h) for i, h
+                                 in header["odd_hashes"].items())
+    file_list._extras = dict((int(i), e) for i, e
+                             in header["extras"].items())
+    file_list._missing = dict((int(i), keys) for i, keys
+                              in header["missing"].items())
+
+    return CompactManifest(header["manifest"], file_list, header["source"])
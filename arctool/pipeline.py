@@ -0,0 +1,118 @@
+"""Module for hashing streams of file objects using a pool of threads.
+
+The thread calling :meth:`HashingPipeline.run` acts as the reader; it reads
+(and hence decompresses) each file object in chunks and passes the chunks to
+a pool of hashing threads through bounded queues. All the chunks of a given
+file object are passed to the same worker, so that each digest is computed
+from its data in order, while different files are hashed concurrently.
+
+hashlib releases the GIL when hashing large buffers, so threads are enough
+to keep several cores busy.
+"""
+
+import hashlib
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+CHUNK_SIZE = 1024 * 1024
+
+_STOP = object()
+
+
+class _WorkerError(object):
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class HashingPipeline(object):
+    """Class for hashing file objects in a reader/hasher pipeline.
+
+    :param n_workers: number of hashing threads
+    :param queue_size: maximum number of chunks queued for each worker
+    :param chunk_size: number of bytes read from a file object at a time
+    :param hasher_factory: callable returning a new hashlib style object
+    """
+
+    def __init__(self, n_workers=4, queue_size=8, chunk_size=CHUNK_SIZE,
+                 hasher_factory=hashlib.sha1):
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.hasher_factory = hasher_factory
+
+    def _hash_chunks(self, in_queue, results):
+        hasher = None
+        failed = False
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                return
+            if failed:
+                # Keep consuming so that the reader never blocks on a
+                # full queue.
+                continue
+            key, chunk = item
+            try:
+                if hasher is None:
+                    hasher = self.hasher_factory()
+                if chunk is None:
+                    results.put((key, hasher.hexdigest()))
+                    hasher = None
+                else:
+                    hasher.update(chunk)
+            except Exception as e:
+                results.put(_WorkerError(e))
+                failed = True
+
+    def _drain(self, results):
+        while True:
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(result, _WorkerError):
+                raise result.exception
+            yield result
+
+    def run(self, items):
+        """Yield (key, hexdigest) tuples for (key, file object) items.
+
+        Results are yielded in the order in which hashing completes, which
+        is not necessarily the order of the input items.
+
+        :param items: iterable of (key, file object) tuples
+        """
+        results = queue.Queue()
+        in_queues = [queue.Queue(maxsize=self.queue_size)
+                     for _ in range(self.n_workers)]
+        workers = [threading.Thread(target=self._hash_chunks,
+                                    args=(in_queue, results))
+                   for in_queue in in_queues]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for i, (key, fileobj) in enumerate(items):
+                in_queue = in_queues[i % self.n_workers]
+                buf = fileobj.read(self.chunk_size)
+                while len(buf) > 0:
+                    in_queue.put((key, buf))
+                    buf = fileobj.read(self.chunk_size)
+                in_queue.put((key, None))
+
+                for result in self._drain(results):
+                    yield result
+        finally:
+            for in_queue in in_queues:
+                in_queue.put(_STOP)
+            for worker in workers:
+                worker.join()
+
+        for result in self._drain(results):
+            yield result
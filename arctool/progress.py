@@ -0,0 +1,87 @@
+"""Module for tracking the progress and throughput of long running tasks.
+
+Archiving, compressing and verifying report their progress by calling a
+progress callable with the number of bytes just processed and, where there
+is one, the path of the file being processed::
+
+    meter = ProgressMeter(total_bytes)
+    archive_builder.persist_to_tar(path, progress=meter.update)
+
+The meter keeps track of the throughput, and the time remaining, of the task.
+"""
+
+import time
+
+
+def format_seconds(seconds):
+    """Return seconds formatted as H:MM:SS."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+class ProgressMeter(object):
+    """Class for metering the bytes processed by a task.
+
+    :param total_bytes: expected number of bytes, typically the sum of the
+                        sizes in the manifest
+    :param on_update: callable called with the meter and the number of bytes
+                      after every update
+    """
+
+    def __init__(self, total_bytes=None, on_update=None):
+        self.total_bytes = total_bytes
+        self.on_update = on_update
+        self.n_bytes = 0
+        self.current = None
+        self._start = time.time()
+        self._end = None
+
+    def update(self, n_bytes, current=None):
+        """Record that n_bytes more have been processed.
+
+        :param n_bytes: number of bytes processed since the last update
+        :param current: path of the file being processed
+        """
+        self.n_bytes += n_bytes
+        if current is not None:
+            self.current = current
+        if self.on_update is not None:
+            self.on_update(self, n_bytes)
+
+    def finish(self):
+        """Stop the clock."""
+        self._end = time.time()
+
+    @property
+    def seconds(self):
+        """Return seconds elapsed."""
+        end = self._end if self._end is not None else time.time()
+        return max(end - self._start, 1e-6)
+
+    @property
+    def mb_per_second(self):
+        """Return throughput in MB/s."""
+        return float(self.n_bytes) / 1e6 / self.seconds
+
+    @property
+    def eta(self):
+        """Return estimated seconds remaining, or None if not known."""
+        if not self.total_bytes or not self.n_bytes:
+            return None
+        remaining = max(self.total_bytes - self.n_bytes, 0)
+        return remaining * self.seconds / self.n_bytes
+
+    def summary(self):
+        """Return dictionary of throughput metrics, for log events."""
+        return {'n_bytes': self.n_bytes,
+                'seconds': round(self.seconds, 3),
+                'mb_per_second': round(self.mb_per_second, 3)}
+
+    def __str__(self):
+        parts = ["{:.1f} MB/s".format(self.mb_per_second)]
+        if self.eta is not None:
+            parts.append("ETA {}".format(format_seconds(self.eta)))
+        if self.current is not None:
+            parts.append(self.current)
+        return "  ".join(parts)
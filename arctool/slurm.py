@@ -1,14 +1,239 @@
-"""Module for generating slurm scripts."""
+"""Module for generating slurm scripts.
 
-from arctool import JINJA2_ENV
+Besides the script for a single command, a script submitting the whole
+archive pipeline can be generated. Each step, creating the manifest, creating
+the tarball, compressing it and verifying it, is submitted as a separate job
+that only starts once the previous step has succeeded
+(``--dependency=afterok``). Many datasets are processed by job arrays, one
+array task per dataset, where each task starts once the task for the same
+dataset in the previous step has succeeded (``--dependency=aftercorr``), so
+that one slow or failed dataset does not hold up the others.
+
+The cores and walltime of each job are sized from the number of bytes in the
+dataset's manifest and the throughput of the step, so that large archives are
+given enough time and small ones do not reserve more than they need.
+"""
+
+import os
+import math
+
+from arctool import jinja2_env
+from arctool.manifest import manifest_size
+
+#: Steps of the archive pipeline, in the order they are run.
+PIPELINE_STEPS = ("manifest", "tar", "compress", "verify")
+
+DEFAULT_PARTITION = "rg-sv"
+DEFAULT_WALLTIME = "0-01:30"
+
+#: Assumed throughput of each step in MB/s, per core for compress.
+DEFAULT_THROUGHPUT = {
+    "manifest": 100.0,
+    "tar": 100.0,
+    "compress": 20.0,
+    "verify": 100.0,
+}
+
+#: Steps whose throughput scales with the number of cores.
+MULTICORE_STEPS = ("compress",)
+
+#: Walltime is the expected time multiplied by this, to allow for slow disks.
+WALLTIME_SAFETY_FACTOR = 2.0
+
+MIN_WALLTIME_SECONDS = 15 * 60
+
+#: Compression is given enough cores to finish in about this time.
+TARGET_SECONDS = 60 * 60
+
+_COMMANDS = {
+    "manifest": "arctool manifest create {dataset}",
+    "tar": "arctool archive create --resume {dataset}",
+    "compress":
+        "arctool archive compress -c {n_cores} {compress_options}{tar}",
+    "verify": "arctool verify full --resume {tar_gz}",
+}
+
+
+def compress_options(index_span=None, blocked=False, block_size=None):
+    """Return the options to pass on to ``arctool archive compress``.
+
+    Options left as None are not passed on, so take their default.
+
+    :param index_span: MiB between seek points in the index
+    :param blocked: compress into independent (BGZF style) gzip blocks
+    :param block_size: MiB of uncompressed data per block
+    :returns: options, each followed by a space
+    """
+    options = []
+    if index_span is not None:
+        options.append("--index-span {} ".format(index_span))
+    if blocked:
+        options.append("--blocked ")
+    if block_size is not None:
+        options.append("--block-size {} ".format(block_size))
+    return "".join(options)
 
 
 def generate_slurm_script(command_string, job_parameters):
     """Return slurm script.
 
+    The job parameters must include the 'n_cores' and 'partition', and can
+    include the 'walltime' (default 0-01:30), the 'memory', a job 'name' and
+    the task ids of a job 'array'.
+
     :param command_string: command to run in slurm script
     :param job_parameters: dictionary of job parameters
     :returns: slurm sbatch script
     """
-    template = JINJA2_ENV.get_template('submit_command.slurm.j2')
-    return template.render(job=job_parameters, command_string=command_string)
+    template = jinja2_env().get_template('submit_command.slurm.j2')
+    job = {'walltime': DEFAULT_WALLTIME}
+    job.update(job_parameters)
+    return template.render(job=job, command_string=command_string)
+
+
+def format_walltime(seconds):
+    """Return seconds, rounded up to the minute, formatted as D-HH:MM."""
+    minutes = int(math.ceil(seconds / 60.0))
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return "{}-{:02d}:{:02d}".format(days, hours, minutes)
+
+
+def size_job(step, n_bytes, mb_per_second=None, overhead_seconds=0.0,
+             n_cores=None, max_cores=16):
+    """Return dictionary with the 'n_cores' and 'walltime' for a step.
+
+    Compression is given enough cores, up to max_cores, to finish in about an
+    hour; the other steps use a single core. The walltime is the expected
+    time, with a safety factor, and at least 15 minutes.
+
+    :param step: one of :data:`PIPELINE_STEPS`
+    :param n_bytes: number of bytes of data to process
+    :param mb_per_second: measured throughput of the step in MB/s, per core
+                          for compress, by default from
+                          :data:`DEFAULT_THROUGHPUT`
+    :param overhead_seconds: fixed time taken by the step regardless of size
+    :param n_cores: number of cores to use, rather than sizing it
+    :param max_cores: maximum number of cores to size a job to
+    :returns: dictionary of job parameters
+    """
+    if mb_per_second is None:
+        mb_per_second = DEFAULT_THROUGHPUT[step]
+    bytes_per_second = mb_per_second * 1e6
+
+    if n_cores is None:
+        n_cores = 1
+        if step in MULTICORE_STEPS:
+            n_cores = int(math.ceil(
+                n_bytes / (bytes_per_second * TARGET_SECONDS)))
+            n_cores = min(max(n_cores, 1), max_cores)
+
+    if step in MULTICORE_STEPS:
+        bytes_per_second *= n_cores
+
+    seconds = overhead_seconds + n_bytes / bytes_per_second
+    seconds *= WALLTIME_SAFETY_FACTOR
+    seconds = max(seconds, MIN_WALLTIME_SECONDS)
+    return {'n_cores': n_cores, 'walltime': format_walltime(seconds)}
+
+
+def dataset_archive_path(dataset):
+    """Return path of the tarball that will be created from a dataset.
+
+    :param dataset: :class:`arctool.archive.ArchiveDataSet`
+    """
+    dataset_path = dataset._abs_path.rstrip(os.sep)
+    return os.path.join(os.path.dirname(dataset_path), dataset.name + ".tar")
+
+
+def _bash_array(name, values):
+    return "{}=({})".format(name, " ".join(_quote(v) for v in values))
+
+
+def _quote(value):
+    return "'{}'".format(value.replace("'", "'\"'\"'"))
+
+
+def generate_pipeline_script(datasets, partition=DEFAULT_PARTITION,
+                             throughput=None, max_cores=16,
+                             steps=PIPELINE_STEPS, estimator=None,
+                             index_span=None, blocked=False,
+                             block_size=None):
+    """Return bash script submitting the archive pipeline for datasets.
+
+    Each step is submitted as a job depending on the success of the previous
+    one. With more than one dataset each job is a job array, with one task
+    per dataset, sized for the largest dataset, and each task depends only
+    on the task for the same dataset in the previous step.
+
+    :param datasets: list of :class:`arctool.archive.ArchiveDataSet`
+    :param partition: slurm partition to submit the jobs to
+    :param throughput: dictionary of measured throughput in MB/s by step,
+                       overriding :data:`DEFAULT_THROUGHPUT`
+    :param max_cores: maximum number of cores to size a job to
+    :param steps: steps of the pipeline to submit
+    :param estimator: :class:`arctool.estimate.Estimator` sizing the steps
+                      from the history of past runs, where no throughput is
+                      given
+    :param index_span: MiB between seek points in the index of the
+                       compressed archives
+    :param blocked: compress into independent (BGZF style) gzip blocks
+    :param block_size: MiB of uncompressed data per block
+    :returns: bash script
+    """
+    if not datasets:
+        raise ValueError("No datasets to archive")
+    throughput = throughput or {}
+
+    options = compress_options(index_span, blocked, block_size)
+    dataset_paths = [d._abs_path.rstrip(os.sep) for d in datasets]
+    tar_paths = [dataset_archive_path(d) for d in datasets]
+    n_bytes = max(manifest_size(d.manifest) for d in datasets)
+
+    preamble = []
+    job_parameters = {'partition': partition}
+    if len(datasets) == 1:
+        placeholders = {'dataset': _quote(dataset_paths[0]),
+                        'tar': _quote(tar_paths[0]),
+                        'tar_gz': _quote(tar_paths[0] + ".gz")}
+        job_name = datasets[0].name
+    else:
+        preamble = [_bash_array("DATASETS", dataset_paths),
+                    _bash_array("ARCHIVES", tar_paths)]
+        placeholders = {'dataset': '"${DATASETS[$SLURM_ARRAY_TASK_ID]}"',
+                        'tar': '"${ARCHIVES[$SLURM_ARRAY_TASK_ID]}"',
+                        'tar_gz': '"${ARCHIVES[$SLURM_ARRAY_TASK_ID]}.gz"'}
+        job_parameters['array'] = "0-{}".format(len(datasets) - 1)
+        job_name = "arctool"
+
+    # Array tasks only wait for the task of the same dataset.
+    dependency_type = 'aftercorr' if 'array' in job_parameters else 'afterok'
+
+    jobs = []
+    dependency = None
+    for step in steps:
+        parameters = dict(job_parameters)
+        if estimator is not None and step not in throughput:
+            suggestion = estimator.suggest(step, n_bytes, max_cores=max_cores)
+            for key in ('n_cores', 'walltime', 'memory'):
+                parameters[key] = suggestion[key]
+        else:
+            parameters.update(size_job(step, n_bytes,
+                                       mb_per_second=throughput.get(step),
+                                       max_cores=max_cores))
+        parameters['name'] = "{}-{}".format(job_name, step)
+        command = _COMMANDS[step].format(n_cores=parameters['n_cores'],
+                                         compress_options=options,
+                                         **placeholders)
+        command_string = "\n".join(preamble + [command])
+        variable = "{}_JOB".format(step.upper())
+        jobs.append({'step': step,
+                     'variable': variable,
+                     'dependency': dependency,
+                     'dependency_type': dependency_type,
+                     'script': generate_slurm_script(command_string,
+                                                     parameters)})
+        dependency = variable
+
+    template = jinja2_env().get_template('submit_pipeline.sh.j2')
+    return template.render(jobs=jobs)
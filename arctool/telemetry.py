@@ -0,0 +1,292 @@
+"""Module for sending telemetry events to fluentd without blocking.
+
+Events are put on a bounded queue and sent by a background thread, so a slow
+or unreachable fluentd host never holds up a command. Nothing connects until
+the first event is sent. Events that cannot be sent, because the host is
+unreachable or the queue is full, are appended to a local spool, a JSON lines
+file at ``~/.arctool/telemetry-spool.jsonl`` (or ``$ARCTOOL_TELEMETRY_SPOOL``),
+and replayed by a later command once the host can be reached.
+
+A command replaying the spool first renames it to ``<spool>.<pid>``, so that
+no other command replays it too. If the command exits before the replay is
+finished, the renamed spool is replayed by a later command, once the process
+that renamed it is no longer running.
+
+Usage::
+
+    from arctool import telemetry
+
+    telemetry.configure(host="my_host.domain")
+    telemetry.emit("pre_create_archive", {"path": path})
+
+Pending events are flushed, for at most a couple of seconds, when the
+process exits.
+"""
+
+import os
+import json
+import time
+import errno
+import atexit
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from arctool.manifest import manifest_hash, manifest_size
+
+DEFAULT_HOST = "v0679"
+DEFAULT_PORT = 24224
+
+SPOOL_ENV_VAR = "ARCTOOL_TELEMETRY_SPOOL"
+
+#: Maximum number of events waiting to be sent.
+MAX_QUEUED = 1000
+
+#: Seconds to wait for pending events to be sent at exit.
+FLUSH_TIMEOUT = 2.0
+
+#: Socket timeout in seconds, shorter than the flush timeout so that an
+#: unreachable host is given up on before the process exits.
+SEND_TIMEOUT = 1.0
+
+_STOP = object()
+
+
+def spool_path():
+    """Return the path to the spool of events that could not be sent."""
+    default = os.path.join(os.path.expanduser("~"), ".arctool",
+                           "telemetry-spool.jsonl")
+    return os.environ.get(SPOOL_ENV_VAR, default)
+
+
+def _is_running(pid):
+    """Return True if a process with the pid is running."""
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def summarise_manifest(manifest):
+    """Return summary of a manifest to log, rather than the whole manifest.
+
+    :param manifest: dataset manifest
+    :returns: dictionary with the 'n_files', 'total_size', 'hash_function'
+              and 'manifest_hash', a sha1 of the paths, sizes and hashes
+    """
+    return {"n_files": len(manifest["file_list"]),
+            "total_size": manifest_size(manifest),
+            "hash_function": manifest.get("hash_function"),
+            "manifest_hash": manifest_hash(manifest)}
+
+
+class TelemetrySender(object):
+    """Class for sending events to fluentd from a background thread.
+
+    :param tag: fluentd tag prefixed to the event labels
+    :param host: fluentd host
+    :param port: fluentd port
+    :param spool: path to the spool, by default :func:`spool_path`
+    :param max_queued: maximum number of events waiting to be sent
+    :param timeout: socket timeout in seconds
+    """
+
+    def __init__(self, tag="arctool", host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 spool=None, max_queued=MAX_QUEUED, timeout=SEND_TIMEOUT):
+        self.tag = tag
+        self.host = host
+        self.port = port
+        self.spool = spool if spool is not None else spool_path()
+        self.timeout = timeout
+        self._queue = queue.Queue(max_queued)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._sender = None
+        self._offline = False
+        self._replayed = False
+        # Record being sent by the thread, claimed by whichever of the
+        # thread and close() deals with it first.
+        self._in_flight = None
+
+    def emit(self, label, data):
+        """Queue an event to be sent; never blocks.
+
+        :param label: event label
+        :param data: dictionary of event data
+        """
+        record = {"label": label, "time": int(time.time()), "data": data}
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._spool([record])
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        """Wait for queued events to be sent, spooling any that are not.
+
+        An event still being sent when the wait times out is spooled too,
+        so it is not lost with the thread; it may then be sent twice.
+
+        :param timeout: maximum seconds to wait
+        """
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+        remaining = []
+        in_flight = self._claim(self._in_flight)
+        if in_flight is not None:
+            remaining.append(in_flight)
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                remaining.append(record)
+        self._spool(remaining)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            with self._lock:
+                self._in_flight = record
+            sent = self._send(record)
+            if self._claim(record) is None:
+                # Spooled by close() while it was being sent.
+                continue
+            if not sent:
+                self._spool([record])
+            elif not self._replayed:
+                self._replay()
+
+    def _claim(self, record):
+        """Return the record if it was in flight, no longer marking it so."""
+        with self._lock:
+            if record is None or self._in_flight is not record:
+                return None
+            self._in_flight = None
+            return record
+
+    def _send(self, record):
+        """Return True if the record was sent."""
+        if self._offline:
+            return False
+        try:
+            if self._sender is None:
+                from fluent.sender import FluentSender
+                # No buffering in the sender, unsent events are spooled.
+                self._sender = FluentSender(self.tag, host=self.host,
+                                            port=self.port, bufmax=0,
+                                            timeout=self.timeout)
+            sent = self._sender.emit_with_time(record["label"],
+                                               record["time"],
+                                               record["data"])
+        except Exception:
+            sent = False
+        if not sent:
+            # Do not wait on the host again for the rest of the process.
+            self._offline = True
+            self._sender = None
+        return sent
+
+    def _replay(self):
+        """Send the events in the spool, and in spools left part replayed."""
+        self._replayed = True
+        replaying = "{}.{}".format(self.spool, os.getpid())
+        # A spool with this pid is left by an earlier process with the pid.
+        for path in [replaying, self.spool] + self._orphaned_spools():
+            if not os.path.isfile(path):
+                continue
+            try:
+                # Claim the spool, so that it is replayed by one process
+                # only.
+                os.rename(path, replaying)
+            except OSError:
+                continue
+            self._replay_file(replaying)
+
+    def _orphaned_spools(self):
+        """Return paths of spools claimed by processes no longer running."""
+        directory, name = os.path.split(self.spool)
+        prefix = name + "."
+        try:
+            names = sorted(os.listdir(directory or "."))
+        except OSError:
+            return []
+        orphaned = []
+        for spool_name in names:
+            pid = spool_name[len(prefix):]
+            if spool_name.startswith(prefix) and pid.isdigit() \
+                    and not _is_running(int(pid)):
+                orphaned.append(os.path.join(directory, spool_name))
+        return orphaned
+
+    def _replay_file(self, replaying):
+        """Send the events in a claimed spool, spooling any not sent again."""
+        with open(replaying) as fh:
+            records = []
+            for line in fh:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        unsent = [record for record in records if not self._send(record)]
+        self._spool(unsent)
+        os.remove(replaying)
+
+    def _spool(self, records):
+        if not records:
+            return
+        try:
+            directory = os.path.dirname(self.spool)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with self._lock:
+                with open(self.spool, "a") as fh:
+                    for record in records:
+                        fh.write(json.dumps(record, default=str) + "\n")
+        except (IOError, OSError):
+            pass
+
+
+_sender = None
+
+
+def configure(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Set the fluentd host and port that events are sent to."""
+    global _sender
+    if _sender is not None:
+        _sender.close()
+    _sender = TelemetrySender(host=host, port=port)
+
+
+def emit(label, data):
+    """Queue an event to be sent to fluentd; never blocks.
+
+    :param label: event label
+    :param data: dictionary of event data
+    """
+    if _sender is None:
+        configure()
+    _sender.emit(label, data)
+
+
+@atexit.register
+def _flush():
+    if _sender is not None:
+        _sender.close()
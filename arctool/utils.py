@@ -10,6 +10,8 @@ from dtool import (
 )
 from dtool.utils import write_templated_file
 
+from arctool import jinja2_env
+
 
 HERE = os.path.dirname(__file__)
 TEMPLATE_DIR = os.path.join(HERE, '..', 'templates')
@@ -42,6 +44,9 @@ def new_archive_dataset(staging_path, descriptive_metadata):
               the staging area)
     """
 
+    # Make sure dtool can find the arctool templates.
+    jinja2_env()
+
     dataset_name = descriptive_metadata['dataset_name']
     dataset = DataSet(dataset_name, 'archive')
     dataset_path = os.path.join(staging_path, dataset_name)
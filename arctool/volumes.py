@@ -0,0 +1,45 @@
+"""Module for archives split into several volumes.
+
+Each volume is a complete tar (or tar.gz) file, ``<name>.NNN.tar``, starting
+with the header files of the dataset, so that it can be read on its own.
+Files are kept whole, a new volume is started rather than splitting a file.
+
+The volume index, ``<name>.volumes.json``, lists the volumes in order and
+the files, as paths in the manifest, in each of them.
+"""
+
+import os
+import json
+
+VOLUMES_SUFFIX = ".volumes.json"
+
+
+def volume_index_path(directory, name):
+    """Return path to the volume index of a named archive."""
+    return os.path.join(directory, name + VOLUMES_SUFFIX)
+
+
+def volume_path(directory, name, number, suffix=".tar"):
+    """Return path to a volume of a named archive, numbered from 1."""
+    return os.path.join(directory, "{}.{:03d}{}".format(name, number, suffix))
+
+
+def is_volume_index(path):
+    """Return True if the path is that of a volume index."""
+    return path.endswith(VOLUMES_SUFFIX)
+
+
+def write_volume_index(path, volume_index):
+    """Write volume index, with volume paths relative to its directory."""
+    with open(path, "w") as fh:
+        json.dump(volume_index, fh, indent=2)
+
+
+def read_volume_index(path):
+    """Return volume index, with absolute volume paths."""
+    with open(path) as fh:
+        volume_index = json.load(fh)
+    directory = os.path.dirname(os.path.abspath(path))
+    for volume in volume_index["volumes"]:
+        volume["path"] = os.path.join(directory, volume["path"])
+    return volume_index
@@ -20,6 +20,9 @@ setup(name="arctool",
           "fluent-logger",
           "pyyaml",
       ],
+      extras_require={
+          "fasthash": ["xxhash", "blake3"],
+      },
       entry_points={
           'console_scripts': ['arctool=arctool.cli:cli']
       },
@@ -10,6 +10,14 @@ import pytest
 
 from dtool import DescriptiveMetadata
 
+# Keep the history of runs, the telemetry spool and the dedup store, written
+# by the commands under test out of the user's home directory.
+_STATE_DIR = tempfile.mkdtemp()
+os.environ["ARCTOOL_HISTORY"] = os.path.join(_STATE_DIR, "history.jsonl")
+os.environ["ARCTOOL_TELEMETRY_SPOOL"] = os.path.join(_STATE_DIR,
+                                                     "spool.jsonl")
+os.environ["ARCTOOL_DEDUP_STORE"] = os.path.join(_STATE_DIR, "dedup.sqlite")
+
 _HERE = os.path.dirname(__file__)
 TEST_INPUT_DATA = os.path.join(_HERE, "data", "basic", "input")
 
@@ -1,8 +1,115 @@
 """Tests for dtool.archive.ArchiveDataSet class."""
 
+import os
+import json
+from distutils.dir_util import copy_tree
+
+from . import tmp_dir_fixture  # NOQA
+from . import TEST_INPUT_DATA
+
 
 def test_ArchiveDataSet_initialisation():
     from arctool.archive import ArchiveDataSet
     archive_ds = ArchiveDataSet(name="my_archive")
     assert archive_ds.name == "my_archive"
     assert archive_ds.data_directory == "archive"
+
+
+# Functional tests.
+
+
+def _manifest_by_path(archive_ds):
+    with open(archive_ds._abs_manifest_path) as fh:
+        manifest = json.load(fh)
+    return {entry['path']: entry for entry in manifest['file_list']}
+
+
+def test_update_manifest_incremental(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveDataSet
+
+    archive_ds = ArchiveDataSet("my_archive")
+    archive_ds.persist_to_path(tmp_dir_fixture)
+    copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+              os.path.join(tmp_dir_fixture, 'archive'))
+
+    archive_ds = ArchiveDataSet.from_path(tmp_dir_fixture)
+    archive_ds.update_manifest()
+
+    entries = _manifest_by_path(archive_ds)
+    assert set(entries) == set(['file1.txt', 'dir1/file2.txt'])
+    expected_hash = entries['file1.txt']['hash']
+    assert 'inode' in entries['file1.txt']
+
+    # Unchanged files keep their existing entries.
+    for entry in archive_ds._structural_metadata['file_list']:
+        entry['hash'] = 'reused'
+    archive_ds.update_manifest()
+    entries = _manifest_by_path(archive_ds)
+    assert entries['file1.txt']['hash'] == 'reused'
+
+    # Changed and new files are hashed.
+    with open(os.path.join(tmp_dir_fixture, 'archive', 'file1.txt'),
+              'a') as fh:
+        fh.write("More data")
+    with open(os.path.join(tmp_dir_fixture, 'archive', 'file3.txt'),
+              'w') as fh:
+        fh.write("New data")
+    archive_ds.update_manifest()
+    entries = _manifest_by_path(archive_ds)
+    assert entries['file1.txt']['hash'] not in ('reused', expected_hash)
+    assert entries['dir1/file2.txt']['hash'] == 'reused'
+    assert len(entries['file3.txt']['hash']) == 40
+
+    # Full update rehashes everything.
+    archive_ds.update_manifest(full=True)
+    entries = _manifest_by_path(archive_ds)
+    assert entries['dir1/file2.txt']['hash'] != 'reused'
+
+
+def test_update_manifest_with_workers(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveDataSet
+
+    archive_ds = ArchiveDataSet("my_archive")
+    archive_ds.persist_to_path(tmp_dir_fixture)
+    data_directory = os.path.join(tmp_dir_fixture, 'archive')
+    for i in range(20):
+        with open(os.path.join(data_directory, "file_{}.txt".format(i)),
+                  "w") as fh:
+            fh.write("data " * i * 100)
+
+    archive_ds = ArchiveDataSet.from_path(tmp_dir_fixture)
+    archive_ds.update_manifest(full=True)
+    with open(archive_ds._abs_manifest_path) as fh:
+        serial_manifest = fh.read()
+
+    archive_ds.update_manifest(full=True, n_workers=4)
+    with open(archive_ds._abs_manifest_path) as fh:
+        parallel_manifest = fh.read()
+
+    assert parallel_manifest == serial_manifest
+
+
+def test_hash_algorithm(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveDataSet
+
+    archive_ds = ArchiveDataSet("my_archive", hash_algorithm="sha256")
+    archive_ds.persist_to_path(tmp_dir_fixture)
+    copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+              os.path.join(tmp_dir_fixture, 'archive'))
+
+    archive_ds = ArchiveDataSet.from_path(tmp_dir_fixture)
+    assert archive_ds.hash_algorithm == "sha256"
+    archive_ds.update_manifest()
+
+    entries = _manifest_by_path(archive_ds)
+    assert len(entries['file1.txt']['hash']) == 64
+
+    archive_ds.set_hash_algorithm("sha1")
+    archive_ds.update_manifest()
+
+    archive_ds = ArchiveDataSet.from_path(tmp_dir_fixture)
+    assert archive_ds.hash_algorithm == "sha1"
+    assert archive_ds.manifest["hash_function"] == "shasum"
+    entries = _manifest_by_path(archive_ds)
+    expected = 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+    assert entries['file1.txt']['hash'] == expected
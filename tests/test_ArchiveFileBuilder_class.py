@@ -3,8 +3,11 @@
 import os
 from distutils.dir_util import copy_tree
 import json
+import tarfile
 import subprocess
 
+import pytest
+
 from . import tmp_dir_fixture  # NOQA
 from . import TEST_INPUT_DATA
 
@@ -90,3 +93,314 @@ def test_create_archive(tmp_dir_fixture):  # NOQA
         manifest = json.load(fh)
 
     assert len(manifest['file_list']) == 2
+
+
+def _create_archive_dataset(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveDataSet
+
+    archive_directory_path = os.path.join(tmp_dir_fixture, "my_archive")
+    os.mkdir(archive_directory_path)
+    archive_ds = ArchiveDataSet("my_archive")
+    archive_ds.persist_to_path(archive_directory_path)
+
+    archive_input_path = os.path.join(TEST_INPUT_DATA, 'archive')
+    archive_output_path = os.path.join(archive_directory_path, 'archive')
+    copy_tree(archive_input_path, archive_output_path)
+
+    archive_ds = ArchiveDataSet.from_path(archive_directory_path)
+    archive_ds.update_manifest()
+
+    return archive_directory_path
+
+
+@pytest.mark.parametrize("blocked", [True, False])
+def test_persist_to_tar_gz(tmp_dir_fixture, blocked):  # NOQA
+    from arctool.archive import ArchiveFile, ArchiveFileBuilder
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    gzip_path = archive_builder.persist_to_tar_gz(tmp_dir_fixture,
+                                                  blocked=blocked)
+
+    expected_gzip_path = os.path.join(tmp_dir_fixture, "my_archive.tar.gz")
+    assert gzip_path == expected_gzip_path
+
+    with tarfile.open(gzip_path, 'r:gz') as tar:
+        names = tar.getnames()
+    expected_headers = [os.path.join("my_archive", hf)
+                        for hf in ArchiveFileBuilder.header_file_order]
+    assert names[:3] == expected_headers
+    assert "my_archive/archive/dir1/file2.txt" in names
+
+    archive_file = ArchiveFile.from_file(gzip_path)
+    assert archive_file.verify_all()
+    expected = 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+    assert archive_file.calculate_file_hash('file1.txt') == expected
+
+
+def test_persist_to_tar_gz_checks_manifest(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder, ArchiveManifestError
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    with open(os.path.join(archive_directory_path, "archive", "new.txt"),
+              "w") as fh:
+        fh.write("Not in the manifest")
+
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    with pytest.raises(ArchiveManifestError):
+        archive_builder.persist_to_tar_gz(tmp_dir_fixture, blocked=True)
+
+    assert not os.path.isfile(
+        os.path.join(tmp_dir_fixture, "my_archive.tar.gz"))
+
+
+def test_persist_to_tar_gz_sha256(tmp_dir_fixture):  # NOQA
+    from arctool.archive import (
+        ArchiveDataSet,
+        ArchiveFile,
+        ArchiveFileBuilder,
+    )
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_ds = ArchiveDataSet.from_path(archive_directory_path)
+    archive_ds.set_hash_algorithm("sha256")
+    archive_ds.update_manifest()
+
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    gzip_path = archive_builder.persist_to_tar_gz(tmp_dir_fixture,
+                                                  blocked=True)
+
+    archive_file = ArchiveFile.from_file(gzip_path)
+    assert archive_file.hash_algorithm == "sha256"
+    assert archive_file.verify_all()
+    assert archive_file.verification_report(n_workers=2)['corrupt'] == []
+    assert len(archive_file.calculate_file_hash('file1.txt')) == 64
+
+
+def test_persist_to_tar_progress(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder, ArchiveFile
+    from arctool.progress import ProgressMeter
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    meter = ProgressMeter()
+    tar_path = archive_builder.persist_to_tar(tmp_dir_fixture,
+                                              progress=meter.update)
+
+    manifest = archive_builder._archive_dataset.manifest
+    header_size = sum(
+        os.path.getsize(os.path.join(archive_directory_path, hf))
+        for hf in ArchiveFileBuilder.header_file_order)
+    data_size = sum(entry['size'] for entry in manifest['file_list'])
+    assert meter.n_bytes == header_size + data_size
+    assert meter.current in [entry['path'] for entry in manifest['file_list']]
+
+    archive_file = ArchiveFile.from_file(tar_path)
+    assert archive_file._index is not None
+    assert archive_file.verify_all()
+
+
+def test_initialise_and_append_to_tar(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    archive_builder.initialise_tar(tmp_dir_fixture)
+    with tarfile.open(archive_builder._tar_path) as tar:
+        assert len(tar.getnames()) == 3
+
+    archive_builder.append_to_tar(tmp_dir_fixture)
+    with tarfile.open(archive_builder._tar_path) as tar:
+        appended_names = tar.getnames()
+
+    tar_path = archive_builder.persist_to_tar(tmp_dir_fixture)
+    with tarfile.open(tar_path) as tar:
+        assert tar.getnames() == appended_names
+
+
+def test_rebuild_over_existing_archive(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder, ArchiveFile
+    from arctool.index import index_path
+    from arctool.manifest import (
+        compact_manifest_path,
+        write_compact_manifest,
+    )
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    tar_path = ArchiveFileBuilder.from_path(archive_directory_path) \
+        .persist_to_tar(tmp_dir_fixture)
+    write_compact_manifest(compact_manifest_path(tar_path),
+                           ArchiveFile.from_file(tar_path,
+                                                 compact=True).manifest)
+    size = os.path.getsize(tar_path)
+
+    # A small file sorted first moves every file along in the tarball,
+    # which stays the same size, padded to whole records.
+    with open(os.path.join(archive_directory_path, 'archive', 'a.txt'),
+              'w') as fh:
+        fh.write('New\n')
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    tar_path = archive_builder.persist_to_tar(tmp_dir_fixture)
+    assert os.path.getsize(tar_path) == size
+    assert not os.path.exists(compact_manifest_path(tar_path))
+
+    archive_file = ArchiveFile.from_file(tar_path)
+    assert archive_file._index is not None
+    for entry in archive_file.manifest['file_list']:
+        assert archive_file.verify_file(entry['path'])
+
+    archive_builder.initialise_tar(tmp_dir_fixture)
+    assert not os.path.exists(index_path(tar_path))
+
+
+def test_persist_to_tar_error(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    def fail(n_bytes, name):
+        raise IOError("Disk full")
+
+    with pytest.raises(IOError):
+        archive_builder.persist_to_tar(tmp_dir_fixture, progress=fail)
+
+    assert not os.path.exists(
+        os.path.join(tmp_dir_fixture, "my_archive.tar"))
+
+
+@pytest.mark.parametrize("compressed,blocked", [
+    (False, False),
+    (True, False),
+    (True, True),
+])
+def test_resume_from_checkpoint(tmp_dir_fixture, compressed, blocked):  # NOQA
+    from arctool.archive import ArchiveFileBuilder, ArchiveFile
+    from arctool.checkpoint import checkpoint_path, read_checkpoint
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    def persist(**kwargs):
+        if compressed:
+            return archive_builder.persist_to_tar_gz(
+                tmp_dir_fixture, blocked=blocked, checkpoint_interval=1,
+                **kwargs)
+        return archive_builder.persist_to_tar(
+            tmp_dir_fixture, checkpoint_interval=1, **kwargs)
+
+    def interrupt(n_bytes, name):
+        if name == 'dir1/file2.txt':
+            raise IOError("Interrupted")
+
+    with pytest.raises(IOError):
+        persist(progress=interrupt)
+
+    output_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    if compressed:
+        output_path += ".gz"
+    members, _, state = read_checkpoint(output_path)
+    assert state['last_entry'] == 'my_archive/archive/dir1'
+    assert len(members) == 4
+
+    written = []
+    assert persist(resume=True,
+                   progress=lambda n, name: written.append(name)) \
+        == output_path
+    assert 'file1.txt' not in written
+    assert not os.path.exists(checkpoint_path(output_path))
+
+    with tarfile.open(output_path) as tar:
+        names = tar.getnames()
+    assert len(names) == len(set(names)) == 7
+
+    archive_file = ArchiveFile.from_file(output_path)
+    assert len(archive_file._index['members']) == 5
+    assert archive_file.verify_all()
+    expected = 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+    assert archive_file.calculate_file_hash('file1.txt') == expected
+
+
+def test_resume_changed_dataset(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    def interrupt(n_bytes, name):
+        if name == 'dir1/file2.txt':
+            raise IOError("Interrupted")
+
+    with pytest.raises(IOError):
+        archive_builder.persist_to_tar(tmp_dir_fixture, progress=interrupt,
+                                       checkpoint_interval=1)
+
+    os.remove(os.path.join(archive_directory_path, 'archive', 'file1.txt'))
+    with pytest.raises(ValueError):
+        archive_builder.persist_to_tar(tmp_dir_fixture, resume=True,
+                                       checkpoint_interval=1)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_persist_to_volumes(tmp_dir_fixture, compress):  # NOQA
+    from arctool.archive import (
+        ArchiveFile,
+        ArchiveFileBuilder,
+        ArchiveVolumeSet,
+    )
+    from arctool.volumes import read_volume_index
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    index_path = archive_builder.persist_to_volumes(
+        tmp_dir_fixture, max_volume_size=1, compress=compress)
+
+    assert index_path == os.path.join(tmp_dir_fixture,
+                                      "my_archive.volumes.json")
+    volume_index = read_volume_index(index_path)
+    volumes = volume_index['volumes']
+    assert [volume['members'] for volume in volumes] \
+        == [['file1.txt'], ['dir1/file2.txt']]
+    suffix = ".tar.gz" if compress else ".tar"
+    assert volumes[1]['path'] == os.path.join(tmp_dir_fixture,
+                                              "my_archive.002" + suffix)
+
+    # Each volume is a tarball in its own right.
+    with tarfile.open(volumes[1]['path']) as tar:
+        names = tar.getnames()
+    assert names[:3] == ['my_archive/' + hf for hf
+                         in ArchiveFileBuilder.header_file_order]
+    assert names[-1] == 'my_archive/archive/dir1/file2.txt'
+
+    archive_file = ArchiveFile.from_file(index_path)
+    assert isinstance(archive_file, ArchiveVolumeSet)
+    assert len(archive_file.volumes) == 2
+    assert archive_file.summarise()['n_files'] == 2
+    assert archive_file.verify_all()
+    assert archive_file.verify_file('dir1/file2.txt')
+    assert archive_file.verify_files(['dir1/file2.txt', 'file1.txt']) \
+        == {'dir1/file2.txt': True, 'file1.txt': True}
+
+    report = archive_file.verification_report(n_workers=2)
+    assert report['complete']
+    assert report['corrupt'] == []
+    assert report['missing'] == []
+
+    archive_file._volumes[1]._manifest['file_list'][0]['hash'] = 'nonsense'
+    report = archive_file.verification_report(n_workers=2)
+    assert report['corrupt'] == ['dir1/file2.txt']
+
+
+def test_plan_volumes(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFileBuilder
+
+    archive_directory_path = _create_archive_dataset(tmp_dir_fixture)
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+
+    plan = archive_builder._plan_volumes(max_volume_size=2 ** 30)
+    assert len(plan) == 1
+    assert plan[0] == list(archive_builder._iter_tar_entries())
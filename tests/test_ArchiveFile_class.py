@@ -1,9 +1,13 @@
 """Tests for arctool.archive.ArchiveFile class."""
 
 import os
+import gzip
+import tarfile
 import subprocess
+from distutils.dir_util import copy_tree
 
 from . import tmp_archive  # NOQA
+from . import tmp_dir_fixture  # NOQA
 
 HERE = os.path.dirname(__file__)
 TEST_INPUT_DATA = os.path.join(HERE, "data", "basic", "input")
@@ -70,6 +74,22 @@ def test_archive_calculate_hash(tmp_archive):  # NOQA
     assert actual == expected
 
 
+def test_archive_calculate_hash_without_index(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.index import index_path
+
+    assert os.path.isfile(index_path(tmp_archive))
+    os.remove(index_path(tmp_archive))
+
+    archive = ArchiveFile.from_file(tmp_archive)
+    assert archive._index is None
+
+    actual = archive.calculate_file_hash('file1.txt')
+    expected = 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+
+    assert actual == expected
+
+
 def test_summarise_archive(tmp_archive):  # NOQA
 
     from arctool.archive import ArchiveFile
@@ -80,3 +100,41 @@ def test_summarise_archive(tmp_archive):  # NOQA
     assert isinstance(summary, dict)
 
     assert summary['n_files'] == 2
+
+
+def test_from_file_reads_header_only(tmp_dir_fixture):  # NOQA
+    from arctool.archive import (
+        ArchiveDataSet,
+        ArchiveFile,
+        ArchiveFileBuilder,
+    )
+
+    archive_directory_path = os.path.join(tmp_dir_fixture, "my_archive")
+    os.mkdir(archive_directory_path)
+    archive_ds = ArchiveDataSet("my_archive")
+    archive_ds.persist_to_path(archive_directory_path)
+    with open(archive_ds.abs_readme_path, "w") as fh:
+        fh.write("project_name: my_project\n")
+    copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+              os.path.join(archive_directory_path, 'archive'))
+
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    tar_path = archive_builder.persist_to_tar(tmp_dir_fixture)
+
+    # Gzip only the header members; the data members are cut off.
+    with tarfile.open(tar_path) as tar:
+        readme_member = tar.getmember("my_archive/README.yml")
+    header_end = readme_member.offset_data + readme_member.size
+    truncated_path = os.path.join(tmp_dir_fixture, "truncated.tar.gz")
+    with open(tar_path, "rb") as fh_in:
+        with gzip.open(truncated_path, "wb") as fh_out:
+            fh_out.write(fh_in.read(header_end + 512))
+
+    assert ArchiveFile.from_file(tar_path)._index is not None
+
+    for path in (tar_path, truncated_path):
+        archive_file = ArchiveFile.from_file(path, use_pigz=False)
+        assert archive_file.admin_metadata['name'] == 'my_archive'
+        assert len(archive_file.manifest['file_list']) == 2
+        assert archive_file.descriptive_metadata == {
+            'project_name': 'my_project'}
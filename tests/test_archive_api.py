@@ -1,9 +1,15 @@
 """Test the archive module."""
 
 import os
+import gzip
 import subprocess
+from distutils.dir_util import copy_tree
+
+import pytest
 
 from . import tmp_archive  # NOQA
+from . import tmp_dir_fixture  # NOQA
+from . import TEST_INPUT_DATA
 
 
 def test_compress_archive(tmp_archive):  # NOQA
@@ -42,3 +48,257 @@ def test_verify_file(tmp_archive):  # NOQA
 
     archive_file._manifest["file_list"][0]["hash"] = "nonsense"
     assert not archive_file.verify_file('file1.txt')
+
+
+def test_verification_report(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+
+    report = archive_file.verification_report()
+    assert report['missing'] == []
+    assert report['extra'] == []
+    assert report['corrupt'] == []
+    assert report['n_bytes'] == sum(
+        entry['size'] for entry in archive_file.manifest['file_list'])
+
+    file_list = archive_file._manifest["file_list"]
+    file_list.sort(key=lambda entry: entry['path'])
+    corrupt_entry, extra_entry = file_list[0], file_list[1]
+    corrupt_entry["hash"] = "nonsense"
+    file_list.remove(extra_entry)
+    file_list.append({"path": "not/in/archive.txt", "hash": "nonsense"})
+
+    report = archive_file.verification_report()
+    assert report['corrupt'] == [corrupt_entry['path']]
+    assert report['extra'] == [extra_entry['path']]
+    assert report['missing'] == ["not/in/archive.txt"]
+
+    assert not archive_file.verify_all()
+
+
+def test_archive_verify_all_with_workers(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    report = archive_file.verification_report(n_workers=4)
+    assert report['corrupt'] == []
+    assert report['missing'] == []
+
+    archive_file._manifest["file_list"][0]["hash"] = "nonsense"
+    report = archive_file.verification_report(n_workers=4)
+    assert report['corrupt'] == [archive_file.manifest["file_list"][0]["path"]]
+
+
+def test_archive_verify_all_with_workers_buf_size(tmp_archive, mocker):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.pipeline import HashingPipeline
+
+    pipeline = mocker.patch("arctool.archive.HashingPipeline",
+                            wraps=HashingPipeline)
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    archive_file.buf_size = 7
+    report = archive_file.verification_report(n_workers=4)
+    assert report['corrupt'] == []
+    assert pipeline.call_args[1]['chunk_size'] == 7
+
+
+def test_open_tar_stream(tmp_archive):  # NOQA
+    from arctool.archive import open_tar_stream
+
+    with open_tar_stream(tmp_archive) as tar:
+        names_pigz = [member.name for member in tar]
+
+    with open_tar_stream(tmp_archive, use_pigz=False) as tar:
+        names_python = [member.name for member in tar]
+
+    assert names_pigz == names_python
+    assert names_pigz[0] == "brassica_rnaseq_reads/.dtool/dtool"
+
+
+def test_open_tar_stream_without_pigz(tmp_archive, monkeypatch):  # NOQA
+    import arctool.archive
+    from arctool.archive import ArchiveFile
+
+    monkeypatch.setattr(arctool.archive, "which", lambda name: None)
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    assert archive_file.verify_all()
+
+
+def test_compress_archive_blocked(tmp_dir_fixture):  # NOQA
+    from arctool.archive import (
+        ArchiveDataSet,
+        ArchiveFile,
+        ArchiveFileBuilder,
+        compress_archive_blocked,
+    )
+    from arctool.index import read_index
+
+    archive_directory_path = os.path.join(tmp_dir_fixture, "my_archive")
+    os.mkdir(archive_directory_path)
+    archive_ds = ArchiveDataSet("my_archive")
+    archive_ds.persist_to_path(archive_directory_path)
+    copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+              os.path.join(archive_directory_path, 'archive'))
+
+    archive_builder = ArchiveFileBuilder.from_path(archive_directory_path)
+    tar_path = archive_builder.persist_to_tar(tmp_dir_fixture)
+    with open(tar_path, "rb") as fh:
+        tar_data = fh.read()
+
+    gzip_path = compress_archive_blocked(tar_path, block_size=1024)
+
+    assert gzip_path == tar_path + ".gz"
+    assert not os.path.isfile(tar_path)
+    with gzip.open(gzip_path, "rb") as fh:
+        assert fh.read() == tar_data
+
+    index = read_index(gzip_path)
+    assert index["block_size"] == 1024
+    assert len(index["seek_points"]) > 1
+
+    archive_file = ArchiveFile.from_file(gzip_path)
+    assert archive_file.verify_all()
+    expected = 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+    assert archive_file.calculate_file_hash('file1.txt') == expected
+
+
+def test_compress_archive_progress(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile, compress_archive
+    from arctool.progress import ProgressMeter
+
+    tar_filename, _ = tmp_archive.rsplit('.', 1)
+    subprocess.call(["gunzip", tmp_archive])
+    tar_size = os.stat(tar_filename).st_size
+
+    meter = ProgressMeter(tar_size)
+    gzip_filename = compress_archive(tar_filename, progress=meter.update)
+
+    assert meter.n_bytes == tar_size
+    assert not os.path.isfile(tar_filename)
+
+    archive_file = ArchiveFile.from_file(gzip_filename)
+    meter = ProgressMeter()
+    report = archive_file.verification_report(n_workers=2,
+                                              progress=meter.update)
+    assert report['corrupt'] == []
+    assert meter.n_bytes == report['n_bytes']
+
+
+def test_verification_journal(tmp_archive, tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.journal import read_journal
+
+    journal_path = os.path.join(tmp_dir_fixture, "verify.jsonl")
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    for entry in archive_file._manifest["file_list"]:
+        entry["hash"] = "nonsense"
+
+    report = archive_file.verification_report(journal_path=journal_path,
+                                              keep_going=False)
+    assert not report['complete']
+    assert report['corrupt'] == ['file1.txt']
+    assert report['missing'] == []
+
+    records = read_journal(journal_path)
+    assert list(records) == ['file1.txt']
+    assert records['file1.txt']['expected'] == "nonsense"
+    assert records['file1.txt']['actual'] \
+        == 'a250369afb3eeaa96fb0df99e7755ba784dfd69c'
+    assert records['file1.txt']['bytes'] > 0
+
+    hashed = []
+    report = archive_file.verification_report(
+        journal_path=journal_path, resume=True,
+        progress=lambda n_bytes, name: hashed.append(name))
+    assert report['complete']
+    assert report['corrupt'] == ['file1.txt', 'dir1/file2.txt']
+    assert set(hashed) == set(['dir1/file2.txt'])
+    assert list(read_journal(journal_path)) == ['file1.txt', 'dir1/file2.txt']
+
+
+def test_verify_all_stops_at_first_failure(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    archive_file._manifest["file_list"].append(
+        {"path": "not/in/archive.txt", "hash": "nonsense"})
+    assert not archive_file.verify_all()
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    for entry in archive_file._manifest["file_list"]:
+        entry["hash"] = "nonsense"
+    report = archive_file.verification_report(n_workers=2, keep_going=False)
+    assert not report['complete']
+    assert len(report['corrupt']) == 1
+    assert not archive_file.verify_all()
+
+
+def test_verify_files(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.index import index_path
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+
+    assert archive_file.verify_files([]) == {}
+    assert archive_file.verify_files(['dir1/file2.txt', 'file1.txt']) \
+        == {'dir1/file2.txt': True, 'file1.txt': True}
+
+    read = []
+    archive_file._manifest_entries()['file1.txt']['hash'] = 'nonsense'
+    results = archive_file.verify_files(
+        ['file1.txt'], progress=lambda n_bytes, name: read.append(name))
+    assert results == {'file1.txt': False}
+    assert set(read) == {'file1.txt'}
+
+    with pytest.raises(KeyError):
+        archive_file.verify_files(['nonexistent.txt'])
+
+    # Without an index the archive is read from the start.
+    os.remove(index_path(tmp_archive))
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    assert archive_file.verify_files(['dir1/file2.txt', 'file1.txt']) \
+        == {'dir1/file2.txt': True, 'file1.txt': True}
+
+
+def test_stale_index_is_not_trusted(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.index import build_index, write_index
+
+    # An index of an earlier build of the archive that happens to have
+    # the same size and fingerprint, with the members at other offsets.
+    index = build_index(tmp_archive)
+    offsets = [(entry['offset'], entry['offset_data'])
+               for entry in index['members']]
+    offsets = offsets[1:] + offsets[:1]
+    for entry, (offset, offset_data) in zip(index['members'], offsets):
+        entry['offset'], entry['offset_data'] = offset, offset_data
+    write_index(tmp_archive, index)
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    assert archive_file.verify_files(['dir1/file2.txt', 'file1.txt']) \
+        == {'dir1/file2.txt': True, 'file1.txt': True}
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    assert archive_file.verify_file('file1.txt')
+    assert archive_file.verify_file('dir1/file2.txt')
+
+
+def test_manifest_lookups_are_cached(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+
+    entries = archive_file._manifest_entries()
+    assert archive_file._manifest_entries() is entries
+    assert archive_file.summarise()['n_files'] == 2
+
+    # Replacing the manifest rebuilds the lookups.
+    archive_file._manifest = dict(archive_file.manifest,
+                                  file_list=archive_file.manifest[
+                                      'file_list'][:1])
+    assert len(archive_file._manifest_entries()) == 1
+    assert archive_file.summarise()['n_files'] == 1
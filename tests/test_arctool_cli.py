@@ -8,6 +8,8 @@ from distutils.dir_util import copy_tree
 
 from . import remember_cwd
 from . import chdir_fixture  # NOQA
+from . import tmp_archive  # NOQA
+from . import tmp_dir_fixture  # NOQA
 
 HERE = os.path.dirname(__file__)
 TEST_INPUT_DATA = os.path.join(HERE, "data", "basic", "input")
@@ -70,12 +72,25 @@ def test_full_archiving_workflow(chdir_fixture):  # NOQA
     gzip_path = "data_set_1.tar.gz"
     assert os.path.isfile(gzip_path)
 
+    cmd = ["arctool", "archive", "create", "--compress",
+           "--max-volume-size", "0.000001", dataset_path]
+    subprocess.call(cmd)
+    volume_index_path = "data_set_1.volumes.json"
+    assert os.path.isfile(volume_index_path)
+    assert os.path.isfile("data_set_1.002.tar.gz")
+
     # Remove the dataset path to ensure that files are actually extracted.
     shutil.rmtree(dataset_path)
 
     cmd = ["arctool", "verify", "summary", gzip_path]
     subprocess.call(cmd)
 
+    cmd = ["arctool", "verify", "full", gzip_path]
+    assert subprocess.call(cmd) == 0
+
+    cmd = ["arctool", "verify", "full", "--workers", "2", volume_index_path]
+    assert subprocess.call(cmd) == 0
+
 
 def test_new(chdir_fixture):  # NOQA
 
@@ -202,3 +217,244 @@ def test_create_new_datasets_within_existing_project(chdir_fixture):  # NOQA
         result = runner.invoke(new, input=input_string)
 
         assert not result.exception
+
+
+def test_archive_index(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.cli import index
+    from arctool.index import index_path, read_index
+    from arctool.manifest import compact_manifest_path
+
+    os.remove(index_path(tmp_archive))
+
+    runner = CliRunner()
+    result = runner.invoke(index, [tmp_archive])
+
+    assert not result.exception
+    assert read_index(tmp_archive) is not None
+    assert os.path.isfile(compact_manifest_path(tmp_archive))
+
+
+def test_archive_diff(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.archive import ArchiveDataSet
+    from arctool.cli import diff
+
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+
+    runner = CliRunner()
+    result = runner.invoke(diff, [tmp_archive, dataset_path])
+    assert not result.exception
+    assert "0 added, 0 changed, 0 removed, 2 unchanged" in result.output
+
+    with open(os.path.join(dataset_path, "archive", "new.txt"), "w") as fh:
+        fh.write("New\n")
+    ArchiveDataSet.from_path(dataset_path).update_manifest()
+
+    result = runner.invoke(diff, [tmp_archive, dataset_path])
+    assert not result.exception
+    assert "A new.txt" in result.output
+    assert "1 added, 0 changed, 0 removed, 2 unchanged" in result.output
+    assert "--incremental-from" in result.output
+
+
+def test_archive_create_incremental(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.archive import ArchiveFile
+    from arctool.cli import create
+
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+    with open(os.path.join(dataset_path, "archive", "new.txt"), "w") as fh:
+        fh.write("New\n")
+    with open(os.path.join(dataset_path, "README.yml"), "w") as fh:
+        fh.write("---\n"
+                 "project_name: some_project\n"
+                 "dataset_name: brassica_rnaseq_reads\n"
+                 "confidential: False\n"
+                 "personally_identifiable_information: False\n"
+                 "owners:\n"
+                 "  - name: Test User\n"
+                 "    email: test.user@example.com\n"
+                 "    username: usert\n"
+                 "archive_date: 2017-06-01\n")
+
+    runner = CliRunner()
+    result = runner.invoke(create, ["--incremental-from", tmp_archive,
+                                    dataset_path])
+    assert not result.exception
+
+    tar_paths = [name for name in os.listdir(os.path.dirname(tmp_archive))
+                 if ".delta-" in name and name.endswith(".tar")]
+    assert len(tar_paths) == 1
+    archive_file = ArchiveFile.from_file(
+        os.path.join(os.path.dirname(tmp_archive), tar_paths[0]))
+    assert archive_file.incremental["paths"] == ["new.txt"]
+
+    result = runner.invoke(create, ["--incremental-from", tmp_archive,
+                                    "--max-volume-size", "1", dataset_path])
+    assert result.exit_code == 2
+
+
+def test_dedup(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.cli import add, report
+
+    runner = CliRunner()
+    result = runner.invoke(add, [tmp_archive])
+    assert not result.exception
+    assert os.path.abspath(tmp_archive) in result.output
+
+    result = runner.invoke(report)
+    assert not result.exception
+    assert "brassica_rnaseq_reads" in result.output
+    assert "Total saved: 0.00 GiB" in result.output
+
+
+def test_manifest_create_records_run(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.cli import manifest
+    from arctool.estimate import read_history
+
+    def manifest_runs():
+        return [r for r in read_history() if r["step"] == "manifest"]
+
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+    n_runs = len(manifest_runs())
+
+    runner = CliRunner()
+    result = runner.invoke(manifest, ["create", "--full", dataset_path])
+    assert not result.exception
+    assert len(manifest_runs()) == n_runs + 1
+    assert manifest_runs()[-1]["n_bytes"] > 0
+
+    # Nothing is hashed when nothing has changed.
+    result = runner.invoke(manifest, ["create", dataset_path])
+    assert not result.exception
+    assert len(manifest_runs()) == n_runs + 1
+
+
+def test_verify_full_journal(tmp_archive):  # NOQA
+
+    from click.testing import CliRunner
+    from arctool.cli import full
+    from arctool.journal import journal_path
+
+    runner = CliRunner()
+    result = runner.invoke(full, [tmp_archive])
+    assert not result.exception
+    assert not os.path.exists(journal_path(tmp_archive))
+
+    result = runner.invoke(full, ["--resume", tmp_archive])
+    assert not result.exception
+    assert os.path.isfile(journal_path(tmp_archive))
+
+
+def test_archive_create_all(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from arctool.cli import create_all
+
+    from .test_batch_api import _create_project
+
+    _create_project(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(create_all, ['--cores-per-job', '1',
+                                        tmp_dir_fixture])
+
+    assert result.exit_code == 0
+    assert 'Datasets found: 2' in result.output
+    assert 'dataset_2' in result.output.splitlines()[-1]
+    assert os.path.isfile(os.path.join(tmp_dir_fixture, "dataset_1.tar.gz"))
+    assert os.path.isfile(os.path.join(tmp_dir_fixture, "dataset_2.tar.gz"))
+
+
+def test_slurm_pipeline(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from arctool.cli import pipeline
+
+    from .test_batch_api import _create_project
+
+    _create_project(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(pipeline, ['--throughput', 'compress=50',
+                                      tmp_dir_fixture])
+
+    assert result.exit_code == 0
+    assert '#SBATCH --array=0-1' in result.output
+    assert 'VERIFY_JOB=$(sbatch' in result.output
+    assert '--index-span 64 --block-size 4 ' in result.output
+
+    result = runner.invoke(pipeline, ['--throughput', 'unpack=50',
+                                      tmp_dir_fixture])
+    assert result.exit_code != 0
+
+
+def test_archive_compress_slurm(tmp_archive):  # NOQA
+    from click.testing import CliRunner
+    from arctool.cli import compress
+
+    runner = CliRunner()
+    result = runner.invoke(compress, ['--slurm', tmp_archive])
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert '#SBATCH -c 1' in lines
+    assert '#SBATCH -t 0-00:15' in lines
+    assert lines[-1].startswith('arctool archive compress -c 1 ')
+
+    result = runner.invoke(compress, ['--slurm', '--blocked',
+                                      '--block-size', '8',
+                                      '--index-span', '16', tmp_archive])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[-1] \
+        == 'arctool archive compress -c 1 --index-span 16 --blocked ' \
+        '--block-size 8 {}'.format(os.path.abspath(tmp_archive))
+
+
+def test_estimate(tmp_archive):  # NOQA
+    from click.testing import CliRunner
+    from arctool.cli import estimate
+
+    runner = CliRunner()
+    result = runner.invoke(estimate, [tmp_archive])
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[1].split()[:4] == ['step', 'cores', 'memory', 'walltime']
+    assert lines[2].startswith('verify')
+
+
+_STARTUP_SCRIPT = """
+import sys
+from arctool.cli import cli
+try:
+    cli.main(['--help'], prog_name='arctool')
+except SystemExit:
+    pass
+heavy = [m for m in ('dtool', 'jinja2', 'yaml', 'fluent', 'tarfile')
+         if m in sys.modules]
+sys.stderr.write(','.join(heavy))
+"""
+
+
+def test_cli_startup_imports():
+    import sys
+
+    process = subprocess.Popen([sys.executable, "-c", _STARTUP_SCRIPT],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+
+    assert process.returncode == 0
+    assert b'Usage:' in stdout
+    # Heavy dependencies are only imported by the commands that need them.
+    assert stderr.decode() == ''
@@ -4,3 +4,14 @@
 def test_version_is_string():
     import arctool
     assert isinstance(arctool.__version__, str)
+
+
+def test_deprecated_jinja2_env():
+    import warnings
+    import arctool
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        template = arctool.JINJA2_ENV.get_template("submit_command.slurm.j2")
+    assert template is not None
+    assert caught[0].category is DeprecationWarning
@@ -0,0 +1,84 @@
+"""Test the batch module API."""
+
+import os
+from distutils.dir_util import copy_tree
+
+from dtool import DescriptiveMetadata
+
+from . import tmp_dir_fixture  # NOQA
+from . import TEST_INPUT_DATA
+
+
+def _create_project(project_path):
+    from arctool.utils import new_archive_dataset
+
+    for dataset_name in ("dataset_1", "dataset_2"):
+        descriptive_metadata = DescriptiveMetadata([
+            ("project_name", u"my_project"),
+            ("dataset_name", dataset_name),
+            ("confidential", False),
+            ("personally_identifiable_information", False),
+            ("owner_name", u"Your Name"),
+            ("owner_email", u"your.email@example.com"),
+            ("unix_username", u"namey"),
+            ("archive_date", u"2017-01-01"),
+        ])
+        _, dataset_path, _ = new_archive_dataset(project_path,
+                                                 descriptive_metadata)
+        copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+                  os.path.join(dataset_path, 'archive'))
+
+    # Neither a dataset nor a file should be picked up.
+    os.mkdir(os.path.join(project_path, "not_a_dataset"))
+    with open(os.path.join(project_path, "notes.txt"), "w") as fh:
+        fh.write("Not a dataset")
+
+
+def test_find_datasets(tmp_dir_fixture):  # NOQA
+    from arctool.batch import find_datasets
+
+    _create_project(tmp_dir_fixture)
+
+    assert find_datasets(tmp_dir_fixture) == [
+        os.path.join(tmp_dir_fixture, "dataset_1"),
+        os.path.join(tmp_dir_fixture, "dataset_2")]
+
+
+def test_BatchArchiver(tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.batch import BatchArchiver, find_datasets
+
+    _create_project(tmp_dir_fixture)
+    dataset_paths = find_datasets(tmp_dir_fixture)
+
+    # An invalid README fails the dataset, without stopping the others.
+    readme_path = os.path.join(dataset_paths[1], "README.yml")
+    with open(readme_path) as fh:
+        readme = fh.read()
+    with open(readme_path, "w") as fh:
+        fh.write("project_name: my_project\n")
+
+    batch = BatchArchiver(n_workers=2, max_io=1, cores=2, cores_per_job=1)
+    results = list(batch.run(dataset_paths))
+
+    assert [result['name'] for result in results] \
+        == ["dataset_1", "dataset_2"]
+    assert results[0]['status'] == 'archived'
+    assert set(results[0]['steps']) \
+        == set(['manifest', 'tar', 'compress', 'verify'])
+    assert results[0]['n_bytes'] > 0
+    assert results[1]['status'] == 'failed'
+    assert 'README.yml' in results[1]['error']
+
+    gzip_path = os.path.join(tmp_dir_fixture, "dataset_1.tar.gz")
+    assert results[0]['archive_path'] == gzip_path
+    assert not os.path.exists(os.path.join(tmp_dir_fixture, "dataset_1.tar"))
+    assert ArchiveFile.from_file(gzip_path).verify_all()
+
+    with open(readme_path, "w") as fh:
+        fh.write(readme)
+
+    results = list(batch.run(dataset_paths))
+    assert [result['status'] for result in results] \
+        == ['skipped', 'archived']
+    assert results[0]['steps'] == {}
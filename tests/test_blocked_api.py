@@ -0,0 +1,30 @@
+"""Test the blocked module API."""
+
+import io
+import gzip
+import random
+
+
+def test_compress_blocks_roundtrip():
+    from arctool.blocked import compress_blocks, BlockedGzipReader
+
+    random.seed(0)
+    data = b"".join(str(random.random()).encode("utf-8")
+                    for _ in range(20000))
+
+    out_fh = io.BytesIO()
+    seek_points = compress_blocks(io.BytesIO(data), out_fh,
+                                  block_size=10000, n_threads=3)
+    compressed = out_fh.getvalue()
+
+    assert len(seek_points) == (len(data) + 9999) // 10000
+    assert seek_points[1]["uncompressed_offset"] == 10000
+
+    # Readable as a standard (multi-member) gzip file.
+    with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as fh:
+        assert fh.read() == data
+
+    reader = BlockedGzipReader(io.BytesIO(compressed), seek_points,
+                               n_threads=2)
+    assert reader.read(5) + reader.read(12345) + reader.read() == data
+    reader.close()
@@ -0,0 +1,129 @@
+"""Test the dedup module."""
+
+import os
+import shutil
+from distutils.dir_util import copy_tree
+
+from . import tmp_archive  # NOQA
+from . import tmp_dir_fixture  # NOQA
+from . import TEST_INPUT_DATA
+
+
+def _new_dataset(directory, name):
+    from arctool.archive import ArchiveDataSet
+
+    dataset_path = os.path.join(directory, name)
+    os.mkdir(dataset_path)
+    ArchiveDataSet(name).persist_to_path(dataset_path)
+    copy_tree(os.path.join(TEST_INPUT_DATA, 'archive'),
+              os.path.join(dataset_path, 'archive'))
+    return dataset_path
+
+
+def test_add_archive_and_lookup(tmp_archive, tmp_dir_fixture):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.dedup import DedupStore
+
+    archive_file = ArchiveFile.from_file(tmp_archive)
+    entry = archive_file.manifest['file_list'][0]
+
+    with DedupStore(os.path.join(tmp_dir_fixture, 'dedup.sqlite')) as store:
+        assert store.lookup('sha1', entry['hash']) is None
+
+        store.add_archive(archive_file, tmp_archive)
+        # Adding again replaces rather than duplicates.
+        store.add_archive(archive_file, tmp_archive)
+
+        location = store.lookup('sha1', entry['hash'])
+        assert location == {
+            'uuid': archive_file.admin_metadata['uuid'],
+            'archive': os.path.abspath(tmp_archive),
+            'member': os.path.join(archive_file._data_dir(), entry['path']),
+            'size': entry['size']}
+
+        references = store.find_references(
+            'sha1', archive_file.manifest, min_size=0)
+        assert sorted(references) == sorted(
+            e['path'] for e in archive_file.manifest['file_list'])
+        assert store.find_references('sha1', archive_file.manifest) == {}
+        assert store.find_references('sha1', archive_file.manifest,
+                                     min_size=0, exclude=tmp_archive) == {}
+        assert store.find_references(
+            'sha1', archive_file.manifest, min_size=0,
+            exclude=tmp_archive[:-len('.gz')]) == {}
+
+        report = store.report()
+        assert len(report) == 1
+        assert report[0]['name'] == 'brassica_rnaseq_reads'
+        assert report[0]['n_files'] == 2
+        assert report[0]['bytes_saved'] == 0
+
+
+def test_persist_deduplicated(tmp_dir_fixture):  # NOQA
+    from arctool.archive import (
+        ArchiveDataSet,
+        ArchiveFile,
+        ArchiveFileBuilder,
+        compress_archive,
+    )
+    from arctool.dedup import DedupStore
+
+    output_path = os.path.join(tmp_dir_fixture, 'output')
+    os.mkdir(output_path)
+    first_path = _new_dataset(tmp_dir_fixture, 'first')
+    second_path = _new_dataset(tmp_dir_fixture, 'second')
+    with open(os.path.join(second_path, 'archive', 'new.txt'), 'w') as fh:
+        fh.write('New\n')
+    # Compressing checks the data against the existing manifest.
+    ArchiveDataSet.from_path(second_path).update_manifest()
+
+    with DedupStore(os.path.join(tmp_dir_fixture, 'dedup.sqlite')) as store:
+        first_tar = ArchiveFileBuilder.from_path(first_path) \
+            .persist_deduplicated(output_path, store, min_size=0)
+        second_tar = ArchiveFileBuilder.from_path(second_path) \
+            .persist_deduplicated(output_path, store, compress=True,
+                                  min_size=0)
+        report = store.report()
+
+    first = ArchiveFile.from_file(first_tar)
+    assert first.references == {}
+    assert len(first.manifest['file_list']) == 2
+
+    second = ArchiveFile.from_file(second_tar)
+    assert sorted(second.references) == ['dir1/file2.txt', 'file1.txt']
+    assert second.references['file1.txt']['uuid'] \
+        == first.admin_metadata['uuid']
+    assert [e['path'] for e in second.manifest['file_list']] == ['new.txt']
+    assert len(second.dataset_manifest['file_list']) == 3
+
+    assert [r['name'] for r in report] == ['first', 'second']
+    assert report[1]['n_references'] == 2
+    assert report[1]['bytes_saved'] == sum(
+        e['size'] for e in first.manifest['file_list'])
+
+    assert second.verify_all()
+    assert second.verify_file('new.txt')
+    # Referenced files are read from the archive storing them.
+    assert second.verify_file('file1.txt')
+    assert second.calculate_file_hash('dir1/file2.txt') \
+        == first.calculate_file_hash('dir1/file2.txt')
+    progress = []
+    assert second.verify_files(
+        ['new.txt', 'file1.txt', 'dir1/file2.txt'],
+        progress=lambda n, name: progress.append(name)) \
+        == {'new.txt': True, 'file1.txt': True, 'dir1/file2.txt': True}
+    assert set(progress) == set(['new.txt', 'file1.txt', 'dir1/file2.txt'])
+
+    # The referenced archive is found next to the archive referencing it.
+    moved_path = os.path.join(tmp_dir_fixture, 'moved')
+    os.mkdir(moved_path)
+    for path in (first_tar, second_tar):
+        shutil.move(path, moved_path)
+    second = ArchiveFile.from_file(
+        os.path.join(moved_path, os.path.basename(second_tar)))
+    assert second.verify_file('file1.txt')
+
+    # Compressed since it was referenced.
+    compress_archive(os.path.join(moved_path, os.path.basename(first_tar)))
+    assert second.verify_file('dir1/file2.txt')
+    assert second.verify_files(['dir1/file2.txt']) == {'dir1/file2.txt': True}
@@ -0,0 +1,72 @@
+"""Test the arctool.estimate module API."""
+
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_record_and_read_history(tmp_dir_fixture):  # NOQA
+    from arctool.estimate import read_history, record_run
+
+    path = os.path.join(tmp_dir_fixture, "history", "history.jsonl")
+    assert read_history(path) == []
+
+    record_run("compress", 1000, 4, 2.5, memory_mb=100, path=path)
+    record_run("verify", 2000, 1, 1.0, path=path)
+    with open(path, "a") as fh:
+        fh.write('{"step": "ver')
+
+    records = read_history(path)
+    assert [r["step"] for r in records] == ["compress", "verify"]
+    assert records[0]["n_bytes"] == 1000
+    assert records[0]["n_cores"] == 4
+    assert records[0]["memory_mb"] == 100
+
+
+def test_ThroughputModel_fit():
+    from arctool.estimate import ThroughputModel
+    from arctool.slurm import DEFAULT_THROUGHPUT
+
+    model = ThroughputModel.fit("verify", [])
+    assert model.mb_per_second == DEFAULT_THROUGHPUT["verify"]
+    assert model.n_runs == 0
+
+    # 10 s overhead plus 50 MB/s per core.
+    records = [{"n_bytes": n_bytes, "n_cores": n_cores,
+                "seconds": 10 + n_bytes / (50e6 * n_cores),
+                "memory_mb": 200}
+               for n_bytes, n_cores in [(1e9, 1), (4e9, 2), (16e9, 8)]]
+    model = ThroughputModel.fit("compress", records)
+    assert abs(model.mb_per_second - 50) < 1e-6
+    assert abs(model.overhead_seconds - 10) < 1e-6
+    assert model.memory_mb == 200
+    assert model.n_runs == 3
+
+    # A negative overhead is fitted through the origin instead.
+    records = [{"n_bytes": 1e9, "n_cores": 1, "seconds": 1},
+               {"n_bytes": 2e9, "n_cores": 1, "seconds": 10}]
+    model = ThroughputModel.fit("verify", records)
+    assert model.overhead_seconds == 0
+    assert model.mb_per_second > 0
+
+
+def test_Estimator_suggest(tmp_dir_fixture):  # NOQA
+    from arctool.estimate import Estimator, record_run
+
+    path = os.path.join(tmp_dir_fixture, "history.jsonl")
+
+    suggestion = Estimator(path).suggest("compress", 1000)
+    assert suggestion["n_cores"] == 1
+    assert suggestion["walltime"] == "0-00:15"
+    assert suggestion["memory"] == "1024M"
+    assert suggestion["n_runs"] == 0
+
+    for n_bytes in (1e11, 2e11):
+        record_run("compress", n_bytes, 4, n_bytes / 40e6,
+                   memory_mb=1000, path=path)
+    suggestion = Estimator(path).suggest("compress", 1e12, max_cores=8)
+    # 1 TB at 10 MB/s per core needs more than the maximum cores.
+    assert suggestion["n_cores"] == 8
+    assert suggestion["walltime"] == "0-06:57"
+    assert suggestion["memory"] == "1536M"
+    assert suggestion["n_runs"] == 2
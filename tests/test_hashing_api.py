@@ -0,0 +1,64 @@
+"""Test the hashing module API."""
+
+import io
+import os
+import hashlib
+
+import pytest
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_hash_from_file_object():
+    from arctool.hashing import hash_from_file_object
+
+    data = b"Hello world" * 10000
+
+    actual = hash_from_file_object(io.BytesIO(data))
+    assert actual == hashlib.sha1(data).hexdigest()
+
+    actual = hash_from_file_object(io.BytesIO(data), "sha256", buf_size=7)
+    assert actual == hashlib.sha256(data).hexdigest()
+
+
+def test_unknown_hash_algorithm():
+    from arctool.hashing import new_hasher, file_hash_function
+
+    with pytest.raises(ValueError):
+        new_hasher("nonsense")
+
+    with pytest.raises(ValueError):
+        file_hash_function("nonsense")
+
+
+def test_file_hash_function_registered_with_dtool():
+    from dtool.filehasher import HASH_FUNCTIONS, shasum
+    from arctool.hashing import file_hash_function
+
+    assert file_hash_function("sha1") is shasum
+
+    sha256sum = file_hash_function("sha256")
+    assert sha256sum.__name__ == "sha256sum"
+    assert HASH_FUNCTIONS["sha256sum"] is sha256sum
+
+
+def test_algorithm_from_manifest():
+    from arctool.hashing import algorithm_from_manifest
+
+    assert algorithm_from_manifest({"hash_function": "shasum"}) == "sha1"
+    assert algorithm_from_manifest({"hash_function": "md5sum"}) == "md5"
+    assert algorithm_from_manifest({"hash_function": "sha256sum"}) == "sha256"
+    assert algorithm_from_manifest({}) == "sha1"
+
+
+def test_benchmark_hash_algorithms(tmp_dir_fixture):  # NOQA
+    from arctool.hashing import HASH_ALGORITHMS, benchmark_hash_algorithms
+
+    sample_path = os.path.join(tmp_dir_fixture, "sample.bin")
+    with open(sample_path, "wb") as fh:
+        fh.write(b"\0" * 100000)
+
+    results = benchmark_hash_algorithms(sample_path)
+
+    assert set(name for name, _ in results) == set(HASH_ALGORITHMS)
+    assert all(mb_per_second > 0 for _, mb_per_second in results)
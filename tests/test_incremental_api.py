@@ -0,0 +1,125 @@
+"""Test the incremental module."""
+
+import os
+import uuid
+
+import pytest
+
+from . import tmp_archive  # NOQA
+
+
+def _manifest(hashes, hash_function="shasum"):
+    return {"hash_function": hash_function,
+            "file_list": [{"path": path, "hash": hexdigest, "size": 1}
+                          for path, hexdigest in sorted(hashes.items())]}
+
+
+def test_diff_manifests():
+    from arctool.incremental import diff_manifests
+
+    old = _manifest({"a.txt": "1", "b.txt": "2", "c.txt": "3"})
+    new = _manifest({"a.txt": "1", "b.txt": "x", "d.txt": "4"})
+
+    assert diff_manifests(old, new) == {"added": ["d.txt"],
+                                        "changed": ["b.txt"],
+                                        "removed": ["c.txt"],
+                                        "unchanged": 1}
+    assert diff_manifests(old, old) == {"added": [],
+                                        "changed": [],
+                                        "removed": [],
+                                        "unchanged": 3}
+
+    with pytest.raises(ValueError):
+        diff_manifests(old, _manifest({}, hash_function="md5sum"))
+
+
+def _change_dataset(tmp_archive):  # NOQA
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+    data_path = os.path.join(dataset_path, "archive")
+    with open(os.path.join(data_path, "file1.txt"), "w") as fh:
+        fh.write("Changed\n")
+    with open(os.path.join(data_path, "dir1", "file3.txt"), "w") as fh:
+        fh.write("New\n")
+    os.remove(os.path.join(data_path, "dir1", "file2.txt"))
+    return dataset_path
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_persist_incremental(tmp_archive, compress):  # NOQA
+    from arctool.archive import (
+        ArchiveDataSet,
+        ArchiveFile,
+        ArchiveFileBuilder,
+    )
+
+    dataset_path = _change_dataset(tmp_archive)
+    if compress:
+        ArchiveDataSet.from_path(dataset_path).update_manifest()
+
+    archive_builder = ArchiveFileBuilder.from_path(dataset_path)
+    output_path = archive_builder.persist_incremental(
+        os.path.dirname(tmp_archive), tmp_archive, compress=compress)
+
+    assert output_path != tmp_archive
+    assert os.path.basename(output_path).startswith(
+        "brassica_rnaseq_reads.delta-")
+    assert output_path.endswith(".tar.gz" if compress else ".tar")
+
+    base = ArchiveFile.from_file(tmp_archive)
+    assert base.incremental is None
+    assert base.dataset_manifest is base.manifest
+
+    archive_file = ArchiveFile.from_file(output_path)
+    reference = archive_file.incremental
+    assert reference["base_uuid"] == base.admin_metadata["uuid"]
+    assert reference["base_archive"] == os.path.basename(tmp_archive)
+    assert reference["paths"] == ["dir1/file3.txt", "file1.txt"]
+    assert reference["removed"] == ["dir1/file2.txt"]
+
+    paths = sorted(e["path"] for e in archive_file.manifest["file_list"])
+    assert paths == ["dir1/file3.txt", "file1.txt"]
+    paths = sorted(e["path"]
+                   for e in archive_file.dataset_manifest["file_list"])
+    assert paths == ["dir1/file3.txt", "file1.txt"]
+
+    report = archive_file.verification_report()
+    assert report["missing"] == []
+    assert report["extra"] == []
+    assert report["corrupt"] == []
+    assert archive_file.verify_all()
+
+
+def test_persist_incremental_unchanged(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile, ArchiveFileBuilder
+
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+    archive_builder = ArchiveFileBuilder.from_path(dataset_path)
+    output_path = archive_builder.persist_incremental(
+        os.path.dirname(tmp_archive), tmp_archive)
+
+    archive_file = ArchiveFile.from_file(output_path)
+    assert archive_file.incremental["paths"] == []
+    assert len(archive_file.manifest["file_list"]) == 0
+    assert len(archive_file.dataset_manifest["file_list"]) == 2
+    assert archive_file.verify_all()
+
+
+def test_persist_incremental_other_dataset(tmp_archive):  # NOQA
+    import json
+    from arctool.archive import ArchiveFileBuilder
+
+    dataset_path = os.path.join(os.path.dirname(tmp_archive),
+                                "brassica_rnaseq_reads")
+    admin_path = os.path.join(dataset_path, ".dtool", "dtool")
+    with open(admin_path) as fh:
+        admin_metadata = json.load(fh)
+    admin_metadata["uuid"] = str(uuid.uuid4())
+    with open(admin_path, "w") as fh:
+        json.dump(admin_metadata, fh)
+
+    archive_builder = ArchiveFileBuilder.from_path(dataset_path)
+    with pytest.raises(ValueError):
+        archive_builder.persist_incremental(
+            os.path.dirname(tmp_archive), tmp_archive)
@@ -0,0 +1,167 @@
+"""Test the index module API."""
+
+import os
+import io
+import zlib
+import gzip
+import random
+import tarfile
+
+import pytest
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def _create_tar(path):
+    random.seed(0)
+    with tarfile.open(path, "w") as tar:
+        for i in range(20):
+            block = bytes(bytearray(random.getrandbits(8) for _ in range(500)))
+            data = block * random.randint(100, 400)
+            tarinfo = tarfile.TarInfo("my_archive/archive/file_{}".format(i))
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def _pigz_like_compress(data, block_size=131072):
+    """Return gzip data with a sync flush between blocks, like pigz."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    output = []
+    for i in range(0, len(data), block_size):
+        output.append(compressor.compress(data[i:i + block_size]))
+        output.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+    output.append(compressor.flush())
+    return b"".join(output)
+
+
+def _multi_member_compress(data, block_size=300000):
+    compressed = []
+    for i in range(0, len(data), block_size):
+        fh = io.BytesIO()
+        with gzip.GzipFile(fileobj=fh, mode="wb") as gz:
+            gz.write(data[i:i + block_size])
+        compressed.append(fh.getvalue())
+    return b"".join(compressed)
+
+
+def _assert_members_readable(path, index, tar_data):
+    from arctool.index import open_member
+
+    for entry in index["members"]:
+        start = entry["offset_data"]
+        expected = tar_data[start:start + entry["size"]]
+        with open_member(path, index, entry) as fh:
+            assert fh.read(1000) + fh.read() == expected
+
+
+def test_index_path():
+    from arctool.index import index_path
+    assert index_path("/tmp/my_archive.tar.gz") == "/tmp/my_archive.tar.gz.idx"
+
+
+def test_build_index_tar(tmp_dir_fixture):  # NOQA
+    from arctool.index import build_index
+
+    tar_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    tar_data = _create_tar(tar_path)
+
+    index = build_index(tar_path)
+
+    assert index["archive_size"] == len(tar_data)
+    assert len(index["members"]) == 20
+    assert index["members"][0]["path"] == "my_archive/archive/file_0"
+    assert index["seek_points"] == []
+    _assert_members_readable(tar_path, index, tar_data)
+
+
+@pytest.mark.parametrize("compress", [
+    _pigz_like_compress,
+    _multi_member_compress,
+])
+def test_build_index_tar_gz(tmp_dir_fixture, compress):  # NOQA
+    from arctool.index import build_index
+
+    tar_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    tar_data = _create_tar(tar_path)
+    gz_path = tar_path + ".gz"
+    with open(gz_path, "wb") as fh:
+        fh.write(compress(tar_data))
+
+    index = build_index(gz_path, span=500000)
+
+    assert len(index["members"]) == 20
+    assert len(index["seek_points"]) > 1
+    _assert_members_readable(gz_path, index, tar_data)
+
+
+def test_open_from(tmp_dir_fixture):  # NOQA
+    from arctool.index import build_index, open_from
+
+    tar_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    tar_data = _create_tar(tar_path)
+    gz_path = tar_path + ".gz"
+    with open(gz_path, "wb") as fh:
+        fh.write(_multi_member_compress(tar_data))
+
+    index = build_index(gz_path, span=500000)
+    offset = index["members"][10]["offset"]
+
+    with open_from(gz_path, index, offset) as fh:
+        assert fh.read(1000) + fh.read() == tar_data[offset:]
+
+    with open_from(gz_path, index, offset) as fh:
+        with tarfile.open(fileobj=fh, mode="r|") as tar:
+            names = [member.name for member in tar]
+    assert names == [entry["path"] for entry in index["members"][10:]]
+
+
+def test_read_index(tmp_dir_fixture):  # NOQA
+    from arctool.index import build_index, read_index, write_index
+
+    tar_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    _create_tar(tar_path)
+
+    assert read_index(tar_path) is None
+
+    index = build_index(tar_path)
+    write_index(tar_path, index)
+    assert read_index(tar_path) == index
+
+    # An index that does not match the archive is ignored.
+    with open(tar_path, "ab") as fh:
+        fh.write(b"\0" * 512)
+    assert read_index(tar_path) is None
+
+    # Nor is one for an archive rebuilt with the same size.
+    index = build_index(tar_path)
+    write_index(tar_path, index)
+    with open(tar_path, "r+b") as fh:
+        fh.seek(-512, os.SEEK_END)
+        fh.write(b"\1" * 512)
+    assert read_index(tar_path) is None
+
+
+def test_stale_member_offsets(tmp_dir_fixture):  # NOQA
+    from arctool.index import (
+        IndexMismatchError,
+        build_index,
+        open_from,
+        open_member,
+    )
+
+    tar_path = os.path.join(tmp_dir_fixture, "my_archive.tar")
+    _create_tar(tar_path)
+    index = build_index(tar_path)
+    # Offsets of an earlier build of the archive, with another file first.
+    offsets = [(entry["offset"], entry["offset_data"])
+               for entry in index["members"]]
+    index["members"] = index["members"][1:]
+    for entry, (offset, offset_data) in zip(index["members"], offsets):
+        entry["offset"], entry["offset_data"] = offset, offset_data
+
+    with pytest.raises(IndexMismatchError):
+        open_member(tar_path, index, index["members"][0])
+    with pytest.raises(IndexMismatchError):
+        open_from(tar_path, index, index["members"][0]["offset"])
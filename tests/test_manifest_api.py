@@ -0,0 +1,198 @@
+"""Test the manifest module."""
+
+import os
+
+import pytest
+
+from . import tmp_archive  # NOQA
+from . import tmp_dir_fixture  # NOQA
+
+
+def _manifest():
+    return {
+        "dtool_version": "0.13.0",
+        "hash_function": "shasum",
+        "file_list": [
+            {"path": "a.txt",
+             "hash": "a" * 40,
+             "size": 10,
+             "mtime": 1496672417.5,
+             "mimetype": "text/plain",
+             "inode": 12},
+            {"path": u"dir/b\xe9.txt",
+             "hash": "not-a-hash",
+             "size": 0,
+             "mtime": 1496672418.0,
+             "mimetype": "text/plain"},
+            {"path": "c.bin",
+             "hash": "0" * 40,
+             "size": 2 ** 40,
+             "colour": "red"},
+        ],
+    }
+
+
+def test_roundtrip():
+    from arctool.manifest import CompactManifest
+
+    manifest = _manifest()
+    compact = CompactManifest.from_dict(manifest)
+
+    assert compact["hash_function"] == "shasum"
+    assert len(compact["file_list"]) == 3
+    assert list(compact["file_list"]) == manifest["file_list"]
+    assert compact["file_list"][-1] == manifest["file_list"][-1]
+    assert compact["file_list"][1:] == manifest["file_list"][1:]
+    assert compact.to_dict() == manifest
+    assert compact.total_size() == 10 + 2 ** 40
+
+
+def test_manifest_size():
+    from arctool.manifest import CompactManifest, manifest_size
+
+    manifest = _manifest()
+    assert manifest_size(manifest) == 10 + 2 ** 40
+    assert manifest_size(CompactManifest.from_dict(manifest)) == 10 + 2 ** 40
+
+
+def test_entries_are_copies():
+    from arctool.manifest import CompactManifest
+
+    compact = CompactManifest.from_dict(_manifest())
+    compact["file_list"][0]["hash"] = "nonsense"
+    assert compact["file_list"][0]["hash"] == "a" * 40
+
+
+def test_entries_by_path_and_select():
+    from arctool.manifest import CompactManifest
+
+    manifest = _manifest()
+    compact = CompactManifest.from_dict(manifest)
+
+    entries = compact.entries_by_path()
+    assert "c.bin" in entries
+    assert "missing.txt" not in entries
+    assert entries["c.bin"] == manifest["file_list"][2]
+    assert sorted(entries) == sorted(e["path"] for e in manifest["file_list"])
+    with pytest.raises(KeyError):
+        entries["missing.txt"]
+
+    selected = compact.select(set(["a.txt", "c.bin"]))
+    assert selected["hash_function"] == "shasum"
+    assert [e["path"] for e in selected["file_list"]] == ["a.txt", "c.bin"]
+
+
+def test_write_and_read(tmp_dir_fixture):  # NOQA
+    from arctool.manifest import (
+        CompactManifest,
+        read_compact_manifest,
+        write_compact_manifest,
+    )
+
+    manifest = _manifest()
+    source = {"uuid": "1234", "size": 100, "mtime": 1}
+    path = os.path.join(tmp_dir_fixture, "manifest.bin")
+    write_compact_manifest(path, CompactManifest.from_dict(manifest, source))
+
+    compact = read_compact_manifest(path)
+    assert compact.source == source
+    assert compact.to_dict() == manifest
+    assert compact.entries_by_path()[u"dir/b\xe9.txt"]["size"] == 0
+    assert compact.total_size() == 10 + 2 ** 40
+
+    with open(path, "wb") as fh:
+        fh.write(b"nonsense")
+    with pytest.raises(ValueError):
+        read_compact_manifest(path)
+
+
+def test_archive_uses_compact_manifest(tmp_archive):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.manifest import (
+        CompactManifest,
+        compact_manifest_path,
+        write_compact_manifest,
+    )
+
+    # The manifest is a dictionary unless asked for in compact form.
+    manifest = ArchiveFile.from_file(tmp_archive).manifest
+    assert isinstance(manifest, dict)
+
+    archive_file = ArchiveFile.from_file(tmp_archive, compact=True)
+    manifest = archive_file.manifest
+    assert isinstance(manifest, CompactManifest)
+    assert manifest.to_dict() == \
+        ArchiveFile.from_file(tmp_archive).manifest
+
+    path = compact_manifest_path(tmp_archive)
+    write_compact_manifest(path, manifest)
+    archive_file = ArchiveFile.from_file(tmp_archive, compact=True)
+    assert archive_file.manifest.to_dict() == manifest.to_dict()
+    assert archive_file.verify_all()
+    assert ArchiveFile.from_file(tmp_archive).manifest == manifest.to_dict()
+
+    # A companion written from another manifest is ignored.
+    stale = manifest.to_dict()
+    stale["file_list"] = stale["file_list"][:1]
+    write_compact_manifest(
+        path, CompactManifest.from_dict(stale, dict(manifest.source, size=1)))
+    archive_file = ArchiveFile.from_file(tmp_archive, compact=True)
+    assert archive_file.manifest.to_dict() == manifest.to_dict()
+
+
+def test_verification_report_compact(tmp_archive, mocker):  # NOQA
+    from arctool.archive import ArchiveFile
+    from arctool.manifest import CompactManifest
+
+    entries_by_path = mocker.spy(CompactManifest, "entries_by_path")
+    to_dict = mocker.spy(CompactManifest, "to_dict")
+
+    archive_file = ArchiveFile.from_file(tmp_archive, compact=True)
+    for n_workers in (1, 2):
+        report = archive_file.verification_report(n_workers=n_workers)
+        assert report["corrupt"] == []
+        assert report["missing"] == []
+        assert report["extra"] == []
+
+    # The hashes are looked up in the compact manifest, not copied out.
+    assert entries_by_path.call_count == 2
+    assert to_dict.call_count == 0
+
+
+def test_iter_manifest_entries():
+    import io
+    import json
+    from arctool.manifest import iter_manifest_entries
+
+    manifest = _manifest()
+    manifest["after"] = [1, {"x": None}]
+    data = json.dumps(manifest, indent=2).encode("utf-8")
+
+    # Reads smaller than an entry split values, numbers and characters.
+    for read_size in (1, 7, 1024):
+        header = {}
+        entries = list(iter_manifest_entries(io.BytesIO(data), header,
+                                             read_size=read_size))
+        assert entries == manifest["file_list"]
+        assert header == dict((k, v) for k, v in manifest.items()
+                              if k != "file_list")
+
+    assert list(iter_manifest_entries(io.BytesIO(b'{"file_list": []}'))) == []
+
+    with pytest.raises(ValueError):
+        list(iter_manifest_entries(io.BytesIO(b'{"file_list": [{"path"')))
+    with pytest.raises(ValueError):
+        list(iter_manifest_entries(io.BytesIO(b'[]')))
+
+
+def test_read_manifest_stream():
+    import io
+    import json
+    from arctool.manifest import read_manifest_stream
+
+    manifest = _manifest()
+    data = json.dumps(manifest).encode("utf-8")
+    compact = read_manifest_stream(io.BytesIO(data), source={"size": 1},
+                                   read_size=16)
+    assert compact.to_dict() == manifest
+    assert compact.source == {"size": 1}
@@ -0,0 +1,36 @@
+"""Test the pipeline module API."""
+
+import io
+import hashlib
+
+import pytest
+
+
+def test_hashing_pipeline():
+    from arctool.pipeline import HashingPipeline
+
+    data = {"file_{}".format(i): (str(i) * i * 1000).encode("utf-8")
+            for i in range(20)}
+    items = [(key, io.BytesIO(value)) for key, value in sorted(data.items())]
+
+    pipeline = HashingPipeline(n_workers=3, queue_size=2, chunk_size=1000)
+    actual = dict(pipeline.run(items))
+
+    expected = {key: hashlib.sha1(value).hexdigest()
+                for key, value in data.items()}
+    assert actual == expected
+
+
+def test_hashing_pipeline_propagates_errors():
+    from arctool.pipeline import HashingPipeline
+
+    class BrokenHasher(object):
+        def update(self, buf):
+            raise ValueError("broken")
+
+    items = [("key_{}".format(i), io.BytesIO(b"x" * 100)) for i in range(10)]
+    pipeline = HashingPipeline(n_workers=2, chunk_size=10,
+                               hasher_factory=BrokenHasher)
+
+    with pytest.raises(ValueError):
+        list(pipeline.run(items))
@@ -0,0 +1,33 @@
+"""Test the progress module API."""
+
+
+def test_format_seconds():
+    from arctool.progress import format_seconds
+
+    assert format_seconds(0) == "0:00:00"
+    assert format_seconds(3725.5) == "1:02:05"
+
+
+def test_ProgressMeter():
+    from arctool.progress import ProgressMeter
+
+    updates = []
+
+    def on_update(meter, n_bytes):
+        updates.append((meter.current, n_bytes))
+
+    meter = ProgressMeter(total_bytes=100, on_update=on_update)
+    assert meter.eta is None
+
+    meter.update(10, 'file1.txt')
+    meter.update(30)
+    meter.finish()
+
+    assert updates == [('file1.txt', 10), ('file1.txt', 30)]
+    assert meter.n_bytes == 40
+    assert meter.eta is not None
+    assert 'file1.txt' in str(meter)
+
+    summary = meter.summary()
+    assert summary['n_bytes'] == 40
+    assert set(summary) == set(['n_bytes', 'seconds', 'mb_per_second'])
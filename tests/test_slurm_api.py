@@ -1,5 +1,9 @@
 """Test the slurm module API."""
 
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
 
 def test_generate_slurm_submission_script():
 
@@ -15,3 +19,105 @@ def test_generate_slurm_submission_script():
     expected = 'arctool archive compress -c 8 /tmp/staging/mytar.tar'
 
     assert expected == actual, (expected, actual)
+
+
+def test_generate_slurm_script_job_parameters():
+
+    from arctool.slurm import generate_slurm_script
+
+    job_parameters = {'n_cores': 2, 'partition': 'rg-sv',
+                      'walltime': '0-04:00', 'name': 'compress',
+                      'array': '0-3'}
+    script = generate_slurm_script("echo hello", job_parameters).split('\n')
+
+    assert '#SBATCH -t 0-04:00' in script
+    assert '#SBATCH -J compress' in script
+    assert '#SBATCH --array=0-3' in script
+    assert script[-1] == 'echo hello'
+
+    script = generate_slurm_script("echo hello", {'n_cores': 2,
+                                                  'partition': 'rg-sv'})
+    assert '#SBATCH -t 0-01:30' in script.split('\n')
+    assert '#SBATCH --array' not in script
+
+
+def test_format_walltime():
+
+    from arctool.slurm import format_walltime
+
+    assert format_walltime(59) == '0-00:01'
+    assert format_walltime(90 * 60) == '0-01:30'
+    assert format_walltime(25 * 60 * 60 + 1) == '1-01:01'
+
+
+def test_size_job():
+
+    from arctool.slurm import size_job
+
+    # Small archives get a single core and the minimum walltime.
+    assert size_job('compress', 1000) == {'n_cores': 1,
+                                          'walltime': '0-00:15'}
+
+    # 1 TB at 20 MB/s per core needs 14 cores to finish in about an hour.
+    job = size_job('compress', 10 ** 12, mb_per_second=20)
+    assert job['n_cores'] == 14
+    assert job['walltime'] == '0-02:00'
+
+    job = size_job('compress', 10 ** 12, mb_per_second=20, max_cores=4)
+    assert job['n_cores'] == 4
+    assert job['walltime'] == '0-06:57'
+
+    job = size_job('verify', 10 ** 12, mb_per_second=100)
+    assert job['n_cores'] == 1
+    assert job['walltime'] == '0-05:34'
+
+
+def test_generate_pipeline_script(tmp_dir_fixture):  # NOQA
+
+    from arctool.archive import ArchiveDataSet
+    from arctool.slurm import generate_pipeline_script
+
+    from .test_batch_api import _create_project
+
+    _create_project(tmp_dir_fixture)
+    dataset_1 = ArchiveDataSet.from_path(
+        os.path.join(tmp_dir_fixture, "dataset_1"))
+    dataset_2 = ArchiveDataSet.from_path(
+        os.path.join(tmp_dir_fixture, "dataset_2"))
+
+    script = generate_pipeline_script([dataset_1], partition='nbi-long')
+    lines = script.split('\n')
+
+    assert lines[0] == '#!/bin/bash'
+    assert 'MANIFEST_JOB=$(sbatch --parsable <<\'END_OF_SCRIPT\'' in lines
+    assert 'TAR_JOB=$(sbatch --parsable --dependency=afterok:$MANIFEST_JOB ' \
+        '<<\'END_OF_SCRIPT\'' in lines
+    assert 'VERIFY_JOB=$(sbatch --parsable --dependency=afterok:' \
+        '$COMPRESS_JOB <<\'END_OF_SCRIPT\'' in lines
+    assert lines.count('#SBATCH -p nbi-long') == 4
+    assert '#SBATCH --array' not in script
+    tar_path = os.path.join(tmp_dir_fixture, "dataset_1.tar")
+    assert "arctool archive compress -c 1 '{}'".format(tar_path) in lines
+    assert "arctool verify full --resume '{}.gz'".format(tar_path) in lines
+
+    script = generate_pipeline_script([dataset_1, dataset_2])
+    lines = script.split('\n')
+
+    assert lines.count('#SBATCH --array=0-1') == 4
+    assert 'MANIFEST_JOB=$(sbatch --parsable <<\'END_OF_SCRIPT\'' in lines
+    assert 'TAR_JOB=$(sbatch --parsable --dependency=aftercorr:' \
+        '$MANIFEST_JOB <<\'END_OF_SCRIPT\'' in lines
+    assert 'VERIFY_JOB=$(sbatch --parsable --dependency=aftercorr:' \
+        '$COMPRESS_JOB <<\'END_OF_SCRIPT\'' in lines
+    assert 'afterok' not in script
+    assert "DATASETS=('{}' '{}')".format(
+        dataset_1._abs_path.rstrip(os.sep),
+        dataset_2._abs_path.rstrip(os.sep)) in lines
+    assert 'arctool archive create --resume ' \
+        '"${DATASETS[$SLURM_ARRAY_TASK_ID]}"' in lines
+
+    script = generate_pipeline_script([dataset_1, dataset_2], index_span=16,
+                                      blocked=True, block_size=8)
+    assert 'arctool archive compress -c 1 --index-span 16 --blocked ' \
+        '--block-size 8 "${ARCHIVES[$SLURM_ARRAY_TASK_ID]}"' \
+        in script.split('\n')
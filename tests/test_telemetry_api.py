@@ -0,0 +1,141 @@
+"""Test the arctool.telemetry module API."""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def _unused_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_summarise_manifest():
+    from arctool.telemetry import summarise_manifest
+
+    manifest = {"hash_function": "shasum",
+                "file_list": [{"path": "a", "size": 3, "hash": "x"},
+                              {"path": "b", "size": 4, "hash": "y"}]}
+    summary = summarise_manifest(manifest)
+
+    assert summary["n_files"] == 2
+    assert summary["total_size"] == 7
+    assert summary["hash_function"] == "shasum"
+    assert len(summary["manifest_hash"]) == 40
+
+    manifest["file_list"][1]["hash"] = "z"
+    assert summarise_manifest(manifest)["manifest_hash"] \
+        != summary["manifest_hash"]
+
+
+def test_TelemetrySender_spools_when_unreachable(tmp_dir_fixture):  # NOQA
+    from arctool.telemetry import TelemetrySender
+
+    spool = os.path.join(tmp_dir_fixture, "spool.jsonl")
+    sender = TelemetrySender(host="127.0.0.1", port=_unused_port(),
+                             spool=spool)
+
+    start = time.time()
+    for i in range(5):
+        sender.emit("test_event", {"i": i})
+    assert time.time() - start < 0.5
+    sender.close()
+
+    with open(spool) as fh:
+        records = [json.loads(line) for line in fh]
+    assert [r["data"]["i"] for r in records] == list(range(5))
+    assert records[0]["label"] == "test_event"
+
+
+def test_TelemetrySender_spools_event_in_flight(tmp_dir_fixture):  # NOQA
+    from arctool.telemetry import TelemetrySender
+
+    spool = os.path.join(tmp_dir_fixture, "spool.jsonl")
+    sender = TelemetrySender(spool=spool)
+
+    sending = threading.Event()
+
+    def slow_send(record):
+        sending.set()
+        time.sleep(0.5)
+        return False
+    sender._send = slow_send
+
+    sender.emit("test_event", {"i": 0})
+    sending.wait(1.0)
+    sender.close(timeout=0.1)
+
+    with open(spool) as fh:
+        assert [json.loads(line)["data"] for line in fh] == [{"i": 0}]
+
+    # Spooled once, not again when the send gives up.
+    sender._thread.join(1.0)
+    with open(spool) as fh:
+        assert len(fh.readlines()) == 1
+
+
+def test_TelemetrySender_replays_spool(tmp_dir_fixture):  # NOQA
+    import msgpack
+    from arctool.telemetry import TelemetrySender
+
+    spool = os.path.join(tmp_dir_fixture, "spool.jsonl")
+    with open(spool, "w") as fh:
+        fh.write(json.dumps({"label": "old_event", "time": 0,
+                             "data": {"i": 0}}) + "\n")
+
+    # Left by a process that exited while replaying the spool.
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    orphaned = "{}.{}".format(spool, exited.pid)
+    with open(orphaned, "w") as fh:
+        fh.write(json.dumps({"label": "orphaned_event", "time": 0,
+                             "data": {"i": 2}}) + "\n")
+    # Being replayed by a running process.
+    replaying = "{}.{}".format(spool, os.getppid())
+    with open(replaying, "w") as fh:
+        fh.write(json.dumps({"label": "replaying_event", "time": 0,
+                             "data": {"i": 3}}) + "\n")
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    received = []
+
+    def serve():
+        connection, _ = server.accept()
+        unpacker = msgpack.Unpacker(raw=False)
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            unpacker.feed(data)
+            received.extend(unpacker)
+        connection.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    sender = TelemetrySender(host="127.0.0.1",
+                             port=server.getsockname()[1], spool=spool)
+    sender.emit("new_event", {"i": 1})
+    sender.close()
+    sender._sender.close()
+    thread.join(5)
+    server.close()
+
+    assert [tag for tag, _, _ in received] == ["arctool.new_event",
+                                               "arctool.old_event",
+                                               "arctool.orphaned_event"]
+    assert not os.path.exists(spool)
+    assert not os.path.exists(orphaned)
+    assert os.path.exists(replaying)